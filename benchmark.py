@@ -0,0 +1,68 @@
+# python benchmark.py --ckpt logs/pretrain/version_0/ckpts/last.ckpt --frames 64
+import time
+import argparse
+
+import torch
+
+from signbert.model.PretrainSignBertModelManoTorch import SignBertModel
+
+
+def measure_latency(model, inputs, warmup, repeats):
+    """
+    Measure the latency of the model encoder.
+
+    Parameters:
+    model (SignBertModel): The pre-trained model.
+    inputs (tuple): Arms, right hand and left hand keypoints.
+    warmup (int): Number of calls not taken into account.
+    repeats (int): Number of timed calls.
+
+    Returns:
+    Tensor: (repeats,) latencies in milliseconds.
+    """
+    latencies = []
+    with torch.inference_mode():
+        for i in range(warmup + repeats):
+            start = time.perf_counter()
+            model.encode(*inputs)
+            if model.device.type == "cuda":
+                torch.cuda.synchronize()
+            if i >= warmup:
+                latencies.append((time.perf_counter() - start) * 1e3)
+
+    return torch.tensor(latencies)
+
+def main(args):
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+    device = torch.device(args.device)
+    model = SignBertModel.load_from_checkpoint(args.ckpt, map_location=device)
+    model.eval()
+    # Single request inputs
+    N, T = args.batch_size, args.frames
+    inputs = (
+        torch.rand((N, T, 6, 2), device=device),
+        torch.rand((N, T, 21, 2), device=device),
+        torch.rand((N, T, 21, 2), device=device),
+    )
+    for parallel_branches in (False, True):
+        model.parallel_branches = parallel_branches
+        latencies = measure_latency(model, inputs, args.warmup, args.repeats)
+        print(
+            f"parallel_branches={parallel_branches}: "
+            f"median {latencies.median():.2f} ms, "
+            f"p90 {latencies.quantile(0.9):.2f} ms"
+        )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ckpt", required=True, type=str)
+    parser.add_argument("--device", default="cpu", type=str)
+    parser.add_argument("--batch_size", default=1, type=int)
+    parser.add_argument("--frames", default=64, type=int)
+    parser.add_argument("--threads", default=None, type=int)
+    parser.add_argument("--warmup", default=5, type=int)
+    parser.add_argument("--repeats", default=50, type=int)
+    args = parser.parse_args()
+
+    main(args)
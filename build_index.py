@@ -0,0 +1,106 @@
+# python build_index.py --embeddings embeddings_out --out embeddings_out/index_flat --kind flat
+# python build_index.py --embeddings embeddings_out --out embeddings_out/index_ivfpq --kind ivfpq --nlist 4096 --m 32 --reference embeddings_out/index_flat
+import os
+import time
+import argparse
+
+import numpy as np
+
+from signbert.retrieval.FlatIndex import FlatIndex
+from signbert.retrieval.IVFPQIndex import IVFPQIndex
+
+
+# Written by extract.py
+IDS_FNAME = "ids.txt"
+OUTPUTS_FNAME = "outputs.npy"
+
+
+def measure_latency(index, queries, k, search_args):
+    """
+    Measure the latency of single queries.
+
+    Parameters:
+    index (FlatIndex or IVFPQIndex): The index.
+    queries (numpy.ndarray): (Q, D) queries, searched one at a time.
+    k (int): The number of neighbours.
+    search_args (dict): Extra `search` arguments, e.g. `nprobe`.
+
+    Returns:
+    numpy.ndarray: (Q,) latencies in milliseconds.
+    """
+    latencies = []
+    for q in queries:
+        start = time.perf_counter()
+        index.search(q, k=k, **search_args)
+        latencies.append((time.perf_counter() - start) * 1e3)
+
+    return np.array(latencies)
+
+def recall_at_k(expected, found):
+    """Fraction of the exact neighbours that were found, averaged over queries."""
+    k = expected.shape[1]
+
+    return float(np.mean([len(set(e) & set(f)) / k for e, f in zip(expected, found)]))
+
+def main(args):
+    # Rows follow ids.txt, index ids are row indices
+    vectors = np.load(os.path.join(args.embeddings, OUTPUTS_FNAME), mmap_mode="r")
+    print(f"{len(vectors)} vectors of {vectors.shape[1]} dimensions")
+    start = time.perf_counter()
+    if args.kind == "flat":
+        index = FlatIndex.build(vectors, args.out, metric=args.metric, normalize=not args.no_normalize, dtype=args.dtype)
+        search_args = {}
+    else:
+        index = IVFPQIndex.build(
+            vectors,
+            args.out,
+            nlist=args.nlist,
+            m=args.m,
+            metric=args.metric,
+            normalize=not args.no_normalize,
+            train_size=args.train_size,
+            niter=args.niter,
+            seed=args.seed
+        )
+        search_args = dict(nprobe=args.nprobe)
+    print(f"{args.kind} index written to {args.out} in {time.perf_counter() - start:.1f} s")
+    if args.num_queries == 0:
+        return
+    # Stored vectors are used as queries
+    rng = np.random.default_rng(args.seed)
+    query_idxs = np.sort(rng.choice(len(vectors), min(args.num_queries, len(vectors)), replace=False))
+    queries = np.asarray(vectors[query_idxs], dtype=np.float32)
+    latencies = measure_latency(index, queries, args.k, search_args)
+    p50, p99 = np.percentile(latencies, (50, 99))
+    print(f"Single query top-{args.k}: p50 {p50:.2f} ms, p99 {p99:.2f} ms")
+    start = time.perf_counter()
+    _, found = index.search(queries, k=args.k, **search_args)
+    print(f"Batch of {len(queries)} queries: {(time.perf_counter() - start) * 1e3:.1f} ms")
+    with open(os.path.join(args.embeddings, IDS_FNAME), "r") as fid:
+        fpaths = fid.read().splitlines()
+    print(f"Neighbours of {fpaths[query_idxs[0]]}: {[fpaths[i] for i in found[0] if i >= 0]}")
+    if args.reference is not None:
+        # Exact neighbours, from a flat index of the same vectors
+        _, expected = FlatIndex(args.reference).search(queries, k=args.k)
+        print(f"Recall@{args.k} against exact search: {recall_at_k(expected, found):.3f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--embeddings", required=True, type=str, help="Output directory of extract.py --embed")
+    parser.add_argument("--out", required=True, type=str, help="Index directory")
+    parser.add_argument("--kind", default="ivfpq", type=str, choices=["flat", "ivfpq"])
+    parser.add_argument("--metric", default="ip", type=str, choices=["ip", "l2"])
+    parser.add_argument("--no-normalize", action="store_true", help="Do not L2-normalize vectors, ip is then not a cosine similarity")
+    parser.add_argument("--dtype", default="float32", type=str, choices=["float32", "float16"], help="Flat index storage dtype")
+    parser.add_argument("--nlist", default=1024, type=int, help="IVF-PQ inverted lists")
+    parser.add_argument("--m", default=32, type=int, help="IVF-PQ bytes per vector")
+    parser.add_argument("--nprobe", default=16, type=int, help="IVF-PQ lists scanned per query")
+    parser.add_argument("--train-size", default=100000, type=int)
+    parser.add_argument("--niter", default=20, type=int)
+    parser.add_argument("--k", default=10, type=int)
+    parser.add_argument("--num-queries", default=200, type=int, help="Benchmark queries, 0 to skip the benchmark")
+    parser.add_argument("--reference", default=None, type=str, help="Flat index of the same vectors, to measure the recall")
+    parser.add_argument("--seed", default=0, type=int)
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,81 @@
+# python check_import_time.py --budget-ms 4000
+import os
+import re
+import sys
+import argparse
+import subprocess
+
+
+# Imports of the training entry points, `torch` and `lightning` are expected
+ENTRY_POINTS = (
+    "from signbert.model.PretrainSignBertModelManoTorch import SignBertModel",
+    "from signbert.data_modules.PretrainDataModule import PretrainDataModule",
+)
+# Dependencies only some code paths need, they must be imported where used
+HEAVY_MODULES = ("IPython", "pandas", "manotorch", "pytorch3d")
+
+
+def import_profile(statement):
+    """
+    Profile an import statement in a fresh interpreter.
+
+    Parameters:
+    statement (str): The import statement, e.g. "from a.b import C".
+
+    Returns:
+    tuple: The import time of the statement in microseconds and the names of
+    all the modules it imported.
+    """
+    def run(code):
+        # A fresh interpreter, so nothing is already imported
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", code],
+            # From the repository root, so `signbert` is importable
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True
+        )
+        # Lines look like "import time: self [us] | cumulative | imported package",
+        # the package name is indented by its nesting depth
+        imports = []
+        for line in proc.stderr.splitlines():
+            match = re.match(r"import time:\s*\d+\s*\|\s*(\d+)\s*\|( *)(\S+)\s*$", line)
+            if match:
+                imports.append((match.group(3), len(match.group(2)) <= 1, int(match.group(1))))
+        return imports
+
+    # Modules imported by the interpreter startup are not part of the statement
+    startup = {name for name, _, _ in run("pass")}
+    imports = [i for i in run(statement) if i[0] not in startup]
+    # Top level imports, their cumulative times include the nested ones
+    total_us = sum(cumulative for _, top_level, cumulative in imports if top_level)
+
+    return total_us, {name for name, _, _ in imports}
+
+def main(args):
+    failed = False
+    for statement in args.statements:
+        # Best of several runs, to filter out disk cache effects
+        profiles = [import_profile(statement) for _ in range(args.runs)]
+        elapsed_ms = min(total_us for total_us, _ in profiles) / 1000
+        heavy = sorted(
+            name for name in profiles[0][1]
+            if name.split(".")[0] in args.heavy_modules
+        )
+        status = "OK" if elapsed_ms <= args.budget_ms else "OVER BUDGET"
+        print(f"{statement}: {elapsed_ms:.1f} ms (budget {args.budget_ms:.1f} ms) {status}")
+        if heavy:
+            print(f"  imports {', '.join(heavy)}")
+        failed |= elapsed_ms > args.budget_ms or bool(heavy)
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--statements", nargs="+", default=list(ENTRY_POINTS), type=str)
+    parser.add_argument("--heavy-modules", nargs="*", default=list(HEAVY_MODULES), type=str)
+    parser.add_argument("--budget-ms", default=4000., type=float)
+    parser.add_argument("--runs", default=3, type=int)
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,71 @@
+# python export.py --ckpt logs/pretrain/version_0/ckpts/last.ckpt --out logs/pretrain/version_0/backbone.pt
+# python export.py --kind islr --ckpt finetune_logs/test/version_0/ckpts/last.ckpt --base-ckpt logs/pretrain/version_0/backbone.pt --config finetune/configs/ISLR_MSASL.yml --out finetune_logs/test/version_0/islr
+# python export.py --kind joints --ckpt logs/pretrain/version_0/ckpts/last.ckpt --out logs/pretrain/version_0/joints
+import argparse
+
+import yaml
+
+from signbert.model.PretrainSignBertModelManoTorch import SignBertModel
+from signbert.model.Backbone import Backbone
+from signbert.model import graph_export
+
+
+def build_graph(args):
+    """Build the eager graph to export, see `graph_export`."""
+    if args.kind == "islr":
+        from finetune.SignBERTModel import SignBertModel as FinetunedModel
+
+        with open(args.config, "r") as fid:
+            head_args = yaml.load(fid, yaml.SafeLoader)["head_args"]
+        model = FinetunedModel.load_from_checkpoint(
+            args.ckpt,
+            map_location="cpu",
+            ckpt=args.base_ckpt,
+            lr=0.,
+            head_args=head_args
+        )
+        return graph_export.ISLRGraph(model.model, model.head).eval()
+    model = SignBertModel.load_from_checkpoint(args.ckpt, map_location="cpu")
+
+    return graph_export.JointsGraph(model).eval()
+
+def main(args):
+    if args.kind == "backbone":
+        # Load the whole pre-training model once, MANO layers included
+        model = SignBertModel.load_from_checkpoint(args.ckpt, map_location="cpu")
+        # Keep only the inference modules and a compact config
+        Backbone.export(model, args.out)
+        print(f"Backbone exported to {args.out}")
+        return
+    graph = build_graph(args)
+    inputs = graph_export.example_inputs(args.batch_size, args.frames)
+    ts_fpath = f"{args.out}.ts"
+    onnx_fpath = f"{args.out}.onnx"
+    graph_export.export_torchscript(graph, inputs, ts_fpath)
+    print(f"TorchScript graph exported to {ts_fpath}")
+    graph_export.export_onnx(graph, inputs, onnx_fpath, opset_version=args.opset)
+    print(f"ONNX graph exported to {onnx_fpath}")
+    if args.no_parity:
+        return
+    # Shapes other than the export one, so baked sizes are caught
+    shapes = [(1, args.frames // 2 + 1), (args.batch_size + 1, 2 * args.frames)]
+    results = graph_export.check_parity(graph, shapes, torchscript_fpath=ts_fpath, onnx_fpath=onnx_fpath)
+    for r in results:
+        print(f"{r['format']} (N={r['batch_size']}, T={r['num_frames']}): max abs. diff. {r['max_abs_diff']:.2e}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--kind", default="backbone", type=str, choices=["backbone", "islr", "joints"], help="backbone: inference weights, islr/joints: TorchScript and ONNX graphs")
+    parser.add_argument("--ckpt", required=True, type=str, help="Pre-training checkpoint, or finetuning checkpoint for islr")
+    parser.add_argument("--base-ckpt", default=None, type=str, help="Pre-trained model the finetuning started from, for islr")
+    parser.add_argument("--config", default=None, type=str, help="Finetuning config, for islr")
+    parser.add_argument("--out", required=True, type=str, help="Output file, or output path prefix for graphs")
+    parser.add_argument("--batch-size", default=2, type=int, help="Export example batch size")
+    parser.add_argument("--frames", default=32, type=int, help="Export example number of frames")
+    parser.add_argument("--opset", default=17, type=int)
+    parser.add_argument("--no-parity", action="store_true", help="Skip the parity checks against eager mode")
+    args = parser.parse_args()
+    if args.kind == "islr":
+        assert args.base_ckpt is not None and args.config is not None, "--base-ckpt and --config are required"
+
+    main(args)
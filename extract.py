@@ -0,0 +1,239 @@
+# python extract.py --kind backbone --ckpt logs/pretrain/version_0/backbone.pt --inputs /home/tmpvideos/SLR/MSASL/skeleton-data/rtmpose-l_8xb64-270e_coco-wholebody-256x192 --out extract_out --num-workers 4
+# python extract.py --kind finetuned --ckpt finetune_logs/test/version_0/ckpts/last.ckpt --base-ckpt logs/pretrain/version_0/backbone.pt --config finetune/configs/ISLR_MSASL.yml --inputs ... --out extract_out
+# python extract.py --kind finetuned --embed ... --out embeddings_out, then see build_index.py
+import os
+import json
+import glob
+import argparse
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+
+import yaml
+import torch
+import numpy as np
+from tqdm import tqdm
+
+from finetune.ISLR.InferenceModel import InferenceModel
+from signbert.utils import set_num_threads_per_process, bucket_length
+
+
+IDS_FNAME = "ids.txt"
+OUTPUTS_FNAME = "outputs.npy"
+BATCHES_FNAME = "batches.json"
+JOURNAL_FNAME = "journal.txt"
+META_FNAME = "meta.json"
+
+
+def list_skeleton_files(input_dpaths):
+    """
+    List the skeleton `.npy` files under some directories, recursively.
+
+    Parameters:
+    input_dpaths (list): The directories to search.
+
+    Returns:
+    list: The sorted file paths.
+    """
+    fpaths = []
+    for dpath in input_dpaths:
+        fpaths.extend(glob.glob(os.path.join(dpath, "**", "*.npy"), recursive=True))
+
+    return sorted(fpaths)
+
+def read_length(fpath):
+    """Read the number of frames of a skeleton file, from its header only."""
+    return np.load(fpath, mmap_mode="r").shape[0]
+
+def plan_batches(lengths, batch_size, max_frames, buckets):
+    """
+    Group files of the same length bucket into batches.
+
+    Files are sorted by length and consecutive files of a bucket are batched
+    until the batch holds `batch_size` files or its padded size exceeds
+    `max_frames`. Batches are padded to their bucket, so a file is padded to
+    the same length whatever the batch it falls in.
+
+    Parameters:
+    lengths (list): The number of frames of each file.
+    batch_size (int): The max. number of files per batch.
+    max_frames (int): The max. number of padded frames per batch.
+    buckets (list): Sequence length buckets.
+
+    Returns:
+    list: The batches, as lists of file indices.
+    """
+    order = sorted(range(len(lengths)), key=lambda i: (lengths[i], i))
+    batches = []
+    batch = []
+    for i in order:
+        padded_len = bucket_length(lengths[i], buckets)
+        new_bucket = batch and bucket_length(lengths[batch[0]], buckets) != padded_len
+        if batch and (new_bucket or len(batch) == batch_size or (len(batch) + 1) * padded_len > max_frames):
+            batches.append(batch)
+            batch = []
+        batch.append(i)
+    if batch:
+        batches.append(batch)
+
+    return batches
+
+def read_journal(journal_fpath):
+    """Read the indices of the batches already written."""
+    if not os.path.isfile(journal_fpath):
+        return set()
+    with open(journal_fpath, "r") as fid:
+        return {int(line) for line in fid if line.strip()}
+
+
+# Per-process state of the extraction workers
+_worker = {}
+
+
+def _init_worker(model_args, out_dpath, num_workers, num_threads, device, buckets):
+    """
+    Extraction process initializer: loads the model and opens the outputs.
+
+    Parameters:
+    model_args (dict): `InferenceModel.load` arguments.
+    out_dpath (str): The output directory.
+    num_workers (int): The number of extraction processes on the host.
+    num_threads (int): The number of file reading threads.
+    device (str): The device the model runs on.
+    buckets (list): Sequence length buckets batches are padded to.
+    """
+    set_num_threads_per_process(num_workers)
+    with open(os.path.join(out_dpath, IDS_FNAME), "r") as fid:
+        _worker["fpaths"] = fid.read().splitlines()
+    _worker["model"] = InferenceModel.load(**model_args).to(device)
+    _worker["device"] = device
+    _worker["buckets"] = buckets
+    _worker["outputs"] = np.load(os.path.join(out_dpath, OUTPUTS_FNAME), mmap_mode="r+")
+    _worker["reader"] = ThreadPoolExecutor(max_workers=num_threads)
+
+def _run_batch(batch_idx, idxs):
+    """
+    Run the model on a batch of files and write the outputs.
+
+    Parameters:
+    batch_idx (int): The batch index, returned once written.
+    idxs (list): The indices of the files of the batch.
+
+    Returns:
+    int: The batch index.
+    """
+    model = _worker["model"]
+    # Files are read and preprocessed concurrently
+    samples = list(_worker["reader"].map(
+        lambda i: model.preprocess(np.load(_worker["fpaths"][i])),
+        idxs
+    ))
+    batch = {k: v.to(_worker["device"]) for k, v in model.collate(samples, _worker["buckets"]).items()}
+    with torch.inference_mode():
+        outputs = model(batch["arms"], batch["rhand"], batch["lhand"], batch["lengths"])
+    _worker["outputs"][idxs] = outputs.float().cpu().numpy()
+    # Written to disk before the batch is journaled
+    _worker["outputs"].flush()
+
+    return batch_idx
+
+def prepare_outputs(args, model_args):
+    """
+    Create the output directory, or check the one of a run being resumed.
+
+    Returns:
+    list: The batches, as lists of file indices.
+    """
+    meta_fpath = os.path.join(args.out, META_FNAME)
+    meta = dict(
+        model_args=model_args,
+        inputs=args.inputs,
+        batch_size=args.batch_size,
+        max_frames=args.max_frames,
+        buckets=args.buckets
+    )
+    if os.path.isfile(meta_fpath):
+        with open(meta_fpath, "r") as fid:
+            assert json.load(fid) == meta, f"{args.out} holds the outputs of another extraction"
+        with open(os.path.join(args.out, BATCHES_FNAME), "r") as fid:
+            return json.load(fid)
+    os.makedirs(args.out, exist_ok=True)
+    fpaths = list_skeleton_files(args.inputs)
+    with open(os.path.join(args.out, IDS_FNAME), "w") as fid:
+        fid.write("\n".join(fpaths))
+    # Lengths only need the files headers
+    with ThreadPoolExecutor(max_workers=args.num_threads) as reader:
+        lengths = list(tqdm(reader.map(read_length, fpaths), total=len(fpaths), desc="Reading lengths"))
+    batches = plan_batches(lengths, args.batch_size, args.max_frames, args.buckets)
+    with open(os.path.join(args.out, BATCHES_FNAME), "w") as fid:
+        json.dump(batches, fid)
+    # The output dimension is only known from the model
+    output_dim = InferenceModel.load(**model_args).output_dim
+    outputs = np.lib.format.open_memmap(
+        os.path.join(args.out, OUTPUTS_FNAME),
+        mode="w+",
+        dtype=np.float32,
+        shape=(len(fpaths), output_dim)
+    )
+    del outputs
+    # Written last, its presence marks an initialized output directory
+    with open(meta_fpath, "w") as fid:
+        json.dump(meta, fid)
+
+    return batches
+
+def main(args):
+    head_args = None
+    if args.config is not None:
+        with open(args.config, "r") as fid:
+            head_args = yaml.load(fid, yaml.SafeLoader)["head_args"]
+    model_args = dict(
+        kind=args.kind,
+        ckpt=args.ckpt,
+        base_ckpt=args.base_ckpt,
+        head_args=head_args,
+        normalize=not args.no_normalize,
+        embed=args.embed,
+        window_size=args.window_size,
+        overlap=args.overlap
+    )
+    batches = prepare_outputs(args, model_args)
+    journal_fpath = os.path.join(args.out, JOURNAL_FNAME)
+    done = read_journal(journal_fpath)
+    todo = [i for i in range(len(batches)) if i not in done]
+    print(f"{len(batches)} batches, {len(done)} already extracted")
+    executor = ProcessPoolExecutor(
+        max_workers=args.num_workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(model_args, args.out, args.num_workers, args.num_threads, args.device, args.buckets)
+    )
+    with executor, open(journal_fpath, "a") as journal:
+        futures = [executor.submit(_run_batch, i, batches[i]) for i in todo]
+        for future in tqdm(as_completed(futures), total=len(futures), desc="Extracting"):
+            journal.write(f"{future.result()}\n")
+            journal.flush()
+    print(f"Outputs written to {os.path.join(args.out, OUTPUTS_FNAME)}, rows follow {IDS_FNAME}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--kind", required=True, type=str, choices=["finetuned", "backbone"])
+    parser.add_argument("--ckpt", required=True, type=str)
+    parser.add_argument("--base-ckpt", default=None, type=str, help="Pre-trained model the finetuning started from")
+    parser.add_argument("--config", default=None, type=str, help="Finetuning config, for the head arguments")
+    parser.add_argument("--inputs", required=True, nargs="+", type=str, help="Directories of skeleton .npy files")
+    parser.add_argument("--out", required=True, type=str)
+    parser.add_argument("--batch-size", default=32, type=int)
+    parser.add_argument("--max-frames", default=16384, type=int, help="Max. padded frames per batch")
+    parser.add_argument("--buckets", default=[32, 64, 128, 256, 512], nargs="+", type=int, help="Sequence length buckets files are padded to")
+    parser.add_argument("--num-workers", default=1, type=int, help="Extraction processes")
+    parser.add_argument("--num-threads", default=8, type=int, help="File reading threads per process")
+    parser.add_argument("--device", default="cpu", type=str)
+    parser.add_argument("--no-normalize", action="store_true")
+    parser.add_argument("--embed", action="store_true", help="Output the head pooled vector instead of logits, for finetuned models")
+    parser.add_argument("--window-size", default=None, type=int, help="Encode long sequences with overlapping windows of this many frames")
+    parser.add_argument("--overlap", default=100, type=int, help="Frames shared by consecutive windows")
+    args = parser.parse_args()
+    if args.kind == "finetuned":
+        assert args.base_ckpt is not None and args.config is not None, "--base-ckpt and --config are required"
+
+    main(args)
@@ -8,9 +8,10 @@ from lightning.pytorch import loggers as pl_loggers
 from lightning.pytorch.callbacks import ModelCheckpoint
 
 from finetune.ISLR.MSASLDataModule import MSASLDataModule
+from finetune.ISLR.FeatureCache import FeatureCacheDataModule
 from finetune.SignBERTModel import SignBertModel
+from signbert.utils import get_trainer_config
 
-from IPython import embed;
 
 class Config:
     """Stores configuration parameters"""
@@ -35,7 +36,22 @@ def main(args):
         **config.datamodule_args
     )
     # Instantiate the model with checkpoint, learning rate, and head arguments
-    model = SignBertModel(ckpt=config.ckpt, lr=config.lr, head_args=config.head_args)
+    model = SignBertModel(
+        ckpt=config.ckpt, 
+        lr=config.lr, 
+        head_args=config.head_args,
+        parallel_branches=getattr(config, "parallel_branches", False)
+    )
+    # Train the head from features of the frozen backbone, computed only once
+    feature_cache = getattr(config, "feature_cache", None)
+    if feature_cache is not None:
+        datamodule = FeatureCacheDataModule(
+            datamodule=datamodule,
+            model=model.model,
+            ckpt=config.ckpt,
+            batch_size=config.batch_size,
+            **feature_cache
+        )
     # Setup logging and checkpoint directories
     logs_dpath = os.path.join(os.getcwd(), "finetune_logs")
     tb_logger = pl_loggers.TensorBoardLogger(save_dir=logs_dpath, name=config.name)
@@ -50,10 +66,15 @@ def main(args):
         save_last=True
     )
     # Setup and configure the Trainer
-    trainer = Trainer(
-        accelerator="gpu",
-        strategy="auto",
+    # On CPU, several processes (per host) run data parallel over gloo
+    trainer_config = get_trainer_config(
+        accelerator=config.accelerator,
         devices=[config.device],
+        num_processes=config.num_processes,
+        num_nodes=config.num_nodes,
+    )
+    trainer = Trainer(
+        **trainer_config,
         max_epochs=config.epochs,
         logger=tb_logger,
         callbacks=[ckpt_cb],
@@ -70,6 +91,11 @@ if __name__ == "__main__":
     parser.add_argument("--device", default=0, type=int)
     parser.add_argument("--epochs", default=10, type=int)
     parser.add_argument("--name", default="test", type=str)
+    parser.add_argument("--accelerator", default="gpu", type=str, choices=["gpu", "cpu"])
+    parser.add_argument("--num-processes", default=1, type=int, help="Processes per host, CPU only")
+    parser.add_argument("--num-nodes", default=1, type=int)
+    # E.g. "bf16-mixed": MANO-free finetuning path, extractors, transformer 
+    # and head run in bfloat16 under autocast
     parser.add_argument("--precision", default="32-true", type=str)
     args = parser.parse_args()
 
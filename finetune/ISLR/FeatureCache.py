@@ -0,0 +1,241 @@
+import os
+import json
+
+import torch
+import numpy as np
+import lightning.pytorch as pl
+from tqdm import tqdm
+from torch.utils.data import Dataset, DataLoader
+from torch.nn.utils.rnn import pad_sequence
+
+
+FEATURES_FNAME = "features.bin"
+OFFSETS_FNAME = "offsets.npy"
+CLASS_IDS_FNAME = "class_ids.npy"
+META_FNAME = "meta.json"
+
+
+def cache_meta(dataset, ckpt=None, dtype="float32", split=None):
+    """
+    Describe what a cache is built from, so stale caches are detected.
+
+    Parameters:
+    dataset (MSASLDataset): The encoded dataset.
+    ckpt (str, optional): Checkpoint the model was loaded from.
+    dtype (str): The features storage dtype. Default is "float32".
+    split (str, optional): The dataset split, e.g. "train".
+
+    Returns:
+    dict: The checkpoint, dtype, keypoints normalization, split and number
+    of samples.
+    """
+    return dict(
+        ckpt=ckpt,
+        dtype=dtype,
+        normalize=bool(getattr(dataset, "normalize", False)),
+        split=split,
+        num_samples=len(dataset)
+    )
+
+def build_feature_cache(model, dataset, cache_dpath, ckpt=None, dtype="float32", device="cpu", split=None):
+    """
+    Run the frozen pre-trained backbone once over a dataset and store its features.
+
+    Per-frame right and left hand transformer outputs of all samples are
+    appended to a single flat file, which is read back memory-mapped. Samples
+    are encoded one at a time and unpadded, so features do not depend on
+    batching, whatever the positional encoding of the backbone.
+
+    Features then differ from the ones the other paths compute, which encode
+    padded batches: finetuning without a cache pads batches to their longest
+    sample without masking the padding, and `InferenceModel` (extract.py,
+    serve.py) pads to length buckets and masks the padding from the
+    attention, while the extractors still see it. A head trained on cached
+    features sees unpadded features only.
+
+    Parameters:
+    model (SignBertModel): The pre-trained base model, with an `encode` method.
+    dataset (MSASLDataset): The dataset to encode.
+    cache_dpath (str): Directory the cache is written to.
+    ckpt (str, optional): Checkpoint the model was loaded from, stored to
+    detect stale caches.
+    dtype (str): The features storage dtype. Default is "float32".
+    device (str): The device the backbone runs on. Default is "cpu".
+    split (str, optional): The dataset split, stored to detect stale caches.
+    """
+    os.makedirs(cache_dpath, exist_ok=True)
+    model = model.to(device).eval()
+    offsets = [0]
+    class_ids = []
+    with open(os.path.join(cache_dpath, FEATURES_FNAME), "wb") as fid, torch.inference_mode():
+        for i in tqdm(range(len(dataset)), desc=f"Caching features to {cache_dpath}"):
+            sample = dataset[i]
+            arms, rhand, lhand = [
+                torch.from_numpy(sample[k]).float().unsqueeze(0).to(device)
+                for k in ("arms", "rhand", "lhand")
+            ]
+            rhand, lhand = model.encode(arms, rhand, lhand)
+            # (T, 2, C) features, right hand first
+            features = torch.stack((rhand[0], lhand[0]), dim=1)
+            fid.write(features.cpu().numpy().astype(dtype).tobytes())
+            offsets.append(offsets[-1] + features.shape[0])
+            class_ids.append(sample["class_id"])
+    np.save(os.path.join(cache_dpath, OFFSETS_FNAME), np.array(offsets, dtype=np.int64))
+    np.save(os.path.join(cache_dpath, CLASS_IDS_FNAME), np.array(class_ids, dtype=np.int64))
+    # Written last, its presence marks a complete cache
+    meta = dict(cache_meta(dataset, ckpt, dtype, split), channels=features.shape[-1])
+    with open(os.path.join(cache_dpath, META_FNAME), "w") as fid:
+        json.dump(meta, fid)
+
+def is_feature_cache_valid(cache_dpath, expected_meta):
+    """
+    Check whether a complete cache built from the given inputs exists.
+
+    Parameters:
+    cache_dpath (str): Directory of the cache.
+    expected_meta (dict): What the cache must be built from, see `cache_meta`.
+
+    Returns:
+    bool: True if the cache can be used.
+    """
+    meta_fpath = os.path.join(cache_dpath, META_FNAME)
+    if not os.path.isfile(meta_fpath):
+        return False
+    with open(meta_fpath, "r") as fid:
+        meta = json.load(fid)
+
+    return all(meta.get(k) == v for k, v in expected_meta.items())
+
+
+class FeatureCacheDataset(Dataset):
+    """
+    A PyTorch Dataset reading backbone features from a cache built with
+    `build_feature_cache`.
+
+    Attributes:
+    features (numpy.memmap): (total_frames, 2, C) memory-mapped features.
+    offsets (numpy.ndarray): (num_samples+1,) first frame of each sample.
+    class_ids (numpy.ndarray): (num_samples,) class of each sample.
+    """
+    def __init__(self, cache_dpath):
+        """
+        Initialize the FeatureCacheDataset.
+
+        Parameters:
+        cache_dpath (str): Directory of the cache.
+        """
+        super().__init__()
+        with open(os.path.join(cache_dpath, META_FNAME), "r") as fid:
+            meta = json.load(fid)
+        self.features = np.memmap(
+            os.path.join(cache_dpath, FEATURES_FNAME),
+            dtype=meta["dtype"],
+            mode="r"
+        ).reshape(-1, 2, meta["channels"])
+        self.offsets = np.load(os.path.join(cache_dpath, OFFSETS_FNAME))
+        self.class_ids = np.load(os.path.join(cache_dpath, CLASS_IDS_FNAME))
+
+    def __len__(self):
+        """Returns the number of samples in the dataset."""
+        return len(self.class_ids)
+
+    def __getitem__(self, idx):
+        """
+        Retrieves a sample from the dataset at the specified index.
+
+        Parameters:
+        idx (int): Index of the sample to retrieve.
+
+        Returns:
+        dict: A dictionary containing the sample data.
+        """
+        features = self.features[self.offsets[idx]:self.offsets[idx+1]]
+        features = torch.from_numpy(np.asarray(features, dtype=np.float32))
+
+        return {
+            "sample_id": idx,
+            "class_id": int(self.class_ids[idx]),
+            "rhand_features": features[:, 0],
+            "lhand_features": features[:, 1],
+        }
+
+
+def feature_cache_collate_fn(original_batch):
+    """Custom collate DataLoader function."""
+    sample_id = torch.tensor([ob["sample_id"] for ob in original_batch], dtype=torch.int32)
+    class_id = torch.tensor([ob["class_id"] for ob in original_batch], dtype=torch.int64)
+    rhand = pad_sequence([ob["rhand_features"] for ob in original_batch], batch_first=True)
+    lhand = pad_sequence([ob["lhand_features"] for ob in original_batch], batch_first=True)
+
+    return {
+        "sample_id": sample_id,
+        "class_id": class_id,
+        "rhand_features": rhand,
+        "lhand_features": lhand,
+    }
+
+
+class FeatureCacheDataModule(pl.LightningDataModule):
+    """
+    A PyTorch Lightning DataModule feeding cached backbone features.
+
+    Caches are built on first use from the splits of a keypoints data module.
+
+    Attributes:
+    datamodule (LightningDataModule): The keypoints data module, e.g. MSASLDataModule.
+    model (SignBertModel): The pre-trained base model.
+    cache_dpath (str): Directory holding one cache per split.
+    ckpt (str): Checkpoint the model was loaded from.
+    batch_size (int): Batch size for data loaders.
+    """
+    def __init__(self, datamodule, model, cache_dpath, ckpt, batch_size, dtype="float32", device="cpu"):
+        """
+        Initialize the FeatureCacheDataModule.
+
+        Parameters:
+        datamodule (LightningDataModule): The keypoints data module, it must
+        set `train_dataset` and `val_dataset` on setup.
+        model (SignBertModel): The pre-trained base model.
+        cache_dpath (str): Directory holding one cache per split.
+        ckpt (str): Checkpoint the model was loaded from.
+        batch_size (int): The size of the batches for data loading.
+        dtype (str): The features storage dtype. Default is "float32".
+        device (str): The device the backbone runs on when caching. Default is "cpu".
+        """
+        super().__init__()
+        self.datamodule = datamodule
+        self.model = model
+        self.cache_dpath = cache_dpath
+        self.ckpt = ckpt
+        self.batch_size = batch_size
+        self.dtype = dtype
+        self.device = device
+
+    def prepare_data(self):
+        # The splits are needed to check the caches, only their lists are read
+        self.datamodule.setup("fit")
+        for split, dataset in (("train", self.datamodule.train_dataset), ("val", self.datamodule.val_dataset)):
+            dpath = os.path.join(self.cache_dpath, split)
+            if not is_feature_cache_valid(dpath, cache_meta(dataset, self.ckpt, self.dtype, split)):
+                build_feature_cache(self.model, dataset, dpath, self.ckpt, self.dtype, self.device, split)
+
+    def setup(self, stage):
+        if stage == "fit":
+            self.train_dataset = FeatureCacheDataset(os.path.join(self.cache_dpath, "train"))
+            self.val_dataset = FeatureCacheDataset(os.path.join(self.cache_dpath, "val"))
+
+    def train_dataloader(self):
+        return DataLoader(
+            self.train_dataset,
+            batch_size=self.batch_size,
+            shuffle=True,
+            drop_last=True,
+            collate_fn=feature_cache_collate_fn
+        )
+
+    def val_dataloader(self):
+        return DataLoader(
+            self.val_dataset,
+            batch_size=self.batch_size,
+            collate_fn=feature_cache_collate_fn
+        )
@@ -1,6 +1,7 @@
 import torch
 import torch.nn as nn
-import torch.nn.functional as F
+
+from signbert.utils import lengths_to_padding_mask
 
 
 class Head(nn.Module):
@@ -36,25 +37,51 @@ class Head(nn.Module):
         # Define the classification layer
         self.classifier = nn.Linear(in_channels, num_classes)
     
-    def forward(self, rhand, lhand):
+    def embed(self, rhand, lhand, lengths=None):
+        """
+        Compute the per-clip vector the classifier is applied to.
+
+        Parameters:
+        rhand (Tensor): (N, T, C) right hand features.
+        lhand (Tensor): (N, T, C) left hand features.
+        lengths (Tensor, optional): (N,) sequence lengths, if given padding
+        frames are excluded from the temporal softmax and max-pooling.
+
+        Returns:
+        Tensor: (N, 2 * C) temporally pooled features.
+        """
+        # Concatenate right and left hand features
+        x = torch.concat((rhand, lhand), axis=2)
+        if lengths is None:
+            # Apply temporal merging to the concatenated features
+            x = self.temporal_merging(x) * x
+            # Apply max-pooling over the time dimension, as a reduction so 
+            # traced and exported graphs do not bake the sequence length in
+            return torch.amax(x, dim=1)
+        padding = lengths_to_padding_mask(lengths.to(x.device), x.shape[1]).unsqueeze(-1)
+        # Same temporal merging, padding frames get no weight
+        weights = self.temporal_merging[0](x).masked_fill(padding, float("-inf"))
+        x = self.temporal_merging[1](weights) * x
+        # Max-pooling over the frames that are not padding
+        x = torch.amax(x.masked_fill(padding, float("-inf")), dim=1)
+
+        return x
+
+    def forward(self, rhand, lhand, lengths=None):
         """
         Forward pass of the Head module.
 
         Parameters:
         rhand (Tensor): Input tensor for right hand features.
         lhand (Tensor): Input tensor for left hand features.
+        lengths (Tensor, optional): (N,) sequence lengths, see `embed`.
 
         Returns:
         Tensor: The output tensor after classification.
         """
-        # Concatenate right and left hand features
-        x = torch.concat((rhand, lhand), axis=2)
-        # Apply temporal merging to the concatenated features
-        x = self.temporal_merging(x) * x
-        # Apply max-pooling over the time dimension
-        x = F.max_pool1d(x.mT, kernel_size=x.shape[1]).squeeze()
+        # Pool the temporal features into a per-clip vector
+        x = self.embed(rhand, lhand, lengths)
         # Pass through the classifier to obtain final logits
         x = self.classifier(x)
 
         return x
-        
\ No newline at end of file
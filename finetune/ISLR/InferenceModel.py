@@ -0,0 +1,227 @@
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.nn.utils.rnn import pad_sequence
+
+from finetune.SignBERTModel import SignBertModel
+from finetune.ISLR.MSASLDataModule import MSASLDataModule
+from signbert.model.Backbone import Backbone
+from signbert.utils import pad_to_bucket
+
+
+class InferenceModel(nn.Module):
+    """
+    Inference wrapper around a finetuned ISLR model or a pre-trained backbone.
+
+    It takes raw rtmpose whole-body skeletons, as stored in the skeleton
+    `.npy` files, and outputs either the finetuned model logits or a per-clip
+    embedding. For a finetuned model, the embedding is the pooled vector the
+    head classifies. For a backbone, it is the per-frame features of both
+    hands averaged over the frames that are not padding.
+
+    The outputs of a sample do not depend on the other samples of its batch
+    as long as it is padded to the same length, e.g. to its bucket (see
+    `collate`): padding frames are masked from the attention and from the
+    temporal pooling. The extractors still see them. Encoders whose
+    positional encoding is not `batch_first` (checkpoints trained without
+    `pe_batch_first`) encode the slot of a sample in its batch, so their
+    batches are run one sample at a time.
+
+    Attributes:
+    kind (str): "finetuned" or "backbone".
+    encoder (nn.Module): The pre-trained model, with an `encode` method.
+    head (Head): The ISLR head, None for a backbone.
+    means (numpy.ndarray): x and y means used to normalize skeletons, None to
+    leave them unnormalized.
+    stds (numpy.ndarray): x and y standard deviations.
+    embed (bool): Whether a finetuned model outputs embeddings instead of
+    logits.
+    window_size (int): If set, sequences are encoded with overlapping windows
+    of this many frames, see `Backbone.encode_windowed`.
+    overlap (int): The number of frames shared by consecutive windows.
+    """
+    KINDS = ("finetuned", "backbone")
+
+    def __init__(self, kind, encoder, head=None, means=None, stds=None, embed=False, window_size=None, overlap=100):
+        """
+        Initialize the InferenceModel.
+
+        Parameters:
+        kind (str): "finetuned" or "backbone".
+        encoder (nn.Module): The pre-trained model, with an `encode` method.
+        head (Head, optional): The ISLR head, required for "finetuned".
+        means (numpy.ndarray, optional): x and y normalization means.
+        stds (numpy.ndarray, optional): x and y normalization standard deviations.
+        embed (bool): Whether a finetuned model outputs the head pooled
+        vector instead of logits. Default is False.
+        window_size (int, optional): The window size of the windowed encoding,
+        for long sequences. Default is None, sequences are encoded at once.
+        overlap (int): The number of frames shared by consecutive windows.
+        Default is 100.
+        """
+        super().__init__()
+        assert kind in InferenceModel.KINDS, f"Unknown model kind: {kind}"
+        assert (kind == "finetuned") == (head is not None)
+        self.kind = kind
+        self.encoder = encoder
+        self.head = head
+        self.means = means
+        self.stds = stds
+        self.embed = embed
+        self.window_size = window_size
+        self.overlap = overlap
+
+    @staticmethod
+    def load(
+            kind,
+            ckpt,
+            base_ckpt=None,
+            head_args=None,
+            normalize=True,
+            means_fpath=MSASLDataModule.MEANS_FPATH,
+            stds_fpath=MSASLDataModule.STDS_FPATH,
+            map_location="cpu",
+            embed=False,
+            window_size=None,
+            overlap=100
+        ):
+        """
+        Load a model for inference.
+
+        Parameters:
+        kind (str): "finetuned" or "backbone".
+        ckpt (str): The finetuning checkpoint, or the backbone export (see
+        `export.py`).
+        base_ckpt (str, optional): For "finetuned", the pre-trained model the
+        finetuning started from, it only defines the architecture as its
+        weights are part of `ckpt`. A backbone export loads much faster.
+        head_args (dict, optional): For "finetuned", the head arguments.
+        normalize (bool): Whether skeletons are normalized. Default is True.
+        means_fpath (str): The normalization means, default is MS-ASL ones.
+        stds_fpath (str): The normalization standard deviations.
+        map_location (str): The device weights are loaded on. Default is "cpu".
+        embed (bool): For "finetuned", whether to output the head pooled vector
+        instead of logits. Default is False.
+        window_size (int, optional): The window size of the windowed encoding.
+        Default is None, sequences are encoded at once.
+        overlap (int): The number of frames shared by consecutive windows.
+        Default is 100.
+
+        Returns:
+        InferenceModel: The model, in eval mode.
+        """
+        if kind == "finetuned":
+            model = SignBertModel.load_from_checkpoint(
+                ckpt,
+                map_location=map_location,
+                ckpt=base_ckpt,
+                lr=0.,
+                head_args=head_args
+            )
+            encoder, head = model.model, model.head
+        else:
+            encoder, head = Backbone.load(ckpt, map_location=map_location), None
+        means = np.load(means_fpath) if normalize else None
+        stds = np.load(stds_fpath) if normalize else None
+
+        return InferenceModel(kind, encoder, head, means, stds, embed, window_size, overlap).eval()
+
+    @property
+    def batch_invariant(self):
+        """Whether samples of a batch are encoded independently of their slot."""
+        return getattr(self.encoder.pe, "batch_first", False)
+
+    @property
+    def output_dim(self):
+        """The size of the outputs, classes or embedding channels."""
+        if self.head is not None:
+            if self.embed:
+                return self.head.classifier.in_features
+            return self.head.classifier.out_features
+
+        return 2 * self.encoder.config["d_model"]
+
+    def preprocess(self, skeleton):
+        """
+        Select and normalize the keypoints used by the model.
+
+        Parameters:
+        skeleton (numpy.ndarray): (T, 133, C) rtmpose whole-body keypoints,
+        scores are dropped if present.
+
+        Returns:
+        dict: The (T, V, 2) float32 arms, right and left hand keypoints.
+        """
+        skeleton = skeleton[..., :2]
+        if self.means is not None:
+            skeleton = (skeleton - self.means) / self.stds
+        skeleton = skeleton.astype(np.float32)
+
+        return {
+            "arms": skeleton[:, 5:11],
+            "lhand": skeleton[:, 91:112],
+            "rhand": skeleton[:, 112:133],
+        }
+
+    @staticmethod
+    def collate(samples, buckets=None):
+        """
+        Pad preprocessed samples into a batch.
+
+        Parameters:
+        samples (list): Samples returned by `preprocess`.
+        buckets (list, optional): Sequence length buckets, if given the batch
+        is padded up to the bucket of its longest sample. Samples whose own
+        bucket is the batch one then get the same padding whatever their batch.
+
+        Returns:
+        dict: The padded arms, right and left hand keypoints and the (N,)
+        sequence lengths.
+        """
+        batch = {
+            k: pad_sequence([torch.from_numpy(s[k]) for s in samples], batch_first=True, padding_value=MSASLDataModule.PADDING_VALUE)
+            for k in ("arms", "rhand", "lhand")
+        }
+        if buckets is not None:
+            for k in ("arms", "rhand", "lhand"):
+                batch[k] = pad_to_bucket(batch[k], buckets, dim=1, value=MSASLDataModule.PADDING_VALUE)
+        batch["lengths"] = torch.tensor([len(s["arms"]) for s in samples], dtype=torch.int64)
+
+        return batch
+
+    def forward(self, arms, rhand, lhand, lengths):
+        """
+        Compute the outputs of a batch.
+
+        Parameters:
+        arms (Tensor): (N, T, 6, 2) arms keypoints.
+        rhand (Tensor): (N, T, 21, 2) right hand keypoints.
+        lhand (Tensor): (N, T, 21, 2) left hand keypoints.
+        lengths (Tensor): (N,) sequence lengths.
+
+        Returns:
+        Tensor: (N, output_dim) logits or embeddings.
+        """
+        if not self.batch_invariant and len(arms) > 1:
+            # Each sample is encoded as a batch of one
+            return torch.cat([
+                self(arms[i:i + 1], rhand[i:i + 1], lhand[i:i + 1], lengths[i:i + 1])
+                for i in range(len(arms))
+            ])
+        if self.window_size is not None:
+            # Bounded memory and linear time on long sequences
+            rhand, lhand = self.encoder.encode_windowed(
+                arms, rhand, lhand, self.window_size, self.overlap, lengths=lengths
+            )
+        else:
+            rhand, lhand = self.encoder.encode(arms, rhand, lhand, lengths)
+        if self.head is not None and self.embed:
+            return self.head.embed(rhand, lhand, lengths)
+        if self.head is not None:
+            return self.head(rhand, lhand, lengths)
+        # Average both hands features over the frames that are not padding
+        x = torch.cat((rhand, lhand), dim=-1)
+        valid = torch.arange(x.shape[1], device=x.device) < lengths.to(x.device).unsqueeze(1)
+        x = (x * valid.unsqueeze(-1)).sum(1) / lengths.to(x.device).unsqueeze(1)
+
+        return x
@@ -0,0 +1,279 @@
+import time
+import asyncio
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+
+from signbert.utils import bucket_length
+
+
+class ServingMetrics:
+    """
+    Rolling serving metrics: counters and latencies of the latest requests.
+
+    Attributes:
+    num_requests (int): The number of requests answered.
+    num_batches (int): The number of batches run.
+    num_errors (int): The number of requests which failed.
+    latencies (deque): Request latencies in ms, from arrival to answer.
+    queue_waits (deque): Request waits in ms, from arrival to batch start.
+    forward_times (deque): Batch forward times in ms.
+    batch_sizes (deque): Batch sizes.
+    """
+    def __init__(self, window=10000):
+        """
+        Initialize the ServingMetrics.
+
+        Parameters:
+        window (int): The number of latest values latencies are computed
+        over. Default is 10000.
+        """
+        self.start_time = time.perf_counter()
+        self.num_requests = 0
+        self.num_batches = 0
+        self.num_errors = 0
+        self.latencies = collections.deque(maxlen=window)
+        self.queue_waits = collections.deque(maxlen=window)
+        self.forward_times = collections.deque(maxlen=window)
+        self.batch_sizes = collections.deque(maxlen=window)
+
+    @staticmethod
+    def _percentiles(values):
+        """p50, p90 and p99 of values, None when empty."""
+        if not values:
+            return None
+        p50, p90, p99 = np.percentile(np.array(values), (50, 90, 99))
+
+        return {"p50": float(p50), "p90": float(p90), "p99": float(p99)}
+
+    def snapshot(self, queue_depth, in_flight):
+        """
+        Get the current metrics.
+
+        Parameters:
+        queue_depth (int): The number of requests waiting for a batch.
+        in_flight (int): The number of batches running.
+
+        Returns:
+        dict: JSON serializable metrics.
+        """
+        return {
+            "uptime_s": time.perf_counter() - self.start_time,
+            "queue_depth": queue_depth,
+            "in_flight_batches": in_flight,
+            "num_requests": self.num_requests,
+            "num_batches": self.num_batches,
+            "num_errors": self.num_errors,
+            "mean_batch_size": float(np.mean(self.batch_sizes)) if self.batch_sizes else None,
+            "latency_ms": ServingMetrics._percentiles(self.latencies),
+            "queue_wait_ms": ServingMetrics._percentiles(self.queue_waits),
+            "forward_ms": ServingMetrics._percentiles(self.forward_times),
+        }
+
+
+class MicroBatcher:
+    """
+    Groups concurrent requests into batches run through the model.
+
+    Requests are queued by length bucket, so a batch only pads sequences up
+    to the longest one of its bucket. A bucket is run as soon as it holds
+    `max_batch_size` requests, or when its oldest request has waited
+    `max_wait_ms`. At most `num_workers` batches run at a time, on worker
+    threads (PyTorch releases the GIL), so while they run new requests
+    accumulate into larger batches: the batch size grows with the load.
+
+    Requests are padded to their bucket length, whatever the other requests
+    of their batch, since the extractors see the padding frames. Logits then
+    do not depend on batching, see `InferenceModel`, and `check_parity`
+    measures the remaining numerical difference.
+
+    Attributes:
+    model (InferenceModel): The model, with `preprocess` and `collate`.
+    buckets (list): Sequence length buckets.
+    max_batch_size (int): The max. number of requests per batch.
+    max_wait_ms (float): The max. time a request waits for its batch to fill.
+    metrics (ServingMetrics): The serving metrics.
+    """
+    def __init__(self, model, buckets, max_batch_size=32, max_wait_ms=10., num_workers=1, device="cpu"):
+        """
+        Initialize the MicroBatcher.
+
+        Parameters:
+        model (InferenceModel): The model, in eval mode.
+        buckets (list): Sequence length buckets.
+        max_batch_size (int): The max. number of requests per batch. Default is 32.
+        max_wait_ms (float): The max. time a request waits for its batch to
+        fill, in ms. Default is 10.
+        num_workers (int): The number of batches run concurrently. Default is 1.
+        device (str): The device the model runs on. Default is "cpu".
+        """
+        self.model = model
+        self.buckets = buckets
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.device = device
+        self.metrics = ServingMetrics()
+        self._queues = collections.defaultdict(collections.deque)
+        self._executor = ThreadPoolExecutor(max_workers=num_workers)
+        self._slots = None
+        self._num_workers = num_workers
+        self._in_flight = 0
+        self._arrival = None
+        self._task = None
+        self._running = set()
+
+    @property
+    def queue_depth(self):
+        """The number of requests waiting for a batch."""
+        return sum(len(q) for q in self._queues.values())
+
+    def start(self):
+        """Start batching, from within the running event loop."""
+        self._slots = asyncio.Semaphore(self._num_workers)
+        self._arrival = asyncio.Event()
+        self._task = asyncio.create_task(self._schedule())
+
+    async def stop(self):
+        """Stop batching and the worker threads."""
+        self._task.cancel()
+        self._executor.shutdown(wait=True)
+
+    async def submit(self, skeleton):
+        """
+        Queue a request and wait for its logits.
+
+        Parameters:
+        skeleton (numpy.ndarray): (T, 133, C) rtmpose whole-body keypoints.
+
+        Returns:
+        tuple: The (num_classes,) logits and the request info: its bucket
+        and the size of the batch it ran in.
+        """
+        sample = self.model.preprocess(skeleton)
+        bucket = bucket_length(len(sample["arms"]), self.buckets)
+        future = asyncio.get_running_loop().create_future()
+        self._queues[bucket].append((sample, future, time.perf_counter()))
+        self._arrival.set()
+
+        return await future
+
+    def _next_batch(self):
+        """
+        Pop the next batch to run, if any is due.
+
+        Returns:
+        tuple: The bucket and the requests of the due batch, both None if no
+        batch is due, and the time in seconds until a bucket is due, None if
+        no request is queued.
+        """
+        now = time.perf_counter()
+        due = None
+        next_deadline = None
+        for bucket, queue in self._queues.items():
+            if not queue:
+                continue
+            oldest = queue[0][2]
+            deadline = oldest + self.max_wait_ms / 1e3
+            if len(queue) >= self.max_batch_size or deadline <= now:
+                # Oldest requests first
+                if due is None or oldest < self._queues[due][0][2]:
+                    due = bucket
+            elif next_deadline is None or deadline < next_deadline:
+                next_deadline = deadline
+        if due is None:
+            return None, None, None if next_deadline is None else next_deadline - now
+        queue = self._queues[due]
+        batch = [queue.popleft() for _ in range(min(len(queue), self.max_batch_size))]
+
+        return due, batch, 0.
+
+    async def _schedule(self):
+        """Run due batches as long as a worker is free."""
+        while True:
+            await self._slots.acquire()
+            while True:
+                bucket, batch, timeout = self._next_batch()
+                if bucket is not None:
+                    break
+                # Wait for a new request or for the next bucket deadline
+                self._arrival.clear()
+                try:
+                    await asyncio.wait_for(self._arrival.wait(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    pass
+            # Running tasks are referenced until done, so they are not collected
+            task = asyncio.create_task(self._run(bucket, batch))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    def _forward(self, samples, bucket):
+        """Run the model on a batch padded to its bucket, on a worker thread."""
+        batch = {k: v.to(self.device) for k, v in self.model.collate(samples, [bucket]).items()}
+        with torch.inference_mode():
+            logits = self.model(batch["arms"], batch["rhand"], batch["lhand"], batch["lengths"])
+
+        return logits.float().cpu().numpy()
+
+    async def _run(self, bucket, batch):
+        """Run a batch and answer its requests."""
+        self._in_flight += 1
+        start = time.perf_counter()
+        try:
+            samples = [sample for sample, _, _ in batch]
+            logits = await asyncio.get_running_loop().run_in_executor(self._executor, self._forward, samples, bucket)
+        except Exception as e:
+            self.metrics.num_errors += len(batch)
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            self._in_flight -= 1
+            self._slots.release()
+        end = time.perf_counter()
+        self.metrics.num_batches += 1
+        self.metrics.batch_sizes.append(len(batch))
+        self.metrics.forward_times.append((end - start) * 1e3)
+        info = {"bucket": bucket, "batch_size": len(batch)}
+        for (_, future, arrival), x in zip(batch, logits):
+            self.metrics.num_requests += 1
+            self.metrics.queue_waits.append((start - arrival) * 1e3)
+            self.metrics.latencies.append((end - arrival) * 1e3)
+            # The client might have disconnected
+            if not future.done():
+                future.set_result((x, info))
+
+    def check_parity(self, skeletons):
+        """
+        Compare the logits of requests batched together with their logits
+        when run alone.
+
+        Requests are batched by bucket, in the given and in the reverse
+        order, so both the co-batched requests and the slots change.
+
+        Parameters:
+        skeletons (list): (T, 133, C) rtmpose whole-body keypoints.
+
+        Returns:
+        float: The max. absolute difference between batched and single logits.
+        """
+        groups = collections.defaultdict(list)
+        for skeleton in skeletons:
+            sample = self.model.preprocess(skeleton)
+            groups[bucket_length(len(sample["arms"]), self.buckets)].append(sample)
+        max_diff = 0.
+        for bucket, samples in groups.items():
+            single = np.concatenate([self._forward([s], bucket) for s in samples])
+            for order in (samples, samples[::-1]):
+                batched = self._forward(order, bucket)
+                if order is not samples:
+                    batched = batched[::-1]
+                max_diff = max(max_diff, float(np.abs(batched - single).max()))
+
+        return max_diff
+
+    def snapshot(self):
+        """Get the current serving metrics, see `ServingMetrics.snapshot`."""
+        return self.metrics.snapshot(self.queue_depth, self._in_flight)
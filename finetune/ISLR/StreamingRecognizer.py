@@ -0,0 +1,207 @@
+import numpy as np
+import torch
+
+
+class StreamingRecognizer:
+    """
+    Frame by frame ISLR inference over a sliding window of the latest frames.
+
+    Frames are normalized once when pushed and kept in a ring buffer. The
+    extractors' tokens are cached in a second ring buffer: the extractors
+    have a finite temporal receptive field of `context` frames on each side,
+    so a new frame only changes the tokens of the last `context + 1` frames,
+    which are recomputed from the last `2 * context + 1` frames. The
+    transformer attends over the whole window, it runs along with the head
+    every `hop` frames only.
+
+    Tokens at the start of the window were computed with the frames that
+    preceded it, instead of the zero padding an offline pass over the window
+    would see, the stream being continuous. If the extractors are not
+    temporally local, `context` is None and the tokens of the whole window
+    are recomputed on every frame.
+
+    Attributes:
+    model (InferenceModel): The finetuned model.
+    window_size (int): The number of latest frames predictions are made on.
+    hop (int): The number of frames between two predictions.
+    min_frames (int): The number of frames before the first prediction.
+    context (int): The extractors' receptive field radius, in frames. None
+    when the tokens of the whole window are recomputed.
+    num_frames (int): The number of frames pushed since the last reset.
+    """
+    def __init__(self, model, window_size=64, hop=8, min_frames=None, context="auto"):
+        """
+        Initialize the StreamingRecognizer.
+
+        Parameters:
+        model (InferenceModel): The finetuned model, in eval mode.
+        window_size (int): The number of latest frames predictions are made
+        on. Default is 64.
+        hop (int): The number of frames between two predictions. Default is 8.
+        min_frames (int, optional): The number of frames before the first
+        prediction. Default is `hop`.
+        context (int or str): The extractors' receptive field radius in frames,
+        None to recompute the whole window, or "auto" to measure it with
+        `measure_context`. Default is "auto".
+        """
+        assert model.kind == "finetuned", "Streaming recognition needs a finetuned model"
+        self.model = model
+        self.window_size = window_size
+        self.hop = hop
+        self.min_frames = min_frames if min_frames is not None else hop
+        if context == "auto":
+            context = StreamingRecognizer.measure_context(model.encoder, probe_len=2 * window_size)
+        self.context = context
+        # Frames needed to recompute the tokens touched by a new frame
+        if context is None:
+            self.frames_capacity = window_size
+        else:
+            self.frames_capacity = 2 * context + 1
+        self.device = next(model.parameters()).device
+        self.reset()
+
+    @staticmethod
+    def measure_context(encoder, probe_len=128, tol=1e-6):
+        """
+        Measure the temporal receptive field radius of the extractors.
+
+        A frame in the middle of a random sequence is perturbed and the
+        furthest token that changes gives the radius.
+
+        Parameters:
+        encoder (nn.Module): The pre-trained model, with an `extract_tokens`
+        method.
+        probe_len (int): The number of frames of the probe sequence. Default
+        is 128.
+        tol (float): Relative change under which a token is unchanged.
+        Default is 1e-6.
+
+        Returns:
+        int: The radius in frames, None if tokens depend on frames further
+        than half the probe length, i.e. the extractors are not temporally
+        local.
+        """
+        device = next(encoder.parameters()).device
+        generator = torch.Generator().manual_seed(0)
+        # Keypoints away from zero, zero frames are taken as padding
+        inputs = [
+            (torch.rand((1, probe_len, V, 2), generator=generator) + 0.5).to(device)
+            for V in (6, 21, 21)
+        ]
+        mid = probe_len // 2
+        perturbed = [x.clone() for x in inputs]
+        for x in perturbed:
+            x[:, mid] += 0.5
+        with torch.inference_mode():
+            ref = torch.cat(encoder.extract_tokens(*inputs), dim=-1)[0]
+            out = torch.cat(encoder.extract_tokens(*perturbed), dim=-1)[0]
+        changed = (out - ref).abs().amax(-1) > tol * ref.abs().amax()
+        radius = int((changed.nonzero()[:, 0] - mid).abs().max())
+        if radius >= mid:
+            return None
+
+        return radius
+
+    def reset(self):
+        """Forget the frames pushed so far, e.g. at a stream cut."""
+        self.num_frames = 0
+        self.frames = None
+        self.tokens = None
+
+    def _chronological(self, start, stop, capacity):
+        """Ring buffer positions of frames [start, stop), in order."""
+        return np.arange(start, stop) % capacity
+
+    def push(self, frame):
+        """
+        Add a frame to the stream.
+
+        Parameters:
+        frame (numpy.ndarray): (133, C) rtmpose whole-body keypoints.
+
+        Returns:
+        Tensor: (num_classes,) logits over the latest frames when a prediction
+        is due, else None.
+        """
+        sample = self.model.preprocess(frame[None])
+        # The ring buffers are sized on the first frame
+        if self.frames is None:
+            self.frames = {
+                k: np.zeros((self.frames_capacity, *v.shape[1:]), dtype=v.dtype)
+                for k, v in sample.items()
+            }
+        for k, v in sample.items():
+            self.frames[k][self.num_frames % self.frames_capacity] = v[0]
+        self.num_frames += 1
+        self._update_tokens()
+        if self.num_frames >= self.min_frames and (self.num_frames - self.min_frames) % self.hop == 0:
+            return self.predict()
+
+        return None
+
+    @torch.inference_mode()
+    def _update_tokens(self):
+        """Recompute the tokens the latest frame changed."""
+        t = self.num_frames
+        if self.context is None:
+            start = keep = max(0, t - self.window_size)
+        else:
+            start = max(0, t - 1 - 2 * self.context)
+            keep = max(0, t - 1 - self.context, t - self.window_size)
+        positions = self._chronological(start, t, self.frames_capacity)
+        arms, rhand, lhand = [
+            torch.from_numpy(self.frames[k][positions]).unsqueeze(0).to(self.device)
+            for k in ("arms", "rhand", "lhand")
+        ]
+        rhand, lhand = self.model.encoder.extract_tokens(arms, rhand, lhand)
+        if self.tokens is None:
+            # (W, 2, C) right and left hand tokens
+            self.tokens = torch.zeros((self.window_size, 2, rhand.shape[-1]), device=self.device)
+        # Only the tokens which saw their whole receptive field are kept
+        tokens = torch.stack((rhand[0], lhand[0]), dim=1)[keep - start:]
+        positions = self._chronological(keep, t, self.window_size)
+        self.tokens[torch.from_numpy(positions).to(self.device)] = tokens
+
+    @torch.inference_mode()
+    def predict(self):
+        """
+        Run the transformer and the head over the latest frames.
+
+        Returns:
+        Tensor: (num_classes,) logits.
+        """
+        t = self.num_frames
+        assert t > 0, "No frame pushed yet"
+        positions = self._chronological(max(0, t - self.window_size), t, self.window_size)
+        tokens = self.tokens[torch.from_numpy(positions).to(self.device)].unsqueeze(0)
+        rhand, lhand = self.model.encoder.encode_tokens(tokens[:, :, 0], tokens[:, :, 1])
+
+        return self.model.head(rhand, lhand)[0]
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from finetune.ISLR.InferenceModel import InferenceModel
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--export', required=True, type=str, help='Backbone export, see export.py')
+    parser.add_argument('--window-size', default=32, type=int)
+    args = parser.parse_args()
+
+    # Untrained head, only the streaming mechanics are checked
+    from finetune.ISLR.Head import Head
+    from signbert.model.Backbone import Backbone
+    encoder = Backbone.load(args.export)
+    head = Head(encoder.config["d_model"], 10).eval()
+    model = InferenceModel("finetuned", encoder, head)
+    recognizer = StreamingRecognizer(model, window_size=args.window_size, hop=args.window_size)
+    print(f'{recognizer.context=}')
+    skeleton = np.random.rand(args.window_size, 133, 2).astype(np.float32) + 0.5
+    for frame in skeleton:
+        logits = recognizer.push(frame)
+    # A stream shorter than the window matches an offline pass
+    batch = model.collate([model.preprocess(skeleton)])
+    with torch.inference_mode():
+        offline = model(batch["arms"], batch["rhand"], batch["lhand"], batch["lengths"])[0]
+    print(f'max abs. diff. {(logits - offline).abs().max():.2e}')
@@ -0,0 +1,149 @@
+import copy
+
+import torch
+import torch.nn as nn
+import torch.ao.quantization as tq
+from tqdm import tqdm
+
+from finetune.SignBERTModel import SignBertModel
+
+
+def _quantized_engine():
+    """Pick the best available CPU quantized engine."""
+    engines = torch.backends.quantized.supported_engines
+    for engine in ("x86", "fbgemm", "qnnpack"):
+        if engine in engines:
+            return engine
+    raise RuntimeError("No quantized engine available")
+
+def _is_pointwise_conv(module):
+    """Whether a module is a plain 1x1 2D convolution."""
+    return (
+        type(module) is nn.Conv2d
+        and module.kernel_size == (1, 1)
+        and module.stride == (1, 1)
+        and module.groups == 1
+    )
+
+def _wrap_pointwise_convs(module):
+    """
+    Wrap the 1x1 convolutions of a module between quantize and dequantize stubs.
+
+    Each convolution runs in int8 while its neighbours stay in fp32, so the
+    third-party graph convolutions need no change.
+
+    Parameters:
+    module (nn.Module): The module whose convolutions are wrapped, in place.
+
+    Returns:
+    int: The number of wrapped convolutions.
+    """
+    num_wrapped = 0
+    for name, child in module.named_children():
+        if _is_pointwise_conv(child):
+            setattr(module, name, tq.QuantWrapper(child))
+            num_wrapped += 1
+        else:
+            num_wrapped += _wrap_pointwise_convs(child)
+
+    return num_wrapped
+
+def prepare(model):
+    """
+    Insert the observers of the statically quantized convolutions.
+
+    Parameters:
+    model (SignBertModel): The fp32 finetuned model, modified in place.
+
+    Returns:
+    int: The number of convolutions to quantize.
+    """
+    torch.backends.quantized.engine = _quantized_engine()
+    num_wrapped = _wrap_pointwise_convs(model.model.ge) + _wrap_pointwise_convs(model.model.stpe)
+    qconfig = tq.get_default_qconfig(torch.backends.quantized.engine)
+    # Only the wrapped convolutions get a qconfig, everything else stays fp32
+    for module in model.modules():
+        if isinstance(module, tq.QuantWrapper):
+            module.qconfig = qconfig
+    tq.prepare(model, inplace=True)
+
+    return num_wrapped
+
+def convert(model):
+    """
+    Convert a prepared model to int8.
+
+    Observed 1x1 convolutions become static int8 convolutions, and the
+    linear layers of the transformer and of the head are dynamically
+    quantized: their weights are int8 and activations are quantized on the
+    fly, so they need no calibration.
+
+    The transformer fast path reads the weights of the linear layers as
+    tensors, which the quantized layers do not have, so the quantized model
+    must run under `no_transformer_fastpath`.
+
+    Parameters:
+    model (SignBertModel): The model returned by `prepare`, after calibration.
+
+    Returns:
+    SignBertModel: The quantized model.
+    """
+    tq.convert(model, inplace=True)
+    # Exact types only, attention output projections are used as weights by
+    # `nn.MultiheadAttention` and cannot be replaced
+    return tq.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8, inplace=True)
+
+def quantize_model(model, calibration_batches):
+    """
+    Quantize a finetuned model for CPU inference.
+
+    Parameters:
+    model (SignBertModel): The fp32 finetuned model, left unchanged.
+    calibration_batches (list): Batches of `MSASLDataModule` used to observe
+    the convolutions activations ranges.
+
+    Returns:
+    SignBertModel: The quantized model, in eval mode, to run under
+    `no_transformer_fastpath`.
+    """
+    model = copy.deepcopy(model).cpu().eval()
+    prepare(model)
+    with torch.inference_mode():
+        for batch in tqdm(calibration_batches, desc="Calibrating"):
+            model(batch["arms"].float(), batch["rhand"].float(), batch["lhand"].float())
+
+    return convert(model).eval()
+
+def save_quantized(model, fpath, model_args):
+    """
+    Write a quantized model.
+
+    Parameters:
+    model (SignBertModel): The model returned by `quantize_model`.
+    fpath (str): Output file path.
+    model_args (dict): The `SignBertModel.load_from_checkpoint` arguments of
+    the fp32 model, it is rebuilt from them on load.
+    """
+    torch.save({"model_args": model_args, "state_dict": model.state_dict()}, fpath)
+
+def load_quantized(fpath):
+    """
+    Load a model written by `save_quantized`.
+
+    The fp32 model is rebuilt and quantized the same way, without
+    calibration, then the int8 weights and quantization parameters are loaded.
+
+    Parameters:
+    fpath (str): File written by `save_quantized`.
+
+    Returns:
+    SignBertModel: The quantized model, in eval mode, to run under
+    `no_transformer_fastpath`.
+    """
+    export = torch.load(fpath, map_location="cpu")
+    model = SignBertModel.load_from_checkpoint(map_location="cpu", **export["model_args"]).eval()
+    prepare(model)
+    model = convert(model)
+    model.load_state_dict(export["state_dict"])
+
+    return model.eval()
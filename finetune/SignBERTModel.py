@@ -6,6 +6,7 @@ from torchmetrics import Accuracy
 
 from finetune.ISLR.Head import Head
 from signbert.model.PretrainSignBertModelManoTorch import SignBertModel as BaseModel
+from signbert.model.Backbone import Backbone
 
 
 class SignBertModel(pl.LightningModule):
@@ -22,22 +23,34 @@ class SignBertModel(pl.LightningModule):
     val_acc (Accuracy): Metric for tracking validation accuracy.
     """
 
-    def __init__(self, ckpt, lr, head_args):
+    def __init__(self, ckpt, lr, head_args, parallel_branches=False):
         """
         Initialize the SignBertModel.
 
         Parameters:
-        ckpt (str): Path to the checkpoint of the pre-trained base model.
+        ckpt (str): Path to the checkpoint of the pre-trained base model, either
+        a Lightning checkpoint (.ckpt) or a backbone export (see `export.py`),
+        which is much faster to load.
         lr (float): Learning rate for the optimizer.
         head_args (dict): Arguments for initializing the custom head.
+        parallel_branches (bool): Whether to run the gesture and arms extractors
+        of the base model concurrently. Default is False.
         """
         super().__init__()
         self.lr = lr
         # Load the pre-trained base model from the given checkpoint
-        self.model = BaseModel.load_from_checkpoint(ckpt, map_location="cpu")
-        self._init_base_model()
+        if ckpt.endswith(".ckpt"):
+            self.model = BaseModel.load_from_checkpoint(ckpt, map_location="cpu")
+            self._init_base_model()
+            gesture_extractor_args = self.model.hparams.gesture_extractor_args
+        else:
+            # Only the inference modules are built, weights are memory-mapped
+            self.model = Backbone.load(ckpt, map_location="cpu")
+            self.model.requires_grad_(False)
+            gesture_extractor_args = self.model.config["gesture_extractor_args"]
+        self.model.parallel_branches = parallel_branches
         # Determine the input channel size for the custom head based on the base model's output
-        ge_hid_dim = self.model.hparams.gesture_extractor_args["hid_dim"]
+        ge_hid_dim = gesture_extractor_args["hid_dim"]
         in_channels = ge_hid_dim[-1] if isinstance(ge_hid_dim, list) else ge_hid_dim
         # Initialize the custom head for sign language recognition
         self.head = Head(in_channels=in_channels, **head_args)
@@ -56,10 +69,8 @@ class SignBertModel(pl.LightningModule):
         del self.model.pg
         del self.model.lhand_hd
         del self.model.rhand_hd
-        del self.model.train_pck_20
-        del self.model.train_pck_auc_20_40
-        del self.model.val_pck_20
-        del self.model.val_pck_auc_20_40
+        del self.model.train_pck
+        del self.model.val_pck
         # Freeze the model to prevent updates to its weights during training
         self.model.freeze()
 
@@ -75,29 +86,8 @@ class SignBertModel(pl.LightningModule):
         Returns:
         Tensor: The output predictions of the model.
         """
-        # Concatenate right and left hand data
-        x = torch.concat((rhand, lhand), dim=2)
-        # Extract hand tokens using the gesture extractor in the base model
-        rhand, lhand = self.model.ge(x)
-        rhand = rhand.squeeze(-1).permute(0, 2, 1, 3).contiguous()
-        lhand = lhand.squeeze(-1).permute(0, 2, 1, 3).contiguous()
-        # Extract arm tokens using the spatial-temporal processing in the base model
-        rarm, larm = self.model.stpe(arms)
-        rarm = rarm.squeeze(-1).permute(0, 2, 1, 3).contiguous()
-        larm = larm.squeeze(-1).permute(0, 2, 1, 3).contiguous()
-        N, T, C, V = rhand.shape
-        # Add positional tokens
-        rhand = rhand + rarm 
-        lhand = lhand + larm 
-        # Reshape hand data for further processing
-        rhand = rhand.view(N, T, C*V)
-        lhand = lhand.view(N, T, C*V)
-        # Apply positional encoding to both right and left hand data
-        rhand = self.model.pe(rhand) 
-        lhand = self.model.pe(lhand) 
-        # Process both right and left hand data through the transformer encoder
-        rhand = self.model.te(rhand)
-        lhand = self.model.te(lhand)
+        # Extract per-frame hand features with the pre-trained base model
+        rhand, lhand = self.model.encode(arms, rhand, lhand)
         # Pass the data through the custom head for final predictions
         x = self.head(rhand, lhand)
 
@@ -110,25 +100,22 @@ class SignBertModel(pl.LightningModule):
         Processes a single batch of data, computes the loss, updates the model, and logs metrics.
 
         Parameters:
-        batch (dict): A batch of data. Contains tensors for arms, left hand, right hand, and class labels.
+        batch (dict): A batch of data. Contains tensors for arms, left hand, right hand (or their
+        cached backbone features), and class labels.
 
         Returns:
         torch.Tensor: The computed loss for the batch.
         """
-        # Extract arms, left hand, right hand, and labels from the batch
-        arms = batch["arms"]
-        lhand = batch["lhand"]
-        rhand = batch["rhand"]
         labels = batch["class_id"]
         # Forward pass
-        logits = self(arms, rhand, lhand)
+        logits = self._shared_step(batch)
         # Compute loss
         loss = F.cross_entropy(logits, labels)
         # Compute accuracy
-        acc = self.train_acc(logits, labels) 
-        # Log loss and accuracy
-        self.log("train_loss", loss, on_step=True, on_epoch=True, logger=True, prog_bar=True)
-        self.log("train_acc", acc, on_step=True, on_epoch=True, logger=True, prog_bar=False)
+        self.train_acc(logits, labels) 
+        # Log loss and accuracy, epoch values are synced across processes
+        self.log("train_loss", loss, on_step=True, on_epoch=True, logger=True, prog_bar=True, sync_dist=True)
+        self.log("train_acc", self.train_acc, on_step=True, on_epoch=True, logger=True, prog_bar=False)
 
         return loss
 
@@ -140,26 +127,41 @@ class SignBertModel(pl.LightningModule):
         and logs metrics for monitoring.
 
         Parameters:
-        batch (dict): A batch of validation data. Contains tensors for arms, left hand, right hand, and class labels.
+        batch (dict): A batch of validation data. Contains tensors for arms, left hand, right hand (or their
+        cached backbone features), and class labels.
         dataloader_idx (int, optional): Index of the dataloader. Default is 0.
 
         Returns:
         None: This method logs validation loss and accuracy but does not return anything.
         """
-        # Extract arms, left hand, right hand, and labels from the validation batch
-        arms = batch["arms"]
-        lhand = batch["lhand"]
-        rhand = batch["rhand"]
         labels = batch["class_id"]
         # Forward pass
-        logits = self(arms, rhand, lhand)
+        logits = self._shared_step(batch)
         # Compute loss
         loss = F.cross_entropy(logits, labels)
         # Compute accuracy
-        acc = self.val_acc(logits, labels) 
-        # Log loss and accuracy
-        self.log("val_loss", loss, on_step=True, on_epoch=True, logger=True, prog_bar=False)
-        self.log("val_acc", acc, on_step=True, on_epoch=True, logger=True, prog_bar=True)
+        self.val_acc(logits, labels) 
+        # Log loss and accuracy, epoch values are synced across processes
+        self.log("val_loss", loss, on_step=True, on_epoch=True, logger=True, prog_bar=False, sync_dist=True)
+        self.log("val_acc", self.val_acc, on_step=True, on_epoch=True, logger=True, prog_bar=True)
+
+    def _shared_step(self, batch):
+        """
+        Compute the logits of a batch.
+
+        Batches coming from a feature cache (see `finetune.ISLR.FeatureCache`)
+        hold the frozen backbone outputs, so only the head is run.
+
+        Parameters:
+        batch (dict): A batch of keypoints or of cached features.
+
+        Returns:
+        Tensor: The output predictions of the model.
+        """
+        if "rhand_features" in batch:
+            return self.head(batch["rhand_features"], batch["lhand_features"])
+        
+        return self(batch["arms"], batch["rhand"], batch["lhand"])
 
     def configure_optimizers(self):
         optimizer = torch.optim.Adam(self.parameters(), lr=self.lr)
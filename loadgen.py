@@ -0,0 +1,129 @@
+# python loadgen.py --url http://127.0.0.1:8080 --inputs /home/tmpvideos/SLR/MSASL/skeleton-data/rtmpose-l_8xb64-270e_coco-wholebody-256x192/val --concurrency 1 4 16 64 --requests 500
+import io
+import time
+import glob
+import random
+import asyncio
+import argparse
+
+import aiohttp
+import numpy as np
+
+
+# Same as `serve.NPY_CONTENT_TYPE`, the load generator does not need torch
+NPY_CONTENT_TYPE = "application/x-npy"
+
+
+def load_payloads(input_dpaths, max_files, min_frames, max_frames, seed):
+    """
+    Build request bodies, from skeleton files or random skeletons.
+
+    Parameters:
+    input_dpaths (list): Directories of skeleton `.npy` files, random
+    skeletons are generated if empty.
+    max_files (int): The max. number of files read.
+    min_frames (int): Min. length of random skeletons.
+    max_frames (int): Max. length of random skeletons.
+    seed (int): The random seed.
+
+    Returns:
+    list: `.npy` encoded request bodies.
+    """
+    rng = random.Random(seed)
+    if input_dpaths:
+        fpaths = []
+        for dpath in input_dpaths:
+            fpaths.extend(glob.glob(f"{dpath}/**/*.npy", recursive=True))
+        skeletons = [np.load(f).astype(np.float32) for f in rng.sample(sorted(fpaths), min(max_files, len(fpaths)))]
+    else:
+        np_rng = np.random.default_rng(seed)
+        skeletons = [
+            np_rng.random((rng.randint(min_frames, max_frames), 133, 2), dtype=np.float32)
+            for _ in range(max_files)
+        ]
+    payloads = []
+    for skeleton in skeletons:
+        buffer = io.BytesIO()
+        np.save(buffer, skeleton)
+        payloads.append(buffer.getvalue())
+
+    return payloads
+
+async def client(session, url, payloads, num_requests, latencies, batch_sizes, rng):
+    """Send requests one after the other, as a single client."""
+    for _ in range(num_requests):
+        body = rng.choice(payloads)
+        start = time.perf_counter()
+        async with session.post(f"{url}/predict", data=body, headers={"Content-Type": NPY_CONTENT_TYPE}) as resp:
+            resp.raise_for_status()
+            result = await resp.json()
+        latencies.append((time.perf_counter() - start) * 1e3)
+        batch_sizes.append(result["batch_size"])
+
+async def run_level(session, url, payloads, concurrency, num_requests, seed):
+    """
+    Run a load level: concurrent clients sharing a number of requests.
+
+    Returns:
+    dict: The throughput and client side latencies of the level.
+    """
+    latencies = []
+    batch_sizes = []
+    per_client = [num_requests // concurrency + (i < num_requests % concurrency) for i in range(concurrency)]
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        client(session, url, payloads, n, latencies, batch_sizes, random.Random(seed + i))
+        for i, n in enumerate(per_client)
+    ))
+    elapsed = time.perf_counter() - start
+    p50, p99 = np.percentile(latencies, (50, 99))
+
+    return dict(
+        concurrency=concurrency,
+        throughput=len(latencies) / elapsed,
+        p50_ms=p50,
+        p99_ms=p99,
+        mean_batch_size=float(np.mean(batch_sizes))
+    )
+
+async def run(args):
+    payloads = load_payloads(args.inputs, args.max_files, args.min_frames, args.max_frames, args.seed)
+    print(f"{len(payloads)} distinct requests")
+    connector = aiohttp.UnixConnector(path=args.unix_socket) if args.unix_socket is not None else aiohttp.TCPConnector(limit=0)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=None)) as session:
+        # Warm-up, not reported
+        await run_level(session, args.url, payloads, 1, args.warmup, args.seed)
+        results = []
+        for concurrency in args.concurrency:
+            r = await run_level(session, args.url, payloads, concurrency, args.requests, args.seed)
+            results.append(r)
+            print(
+                f"concurrency {r['concurrency']:4d}: {r['throughput']:8.1f} req/s, "
+                f"p50 {r['p50_ms']:8.1f} ms, p99 {r['p99_ms']:8.1f} ms, "
+                f"mean batch size {r['mean_batch_size']:.1f}"
+            )
+        async with session.get(f"{args.url}/metrics") as resp:
+            print(f"Server metrics: {await resp.json()}")
+    # Batching should make throughput grow with the load
+    if len(results) > 1:
+        speedup = results[-1]["throughput"] / results[0]["throughput"]
+        print(f"Throughput x{speedup:.2f} from concurrency {results[0]['concurrency']} to {results[-1]['concurrency']}")
+
+def main(args):
+    asyncio.run(run(args))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://127.0.0.1:8080", type=str, help="Server URL, the host is ignored with --unix-socket")
+    parser.add_argument("--unix-socket", default=None, type=str)
+    parser.add_argument("--inputs", default=[], nargs="*", type=str, help="Directories of skeleton .npy files, random skeletons if none")
+    parser.add_argument("--max-files", default=256, type=int)
+    parser.add_argument("--min-frames", default=16, type=int, help="Min. length of random skeletons")
+    parser.add_argument("--max-frames", default=128, type=int, help="Max. length of random skeletons")
+    parser.add_argument("--concurrency", default=[1, 4, 16, 64], nargs="+", type=int, help="Concurrent clients of each load level")
+    parser.add_argument("--requests", default=500, type=int, help="Requests per load level")
+    parser.add_argument("--warmup", default=10, type=int)
+    parser.add_argument("--seed", default=0, type=int)
+    args = parser.parse_args()
+
+    main(args)
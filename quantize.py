@@ -0,0 +1,116 @@
+# python quantize.py --ckpt finetune_logs/test/version_0/ckpts/last.ckpt --base-ckpt logs/pretrain/version_0/backbone.pt --config finetune/configs/ISLR_MSASL.yml --out finetune_logs/test/version_0/quantized.pt
+import time
+import argparse
+import contextlib
+
+import yaml
+import torch
+import numpy as np
+from tqdm import tqdm
+
+from finetune.SignBERTModel import SignBertModel
+from finetune.ISLR.MSASLDataModule import MSASLDataModule, my_collate_fn
+from finetune.ISLR.quantization import quantize_model, save_quantized
+from signbert.model.graph_export import no_transformer_fastpath
+
+
+def evaluate(model, dataloader, max_batches=None, fastpath=True):
+    """
+    Compute the top-1 accuracy of a model.
+
+    Parameters:
+    model (SignBertModel): The model.
+    dataloader (DataLoader): The validation dataloader.
+    max_batches (int, optional): Only evaluate the first batches.
+    fastpath (bool): Whether the fused transformer kernels are used, they
+    must not be with a quantized model. Default is True.
+
+    Returns:
+    float: The top-1 accuracy.
+    """
+    correct = 0
+    total = 0
+    with torch.inference_mode(), contextlib.nullcontext() if fastpath else no_transformer_fastpath():
+        for i, batch in enumerate(tqdm(dataloader, desc="Evaluating")):
+            if max_batches is not None and i >= max_batches:
+                break
+            logits = model(batch["arms"].float(), batch["rhand"].float(), batch["lhand"].float())
+            correct += int((logits.argmax(-1) == batch["class_id"]).sum())
+            total += len(batch["class_id"])
+
+    return correct / total
+
+def measure_latency(model, dataset, num_samples, warmup=5, fastpath=True):
+    """
+    Measure the single sample latency of a model.
+
+    Parameters:
+    model (SignBertModel): The model.
+    dataset (MSASLDataset): The samples, the first ones are used.
+    num_samples (int): The number of timed samples.
+    warmup (int): The number of calls not taken into account. Default is 5.
+    fastpath (bool): Whether the fused transformer kernels are used, they
+    must not be with a quantized model. Default is True.
+
+    Returns:
+    numpy.ndarray: (num_samples,) latencies in milliseconds.
+    """
+    num_samples = min(num_samples, len(dataset))
+    latencies = []
+    with torch.inference_mode(), contextlib.nullcontext() if fastpath else no_transformer_fastpath():
+        for i in range(warmup + num_samples):
+            batch = my_collate_fn([dataset[(i - warmup) % num_samples]])
+            inputs = [batch[k].float() for k in ("arms", "rhand", "lhand")]
+            start = time.perf_counter()
+            model(*inputs)
+            if i >= warmup:
+                latencies.append((time.perf_counter() - start) * 1e3)
+
+    return np.array(latencies)
+
+def main(args):
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+    torch.manual_seed(args.seed)
+    with open(args.config, "r") as fid:
+        cfg = yaml.load(fid, yaml.SafeLoader)
+    model_args = dict(checkpoint_path=args.ckpt, ckpt=args.base_ckpt, lr=0., head_args=cfg["head_args"])
+    model = SignBertModel.load_from_checkpoint(map_location="cpu", **model_args).eval()
+    datamodule = MSASLDataModule(batch_size=cfg["batch_size"], **cfg["datamodule_args"])
+    datamodule.setup("fit")
+    # A random sample of training batches, the train dataloader shuffles
+    calibration_batches = []
+    for batch in datamodule.train_dataloader():
+        if len(calibration_batches) == args.calibration_batches:
+            break
+        calibration_batches.append(batch)
+    quantized = quantize_model(model, calibration_batches)
+    save_quantized(quantized, args.out, model_args)
+    print(f"Quantized model written to {args.out}")
+    # Accuracy and latency report against fp32
+    results = {}
+    for name, m in (("fp32", model), ("int8", quantized)):
+        # The fp32 model keeps the fused kernels, so the speedup is not overstated
+        fastpath = name == "fp32"
+        acc = evaluate(m, datamodule.val_dataloader(), args.max_val_batches, fastpath)
+        latencies = measure_latency(m, datamodule.val_dataset, args.latency_samples, fastpath=fastpath)
+        results[name] = (acc, *np.percentile(latencies, (50, 99)))
+    for name, (acc, p50, p99) in results.items():
+        print(f"{name}: top-1 {100 * acc:.2f}%, p50 {p50:.2f} ms, p99 {p99:.2f} ms")
+    fp32, int8 = results["fp32"], results["int8"]
+    print(f"int8 vs fp32: top-1 {100 * (int8[0] - fp32[0]):+.2f} pts, p50 speedup x{fp32[1] / int8[1]:.2f}, p99 speedup x{fp32[2] / int8[2]:.2f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ckpt", required=True, type=str, help="Finetuning checkpoint")
+    parser.add_argument("--base-ckpt", required=True, type=str, help="Pre-trained model the finetuning started from")
+    parser.add_argument("--config", required=True, type=str, help="Finetuning config")
+    parser.add_argument("--out", required=True, type=str)
+    parser.add_argument("--calibration-batches", default=16, type=int, help="Training batches the convolutions are calibrated on")
+    parser.add_argument("--max-val-batches", default=None, type=int, help="Evaluate on the first validation batches only")
+    parser.add_argument("--latency-samples", default=200, type=int, help="Validation samples latency is measured on, one at a time")
+    parser.add_argument("--threads", default=None, type=int)
+    parser.add_argument("--seed", default=0, type=int)
+    args = parser.parse_args()
+
+    main(args)
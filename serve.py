@@ -0,0 +1,176 @@
+# python serve.py --ckpt finetune_logs/test/version_0/ckpts/last.ckpt --base-ckpt logs/pretrain/version_0/backbone.pt --config finetune/configs/ISLR_MSASL.yml --port 8080 --max-batch-size 32 --max-wait-ms 10
+import io
+import argparse
+import contextlib
+
+import yaml
+import torch
+import numpy as np
+from aiohttp import web
+
+from finetune.ISLR.InferenceModel import InferenceModel
+from finetune.ISLR.MicroBatcher import MicroBatcher
+from finetune.ISLR.MSASLDataModule import MSASLDataModule
+from signbert.model.graph_export import no_transformer_fastpath
+
+
+NPY_CONTENT_TYPE = "application/x-npy"
+
+
+def load_model(args):
+    """
+    Load the finetuned model, or its int8 version, see `quantize.py`.
+
+    The int8 model must run under `no_transformer_fastpath`.
+    """
+    if args.quantized is None:
+        with open(args.config, "r") as fid:
+            head_args = yaml.load(fid, yaml.SafeLoader)["head_args"]
+        return InferenceModel.load(
+            "finetuned",
+            args.ckpt,
+            base_ckpt=args.base_ckpt,
+            head_args=head_args,
+            normalize=not args.no_normalize,
+            map_location=args.device
+        )
+    from finetune.ISLR.quantization import load_quantized
+
+    model = load_quantized(args.quantized)
+    means, stds = None, None
+    if not args.no_normalize:
+        means, stds = np.load(MSASLDataModule.MEANS_FPATH), np.load(MSASLDataModule.STDS_FPATH)
+
+    return InferenceModel("finetuned", model.model, model.head, means, stds).eval()
+
+async def read_skeleton(request):
+    """
+    Read the skeleton of a request.
+
+    The body is either a `.npy` file, with the `application/x-npy` content
+    type, or JSON: {"keypoints": (T, 133, C) nested lists}.
+
+    Returns:
+    numpy.ndarray: (T, 133, C) rtmpose whole-body keypoints.
+    """
+    if request.content_type == NPY_CONTENT_TYPE:
+        skeleton = np.load(io.BytesIO(await request.read()), allow_pickle=False)
+    else:
+        skeleton = np.asarray((await request.json())["keypoints"], dtype=np.float32)
+    if skeleton.ndim != 3 or skeleton.shape[1] != 133 or len(skeleton) == 0:
+        raise web.HTTPBadRequest(text=f"Expected (T, 133, C) keypoints, got {skeleton.shape}")
+
+    return skeleton
+
+async def predict(request):
+    """POST /predict: top-k classes of a skeleton."""
+    batcher = request.app["batcher"]
+    skeleton = await read_skeleton(request)
+    logits, info = await batcher.submit(skeleton)
+    top_k = min(int(request.query.get("top_k", 5)), len(logits))
+    # Softmax on the host, over a single request
+    probs = np.exp(logits - logits.max())
+    probs /= probs.sum()
+    classes = np.argsort(-probs)[:top_k]
+
+    return web.json_response({
+        "top_k": [{"class_id": int(c), "prob": float(probs[c])} for c in classes],
+        **info
+    })
+
+async def metrics(request):
+    """GET /metrics: queue depth, batch sizes and latencies."""
+    return web.json_response(request.app["batcher"].snapshot())
+
+async def health(request):
+    """GET /health: liveness."""
+    return web.json_response({"status": "ok"})
+
+def build_app(batcher, max_request_mb):
+    """
+    Build the server application around a micro-batcher.
+
+    Parameters:
+    batcher (MicroBatcher): The micro-batcher, started with the application.
+    max_request_mb (float): The max. request body size, in MB.
+
+    Returns:
+    web.Application: The application.
+    """
+    app = web.Application(client_max_size=int(max_request_mb * 2**20))
+    app["batcher"] = batcher
+    app.add_routes([
+        web.post("/predict", predict),
+        web.get("/metrics", metrics),
+        web.get("/health", health),
+    ])
+
+    async def on_startup(app):
+        app["batcher"].start()
+
+    async def on_cleanup(app):
+        await app["batcher"].stop()
+
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+
+    return app
+
+def main(args):
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+    model = load_model(args).to(args.device)
+    batcher = MicroBatcher(
+        model,
+        buckets=args.buckets,
+        max_batch_size=args.max_batch_size,
+        max_wait_ms=args.max_wait_ms,
+        num_workers=args.num_workers,
+        device=args.device
+    )
+    # The fused transformer kernels read the weights of the linear layers,
+    # which the int8 model does not have; the switch is global, so it also
+    # covers the batcher worker threads
+    fastpath = contextlib.nullcontext() if args.quantized is None else no_transformer_fastpath()
+    with fastpath:
+        if args.parity_check > 0:
+            # Random requests of the first bucket, batched and run alone
+            rng = np.random.default_rng(0)
+            skeletons = [
+                rng.random((int(rng.integers(1, min(args.buckets) + 1)), 133, 2), dtype=np.float32)
+                for _ in range(args.parity_check)
+            ]
+            max_diff = batcher.check_parity(skeletons)
+            print(f"Max. difference between batched and single logits: {max_diff:.2e}")
+            if max_diff > args.parity_atol:
+                print("Logits depend on the co-batched requests beyond the tolerance")
+        app = build_app(batcher, args.max_request_mb)
+        if args.unix_socket is not None:
+            web.run_app(app, path=args.unix_socket)
+        else:
+            web.run_app(app, host=args.host, port=args.port)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ckpt", default=None, type=str, help="Finetuning checkpoint")
+    parser.add_argument("--base-ckpt", default=None, type=str, help="Pre-trained model the finetuning started from")
+    parser.add_argument("--config", default=None, type=str, help="Finetuning config, for the head arguments")
+    parser.add_argument("--quantized", default=None, type=str, help="Model written by quantize.py, instead of --ckpt")
+    parser.add_argument("--host", default="127.0.0.1", type=str)
+    parser.add_argument("--port", default=8080, type=int)
+    parser.add_argument("--unix-socket", default=None, type=str, help="Serve on a Unix socket instead of TCP")
+    parser.add_argument("--buckets", default=[32, 64, 128, 256, 512], nargs="+", type=int, help="Sequence length buckets")
+    parser.add_argument("--max-batch-size", default=32, type=int)
+    parser.add_argument("--max-wait-ms", default=10., type=float, help="Max. time a request waits for its batch to fill")
+    parser.add_argument("--num-workers", default=1, type=int, help="Batches run concurrently")
+    parser.add_argument("--max-request-mb", default=16., type=float)
+    parser.add_argument("--device", default="cpu", type=str)
+    parser.add_argument("--threads", default=None, type=int)
+    parser.add_argument("--no-normalize", action="store_true")
+    parser.add_argument("--parity-check", default=8, type=int, help="Requests compared batched and alone at startup, 0 to skip")
+    parser.add_argument("--parity-atol", default=1e-4, type=float)
+    args = parser.parse_args()
+    if args.quantized is None:
+        assert None not in (args.ckpt, args.base_ckpt, args.config), "--ckpt, --base-ckpt and --config are required"
+
+    main(args)
@@ -1 +1,11 @@
-from signbert import model
\ No newline at end of file
+import importlib
+
+
+# Subpackages are imported on first access, so `import signbert` stays cheap
+_SUBMODULES = ("model", "data_modules", "metrics", "retrieval")
+
+
+def __getattr__(name):
+    if name in _SUBMODULES:
+        return importlib.import_module(f"{__name__}.{name}")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
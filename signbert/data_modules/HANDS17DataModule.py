@@ -1,12 +1,10 @@
 import os
 
 import numpy as np
-import pandas as pd
 import lightning.pytorch as pl
 from torch.utils.data import DataLoader
 
 from signbert.data_modules.MaskKeypointDataset import MaskKeypointDataset, mask_keypoint_dataset_collate_fn
-from IPython import embed; from sys import exit
 
 
 class HANDS17DataModule(pl.LightningDataModule):
@@ -62,6 +60,8 @@ class HANDS17DataModule(pl.LightningDataModule):
         self.no_mask_joint = no_mask_joint
 
     def prepare_data(self):
+        # Only needed to create the splits, imported here as it is slow to import
+        import pandas as pd
         # Create preprocess directory if it does not exist
         if not os.path.isdir(HANDS17DataModule.PREPROCESS_DPATH):
             os.makedirs(HANDS17DataModule.PREPROCESS_DPATH)
@@ -367,6 +367,8 @@ def create_keypoints_video_with_images(keypoints_array, rgb_images, output_file,
     Returns:
         None
     """
+    import cv2
+
     num_frames, num_keypoints, _ = keypoints_array.shape
     frame_height, frame_width, _ = rgb_images[0].shape
 
@@ -378,7 +380,6 @@ def create_keypoints_video_with_images(keypoints_array, rgb_images, output_file,
         frame = rgb_images[frame_index].copy()  # Copy the RGB image to avoid modifying the original
 
         for kp_index in range(num_keypoints):
-            embed(); exit()
             x, y, _ = keypoints_array[frame_index, kp_index]
             # Draw a circle for each key point type
             color = (0, 0, 255)  # Red color (BGR format)
@@ -391,6 +392,8 @@ def create_keypoints_video_with_images(keypoints_array, rgb_images, output_file,
     out.release()
 
 def check_p_at_20(data_module):
+    from sys import exit
+    from IPython import embed
     embed(); exit()
 
 
@@ -9,10 +9,9 @@ from psutil import Process
 from torch.utils.data import DataLoader
 
 from signbert.data_modules.PretrainMaskKeypointDataset import PretrainMaskKeypointDataset, mask_keypoint_dataset_collate_fn
+from signbert.data_modules.utils import save_ragged_npy_arrays
 from signbert.utils import read_json
 
-from IPython import embed
-
 
 class How2SignDataModule(pl.LightningDataModule):
 
@@ -33,9 +32,13 @@ class How2SignDataModule(pl.LightningDataModule):
     TRAIN_IDXS_FPATH = os.path.join(PREPROCESS_DPATH, 'train_idxs.npy')
     VAL_IDXS_FPATH = os.path.join(PREPROCESS_DPATH, 'val_idxs.npy')
     TEST_IDXS_FPATH = os.path.join(PREPROCESS_DPATH, 'test_idxs.npy')
+    # Full-length training sequences, without splitting nor padding
+    TRAIN_RAGGED_FPATH = os.path.join(PREPROCESS_DPATH, 'train_ragged.npy')
+    TRAIN_RAGGED_NORM_FPATH = os.path.join(PREPROCESS_DPATH, 'train_ragged_norm.npy')
+    TRAIN_OFFSETS_FPATH = os.path.join(PREPROCESS_DPATH, 'train_offsets.npy')
     SEQ_PAD_VALUE = 0.0
 
-    def __init__(self, batch_size, normalize=False, R=0.3, m=5, K=8, max_disturbance=0.25):
+    def __init__(self, batch_size, normalize=False, R=0.3, m=5, K=8, max_disturbance=0.25, crop_len=None):
         super().__init__()
         self.batch_size = batch_size
         self.normalize = normalize
@@ -43,6 +46,9 @@ class How2SignDataModule(pl.LightningDataModule):
         self.m = m
         self.K = K
         self.max_disturbance = max_disturbance
+        # Training on random crops of full-length sequences if set, otherwise
+        # on sequences split into chunks of 500 frames
+        self.crop_len = crop_len
         self.means_fpath = How2SignDataModule.MEANS_FPATH
         self.stds_fpath = How2SignDataModule.STDS_FPATH
 
@@ -97,6 +103,21 @@ class How2SignDataModule(pl.LightningDataModule):
             )
             del test
             gc.collect()
+        # Full-length training sequences, randomly cropped when loaded
+        if self.crop_len is not None and (
+            not os.path.exists(How2SignDataModule.TRAIN_RAGGED_FPATH) or \
+            not os.path.exists(How2SignDataModule.TRAIN_RAGGED_NORM_FPATH) or \
+            not os.path.exists(How2SignDataModule.TRAIN_OFFSETS_FPATH)):
+            train = self._read_openpose_split(How2SignDataModule.TRAIN_SKELETON_DPATH)
+            save_ragged_npy_arrays(
+                train,
+                self._normalize_seqs(train),
+                How2SignDataModule.TRAIN_RAGGED_FPATH,
+                How2SignDataModule.TRAIN_RAGGED_NORM_FPATH,
+                How2SignDataModule.TRAIN_OFFSETS_FPATH
+            )
+            del train
+            gc.collect()
             
     def setup(self, stage=None):
         if stage == 'fit' or stage is None:
@@ -104,15 +125,29 @@ class How2SignDataModule(pl.LightningDataModule):
             X_val_fpath = How2SignDataModule.VAL_NORM_FPATH if self.normalize else How2SignDataModule.VAL_FPATH
             X_test_fpath = How2SignDataModule.TEST_NORM_FPATH if self.normalize else How2SignDataModule.TEST_FPATH
 
-            self.setup_train = PretrainMaskKeypointDataset(
-                How2SignDataModule.TRAIN_IDXS_FPATH, 
-                X_train_fpath, 
-                self.R, 
-                self.m, 
-                self.K, 
-                self.max_disturbance,
-                openpose=True
-            )
+            if self.crop_len is not None:
+                X_train_ragged_fpath = How2SignDataModule.TRAIN_RAGGED_NORM_FPATH if self.normalize else How2SignDataModule.TRAIN_RAGGED_FPATH
+                self.setup_train = PretrainMaskKeypointDataset(
+                    None,
+                    X_train_ragged_fpath,
+                    self.R,
+                    self.m,
+                    self.K,
+                    self.max_disturbance,
+                    openpose=True,
+                    offsets_fpath=How2SignDataModule.TRAIN_OFFSETS_FPATH,
+                    crop_len=self.crop_len
+                )
+            else:
+                self.setup_train = PretrainMaskKeypointDataset(
+                    How2SignDataModule.TRAIN_IDXS_FPATH, 
+                    X_train_fpath, 
+                    self.R, 
+                    self.m, 
+                    self.K, 
+                    self.max_disturbance,
+                    openpose=True
+                )
             self.setup_val = PretrainMaskKeypointDataset(
                 How2SignDataModule.VAL_IDXS_FPATH,
                 X_val_fpath, 
@@ -293,6 +328,7 @@ class How2SignDataModule(pl.LightningDataModule):
 
 
 if __name__ == '__main__':
+    from IPython import embed
 
     d = How2SignDataModule(
         batch_size=32,
@@ -7,10 +7,9 @@ import lightning.pytorch as pl
 from torch.utils.data import DataLoader
 
 from signbert.data_modules.PretrainMaskKeypointDataset import PretrainMaskKeypointDataset, mask_keypoint_dataset_collate_fn
+from signbert.data_modules.utils import save_ragged_npy_arrays
 from signbert.utils import read_txt_as_list, dict_to_json_file
 
-from IPython import embed
-
 
 class MSASLDataModule(pl.LightningDataModule):
 
@@ -36,12 +35,16 @@ class MSASLDataModule(pl.LightningDataModule):
     TRAIN_IDXS_FPATH = os.path.join(PREPROCESS_DPATH, 'train_idxs.npy')
     VAL_IDXS_FPATH = os.path.join(PREPROCESS_DPATH, 'val_idxs.npy')
     TEST_IDXS_FPATH = os.path.join(PREPROCESS_DPATH, 'test_idxs.npy')
+    # Full-length training sequences, without splitting nor padding
+    TRAIN_RAGGED_FPATH = os.path.join(PREPROCESS_DPATH, 'train_ragged.npy')
+    TRAIN_RAGGED_NORM_FPATH = os.path.join(PREPROCESS_DPATH, 'train_ragged_norm.npy')
+    TRAIN_OFFSETS_FPATH = os.path.join(PREPROCESS_DPATH, 'train_offsets.npy')
     TRAIN_MAPPING_IDXS_FPATH = os.path.join(PREPROCESS_DPATH, 'train_mapping_idxs.json')
     VAL_MAPPING_IDXS_FPATH = os.path.join(PREPROCESS_DPATH, 'val_mapping_idxs.json')
     TEST_MAPPING_IDXS_FPATH = os.path.join(PREPROCESS_DPATH, 'test_mapping_idxs.json')
     SEQ_PAD_VALUE = 0.0
 
-    def __init__(self, batch_size, normalize=False, R=0.3, m=5, K=8, max_disturbance=0.25):
+    def __init__(self, batch_size, normalize=False, R=0.3, m=5, K=8, max_disturbance=0.25, crop_len=None):
         super().__init__()
         self.batch_size = batch_size
         self.normalize = normalize
@@ -49,6 +52,9 @@ class MSASLDataModule(pl.LightningDataModule):
         self.m = m
         self.K = K
         self.max_disturbance = max_disturbance
+        # Training on random crops of full-length sequences if set, otherwise
+        # on sequences split into chunks of 500 frames
+        self.crop_len = crop_len
         self.means_fpath = MSASLDataModule.MEANS_FPATH
         self.stds_fpath = MSASLDataModule.STDS_FPATH
 
@@ -144,6 +150,29 @@ class MSASLDataModule(pl.LightningDataModule):
                 MSASLDataModule.TEST_IDXS_FPATH,
                 MSASLDataModule.TEST_MAPPING_IDXS_FPATH
             )
+        # Full-length training sequences, randomly cropped when loaded
+        if self.crop_len is not None and (
+            not os.path.exists(MSASLDataModule.TRAIN_RAGGED_FPATH) or \
+            not os.path.exists(MSASLDataModule.TRAIN_RAGGED_NORM_FPATH) or \
+            not os.path.exists(MSASLDataModule.TRAIN_OFFSETS_FPATH)):
+            missing_idxs = read_txt_as_list(MSASLDataModule.MISSING_VIDEOS_FPATH)
+            train_skeleton_fpaths = glob.glob(
+                os.path.join(MSASLDataModule.TRAIN_SKELETON_DPATH, '*.npy')
+            )
+            train = [
+                np.load(f)
+                for f in train_skeleton_fpaths
+                if os.path.basename(f).split('.npy')[0] not in missing_idxs
+            ]
+            save_ragged_npy_arrays(
+                train,
+                self._normalize_seqs(train),
+                MSASLDataModule.TRAIN_RAGGED_FPATH,
+                MSASLDataModule.TRAIN_RAGGED_NORM_FPATH,
+                MSASLDataModule.TRAIN_OFFSETS_FPATH
+            )
+            del train
+            gc.collect()
             
     def setup(self, stage=None):
         if stage == 'fit' or stage is None:
@@ -151,14 +180,27 @@ class MSASLDataModule(pl.LightningDataModule):
             X_val_fpath = MSASLDataModule.VAL_NORM_FPATH if self.normalize else MSASLDataModule.VAL_FPATH
             X_test_fpath = MSASLDataModule.TEST_NORM_FPATH if self.normalize else MSASLDataModule.TEST_FPATH
 
-            self.setup_train = PretrainMaskKeypointDataset(
-                MSASLDataModule.TRAIN_IDXS_FPATH, 
-                X_train_fpath, 
-                self.R, 
-                self.m, 
-                self.K, 
-                self.max_disturbance
-            )
+            if self.crop_len is not None:
+                X_train_ragged_fpath = MSASLDataModule.TRAIN_RAGGED_NORM_FPATH if self.normalize else MSASLDataModule.TRAIN_RAGGED_FPATH
+                self.setup_train = PretrainMaskKeypointDataset(
+                    None,
+                    X_train_ragged_fpath,
+                    self.R,
+                    self.m,
+                    self.K,
+                    self.max_disturbance,
+                    offsets_fpath=MSASLDataModule.TRAIN_OFFSETS_FPATH,
+                    crop_len=self.crop_len
+                )
+            else:
+                self.setup_train = PretrainMaskKeypointDataset(
+                    MSASLDataModule.TRAIN_IDXS_FPATH, 
+                    X_train_fpath, 
+                    self.R, 
+                    self.m, 
+                    self.K, 
+                    self.max_disturbance
+                )
             self.setup_val = PretrainMaskKeypointDataset(
                 MSASLDataModule.VAL_IDXS_FPATH,
                 X_val_fpath, 
@@ -318,6 +360,7 @@ class MSASLDataModule(pl.LightningDataModule):
 
 
 if __name__ == '__main__':
+    from IPython import embed
 
     d = MSASLDataModule(
         batch_size=32,
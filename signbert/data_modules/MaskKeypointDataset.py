@@ -4,14 +4,15 @@ import torch
 import numpy as np
 from torch.utils.data import Dataset
 
-from signbert.data_modules.utils import mask_transform, mask_transform_identity
-
-from IPython import embed; from sys import exit
+from signbert.data_modules.utils import mask_transform, mask_transform_identity, load_npy
 
 
 file_lock = Lock()
 
 class MaskKeypointDataset(Dataset):
+    # Set to "r" to memory-map the keypoints arrays instead of reading them,
+    # e.g. by processes running several trainings in a row
+    MMAP_MODE = None
 
     def __init__(
             self, 
@@ -32,7 +33,7 @@ class MaskKeypointDataset(Dataset):
         super().__init__()
         with file_lock:
             self.idxs = np.load(idxs_fpath)
-            self.data = np.load(npy_fpath)
+            self.data = load_npy(npy_fpath, self.MMAP_MODE)
         # Max. number of frames to mask, ablation study, 0.4
         self.R = R
         # Number of joints to take when performing joint masking, ablation study
@@ -1,19 +1,95 @@
+import copy
+
 import torch
 import numpy as np
 import lightning.pytorch as pl
+from torch.utils.data import DataLoader, DistributedSampler
 from lightning.pytorch.utilities import CombinedLoader
+from lightning.pytorch.trainer.states import TrainerFn
 
 from signbert.utils import my_import
+from signbert.data_modules.ResumableSampler import ResumableSampler, derive_seed
+from signbert.data_modules.PretrainMaskKeypointDataset import (
+    CachedSubset,
+    TaggedConcatDataset,
+    stratified_subset_idxs,
+    tagged_mask_keypoint_dataset_collate_fn
+)
+
+
+class _ScheduledLoader:
+    """
+    Iterable over a dataloader that yields nothing unless `should_run()`.
+
+    It has no length, as the number of batches changes between validations.
+    """
+    def __init__(self, dataloader, should_run):
+        self.dataloader = dataloader
+        self.should_run = should_run
+
+    def __iter__(self):
+        if self.should_run():
+            yield from self.dataloader
 
 
 class PretrainDataModule(pl.LightningDataModule):
+    """
+    Data module combining the pre-training datasets.
 
-    def __init__(self, datasets, batch_size, normalize=False, mode="sequential"):
+    Two modes are supported:
+    - "sequential": each training batch is a dict with one batch per dataset.
+    - "mixed": each training batch mixes samples from all the datasets, drawn
+    with the `weight` given to each dataset in `datasets` (default is 1, i.e.
+    datasets are sampled uniformly regardless of their size). Batches carry
+    the index of the dataset of each sample, see `dataset_keys`.
+    Validation batches always come from a single dataset.
+
+    Training is resumable mid-epoch: the sampling order and the masks only
+    depend on `seed`, the epoch and the sample index, and the number of
+    batches consumed in the epoch is saved in the checkpoints. On resume, the
+    samplers skip the consumed samples without reading them. Samplers shard
+    the data themselves, so the Trainer must run with
+    `use_distributed_sampler=False`. The Trainer then does not shard the
+    validation loaders either, they are sharded here with non-shuffling
+    `DistributedSampler`s, as the Trainer would.
+
+    If `val_subset_size` is set, validation runs on a fixed subset of each
+    validation set, stratified by sequence length and cached with its masks,
+    and logs `val_loss`/`val_PCK_20`. The full validation sets are only
+    evaluated by the first validation of every `full_val_every_n_epochs`
+    epochs, logged as `val_full_loss`/`val_full_PCK_20`.
+    """
+    MODES = ("sequential", "mixed")
+
+    def __init__(
+            self, 
+            datasets, 
+            batch_size, 
+            normalize=False, 
+            mode="sequential", 
+            num_workers=0, 
+            seed=0,
+            val_subset_size=None,
+            full_val_every_n_epochs=1
+        ):
         super().__init__()
+        assert mode in PretrainDataModule.MODES, f"Unknown mode: {mode}"
         self.datasets = datasets
         self.batch_size = batch_size
         self.normalize = normalize
         self.mode = mode
+        self.num_workers = num_workers
+        self.seed = seed
+        # Pipeline position restored from a checkpoint, see `load_state_dict`
+        self._resume_state = None
+        # Number of samples of the validation subset of each dataset
+        self.val_subset_size = val_subset_size
+        self.full_val_every_n_epochs = full_val_every_n_epochs
+        # Window of epochs of the last full validation, none has run yet so
+        # the first epoch is evaluated on the full sets
+        self._last_full_val_window = -1
+        self._full_val_step = None
+        self.dataset_keys = list(datasets.keys())
         self.means = {}
         self.stds = {}
 
@@ -22,32 +98,233 @@ class PretrainDataModule(pl.LightningDataModule):
             module_cls = my_import(v["module_cls"])
             dataset_args = v.get("dataset_args", dict())
             data_module = module_cls(
-                batch_size=self.batch_size, 
-                normalize=self.normalize, 
+                batch_size=self.batch_size,
+                normalize=self.normalize,
                 **dataset_args
             )
             data_module.prepare_data()
-        
+
     def setup(self, stage=None):
         if stage == "fit" or stage is None:
-            self.train_dataloaders = {}
+            self.train_datasets = {}
+            self.train_loader_args = {}
             self.val_dataloaders = {}
-            for k, v in self.datasets.items():
+            self.val_subset_dataloaders = {}
+            for i, (k, v) in enumerate(self.datasets.items()):
                 module_cls = my_import(v["module_cls"])
                 dataset_args = v.get("dataset_args", dict())
                 data_module = module_cls(
-                    batch_size=self.batch_size, 
-                    normalize=self.normalize, 
+                    batch_size=self.batch_size,
+                    normalize=self.normalize,
                     **dataset_args
                 )
                 data_module.setup()
-                self.train_dataloaders[k] = data_module.train_dataloader()
+                self.train_datasets[k] = data_module.setup_train
+                # Seeded masking, distinct for each dataset
+                self.train_datasets[k].seed = derive_seed(self.seed, i)
+                # Loaders are rebuilt around resumable samplers, with the
+                # collate function and drop policy of the data module
+                train_dataloader = data_module.train_dataloader()
+                self.train_loader_args[k] = dict(
+                    collate_fn=train_dataloader.collate_fn,
+                    drop_last=train_dataloader.drop_last
+                )
                 self.val_dataloaders[k] = data_module.val_dataloader()
+                if self.val_subset_size is not None:
+                    self.val_subset_dataloaders[k] = self._val_subset_dataloader(
+                        self.val_dataloaders[k], 
+                        derive_seed(self.seed, i, 1)
+                    )
                 self.means[k] = torch.from_numpy(np.load(data_module.means_fpath))
                 self.stds[k] = torch.from_numpy(np.load(data_module.stds_fpath))
-    
+            # (K, 2) tables, indexed by the dataset indices of mixed batches
+            self.means_table = torch.stack([self.means[k] for k in self.dataset_keys])
+            self.stds_table = torch.stack([self.stds[k] for k in self.dataset_keys])
+
     def train_dataloader(self):
-        return CombinedLoader(self.train_dataloaders)
-    
+        num_replicas = self.trainer.world_size if self.trainer is not None else 1
+        rank = self.trainer.global_rank if self.trainer is not None else 0
+        resume_state = self._resume_state
+        if self.mode == "sequential":
+            self.train_samplers = {}
+            dataloaders = {}
+            for i, k in enumerate(self.dataset_keys):
+                dataset = self.train_datasets[k]
+                self.train_samplers[k] = ResumableSampler(
+                    dataset,
+                    seed=derive_seed(self.seed, i),
+                    num_replicas=num_replicas,
+                    rank=rank
+                )
+                dataloaders[k] = DataLoader(
+                    dataset,
+                    batch_size=self.batch_size,
+                    sampler=self.train_samplers[k],
+                    num_workers=self.num_workers,
+                    **self.train_loader_args[k]
+                )
+            self._resume_samplers(resume_state)
+            return CombinedLoader(dataloaders)
+        datasets = [self.train_datasets[k] for k in self.dataset_keys]
+        dataset = TaggedConcatDataset(datasets)
+        # Each sample is weighted so datasets are drawn according to their
+        # weight and not to their size
+        sample_weights = torch.cat([
+            torch.full((len(d),), self.datasets[k].get("weight", 1.) / len(d), dtype=torch.double)
+            for k, d in zip(self.dataset_keys, datasets)
+        ])
+        self.train_samplers = {
+            "mixed": ResumableSampler(
+                dataset,
+                weights=sample_weights,
+                seed=self.seed,
+                num_replicas=num_replicas,
+                rank=rank
+            )
+        }
+        self._resume_samplers(resume_state)
+        return DataLoader(
+            dataset,
+            batch_size=self.batch_size,
+            sampler=self.train_samplers["mixed"],
+            collate_fn=tagged_mask_keypoint_dataset_collate_fn,
+            num_workers=self.num_workers,
+            drop_last=True
+        )
+
     def val_dataloader(self):
-        return CombinedLoader(self.val_dataloaders, mode="sequential")
\ No newline at end of file
+        val_dataloaders = {k: self._shard(v) for k, v in self.val_dataloaders.items()}
+        if self.val_subset_size is None:
+            return CombinedLoader(val_dataloaders, mode="sequential")
+        # The subsets run at every validation, the full sets when scheduled
+        dataloaders = {k: self._shard(v) for k, v in self.val_subset_dataloaders.items()}
+        for k, dataloader in val_dataloaders.items():
+            dataloaders[f"{k}_full"] = _ScheduledLoader(dataloader, self._full_validation_due)
+
+        return CombinedLoader(dataloaders, mode="sequential")
+
+    def val_dataloader_info(self, dataloader_idx):
+        """
+        Identify a validation dataloader.
+
+        Parameters:
+        dataloader_idx (int): The index of the dataloader.
+
+        Returns:
+        tuple: The dataset key and whether the dataloader is over a full
+        validation set while subsets are in use.
+        """
+        n_datasets = len(self.dataset_keys)
+        full = self.val_subset_size is not None and dataloader_idx >= n_datasets
+
+        return self.dataset_keys[dataloader_idx % n_datasets], full
+
+    def _shard(self, dataloader):
+        """Rebuild a validation dataloader over the shard of this process."""
+        if self.trainer is None or self.trainer.world_size == 1:
+            return dataloader
+        sampler = DistributedSampler(
+            dataloader.dataset,
+            num_replicas=self.trainer.world_size,
+            rank=self.trainer.global_rank,
+            shuffle=False
+        )
+
+        return DataLoader(
+            dataloader.dataset,
+            batch_size=dataloader.batch_size,
+            sampler=sampler,
+            collate_fn=dataloader.collate_fn,
+            num_workers=dataloader.num_workers,
+            pin_memory=dataloader.pin_memory,
+            drop_last=dataloader.drop_last
+        )
+
+    def _val_subset_dataloader(self, dataloader, seed):
+        """Build the dataloader of the cached validation subset of a dataset."""
+        # Masks of the cached samples are drawn once, from a fixed seed. The
+        # dataset is shared with the full validation loader, so a shallow copy
+        # is seeded and the full set keeps its own masks
+        dataset = copy.copy(dataloader.dataset)
+        dataset.seed = seed
+        idxs = stratified_subset_idxs(dataset, self.val_subset_size, seed)
+
+        return DataLoader(
+            CachedSubset(dataset, idxs),
+            batch_size=dataloader.batch_size,
+            collate_fn=dataloader.collate_fn
+        )
+
+    def _full_validation_due(self):
+        """Whether the running validation evaluates the full validation sets."""
+        trainer = self.trainer
+        if trainer is None or trainer.state.fn != TrainerFn.FITTING:
+            return True
+        # Already decided for this validation, by a previous dataloader
+        if self._full_val_step == trainer.global_step:
+            return True
+        window = trainer.current_epoch // self.full_val_every_n_epochs
+        if window > self._last_full_val_window:
+            self._last_full_val_window = window
+            self._full_val_step = trainer.global_step
+            return True
+
+        return False
+
+    def state_dict(self):
+        """
+        Position of the training data pipeline, saved in the checkpoints.
+
+        Returns:
+        dict: The seed, the epoch, the number of batches consumed in the epoch
+        and, per sampler, the pass it is in and the number of consumed indices.
+        """
+        if self.trainer is None or not hasattr(self, "train_samplers"):
+            return {}
+        epoch = self.trainer.fit_loop.epoch_progress.current.processed
+        batches = self.trainer.fit_loop.epoch_loop.batch_progress.current.processed
+        samplers = {}
+        for k, sampler in self.train_samplers.items():
+            # Shorter loaders are cycled by the CombinedLoader
+            n_batches = max(len(sampler) // self.batch_size, 1)
+            samplers[k] = dict(
+                cycle=batches // n_batches,
+                skip=(batches % n_batches) * self.batch_size
+            )
+
+        return dict(
+            seed=self.seed,
+            mode=self.mode,
+            epoch=epoch,
+            batches=batches,
+            samplers=samplers,
+            last_full_val_window=self._last_full_val_window
+        )
+
+    def load_state_dict(self, state_dict):
+        """
+        Restore the position of the training data pipeline, applied when the
+        training dataloader is built.
+
+        Parameters:
+        state_dict (dict): The state returned by `state_dict`.
+        """
+        if not state_dict:
+            return
+        if state_dict["seed"] != self.seed or state_dict["mode"] != self.mode:
+            print("Data pipeline seed or mode changed, the resumed epoch restarts from scratch")
+            return
+        self._resume_state = state_dict
+        self._last_full_val_window = state_dict.get("last_full_val_window", -1)
+
+    def _resume_samplers(self, resume_state):
+        """Make the samplers skip the indices consumed before the checkpoint."""
+        if resume_state is None:
+            return
+        for k, sampler in self.train_samplers.items():
+            sampler_state = resume_state["samplers"].get(k)
+            if sampler_state is not None:
+                # Also sets the sampler and dataset epoch, the loader may be
+                # iterated before Lightning sets it
+                sampler.resume(resume_state["epoch"], sampler_state["cycle"], sampler_state["skip"])
+        self._resume_state = None
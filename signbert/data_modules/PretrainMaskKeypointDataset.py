@@ -1,17 +1,21 @@
+import bisect
 from multiprocessing import Lock
 
 import torch
 import numpy as np
-from torch.utils.data import Dataset
+from torch.utils.data import Dataset, ConcatDataset
 
-from signbert.data_modules.utils import mask_transform, mask_transform_identity
+from signbert.data_modules.utils import mask_transform, mask_transform_identity, load_npy
+from signbert.data_modules.ResumableSampler import derive_seed
 
-from IPython import embed; from sys import exit
 
 file_lock = Lock()
 
 
 class PretrainMaskKeypointDataset(Dataset):
+    # Set to "r" to memory-map the keypoints arrays instead of reading them,
+    # e.g. by processes running several trainings in a row
+    MMAP_MODE = None
 
     def __init__(
             self, 
@@ -23,17 +27,34 @@ class PretrainMaskKeypointDataset(Dataset):
             max_disturbance=0.25, 
             identity=False,
             no_mask_joint=False,
-            openpose=False
+            openpose=False,
+            seed=None,
+            offsets_fpath=None,
+            crop_len=None
         ):
         """In the paper they perform an ablation on the MSASL dataset:
             - R: 40%
             - m: not provided
             - K: 8
+
+        If `seed` is given, the masking of a sample only depends on the seed,
+        the epoch and the sample index, so it does not depend on the order
+        samples are read in, nor on the DataLoader worker reading them.
+
+        If `offsets_fpath` is given, `npy_fpath` holds full-length sequences
+        stored without padding (see `save_ragged_npy_arrays`) and `idxs_fpath`
+        may be None. Sequences longer than `crop_len` are then randomly
+        cropped to `crop_len` frames each time they are read.
         """
         super().__init__()
         with file_lock:
-            self.idxs = np.load(idxs_fpath)
-            self.data = np.load(npy_fpath)
+            self.data = load_npy(npy_fpath, self.MMAP_MODE)
+            # Ragged storage, sequence i spans the frames offsets[i]:offsets[i+1]
+            self.offsets = np.load(offsets_fpath) if offsets_fpath is not None else None
+            n_seqs = len(self.data) if self.offsets is None else len(self.offsets) - 1
+            self.idxs = np.load(idxs_fpath) if idxs_fpath is not None else np.arange(n_seqs, dtype=np.int32)
+        # Length of the random crops of ragged sequences, None to read them whole
+        self.crop_len = crop_len
         # Max. number of frames to mask, ablation study, 0.4
         self.R = R
         # Number of joints to take when performing joint masking, ablation study
@@ -45,13 +66,22 @@ class PretrainMaskKeypointDataset(Dataset):
         self.identity = identity
         self.no_mask_joint = no_mask_joint
         self.openpose = openpose
+        # Masking seed, None to use the global numpy random state
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        """Set the epoch, masks are drawn anew each epoch when seeded."""
+        self.epoch = epoch
 
     def __len__(self):
-        return len(self.data)
+        return len(self.idxs)
     
     def __getitem__(self, idx):
         seq_idx = self.idxs[idx]
-        seq = self.data[idx]
+        # Per-sample random state, so resuming an epoch reproduces its crops and masks
+        rng = np.random if self.seed is None else np.random.RandomState(derive_seed(self.seed, self.epoch, idx))
+        seq = self._read_seq(idx, rng)
         score = seq[...,-1]
         seq = seq[...,:-1]
         # MSASL dataset has Openpose keypoints computed with scores
@@ -68,11 +98,11 @@ class PretrainMaskKeypointDataset(Dataset):
             lhand_scores = score[:, 91:112]
             rhand_scores = score[:, 112:133]
         if self.identity:
-            rhand_masked, rhand_masked_frames_idx = mask_transform_identity(rhand, self.R, self.max_disturbance, self.no_mask_joint, self.K, self.m)
-            lhand_masked, lhand_masked_frames_idx = mask_transform_identity(lhand, self.R, self.max_disturbance, self.no_mask_joint, self.K, self.m)
+            rhand_masked, rhand_masked_frames_idx = mask_transform_identity(rhand, self.R, self.max_disturbance, self.no_mask_joint, self.K, self.m, rng)
+            lhand_masked, lhand_masked_frames_idx = mask_transform_identity(lhand, self.R, self.max_disturbance, self.no_mask_joint, self.K, self.m, rng)
         else:
-            rhand_masked, rhand_masked_frames_idx = mask_transform(rhand, self.R, self.max_disturbance, self.no_mask_joint, self.K, self.m)
-            lhand_masked, lhand_masked_frames_idx = mask_transform(lhand, self.R, self.max_disturbance, self.no_mask_joint, self.K, self.m)
+            rhand_masked, rhand_masked_frames_idx = mask_transform(rhand, self.R, self.max_disturbance, self.no_mask_joint, self.K, self.m, rng)
+            lhand_masked, lhand_masked_frames_idx = mask_transform(lhand, self.R, self.max_disturbance, self.no_mask_joint, self.K, self.m, rng)
 
         return (
             seq_idx, 
@@ -87,12 +117,25 @@ class PretrainMaskKeypointDataset(Dataset):
             lhand_scores,
         )
 
+    def _read_seq(self, idx, rng):
+        """Read a sequence, randomly cropped to `crop_len` frames if ragged."""
+        if self.offsets is None:
+            return self.data[idx]
+        start, end = self.offsets[idx], self.offsets[idx+1]
+        if self.crop_len is not None and end - start > self.crop_len:
+            start += rng.randint(end - start - self.crop_len + 1)
+            end = start + self.crop_len
+
+        return self.data[start:end]
+
 
 def mask_keypoint_dataset_collate_fn(batch):
     """
     Custom DataLoader collate function.
 
-    Adds padding and changes data format so it can be batched.
+    Adds padding and changes data format so it can be batched. Sequences are
+    padded with zeros to the longest one, so samples coming from datasets 
+    with different sequence lengths can be batched together.
     """
     seq_idxs = [] 
     arms_seqs = []
@@ -109,6 +152,10 @@ def mask_keypoint_dataset_collate_fn(batch):
     rhand_pad_value = rhand_n_masked_frames_idxs.max() - rhand_n_masked_frames_idxs
     lhand_n_masked_frames_idxs = np.array([len(b[8]) for b in batch])
     lhand_pad_value = lhand_n_masked_frames_idxs.max() - lhand_n_masked_frames_idxs
+    # Find sequences pad lengths
+    seq_lens = np.array([len(b[2]) for b in batch])
+    seq_pad_value = seq_lens.max() - seq_lens
+    pad_seq = lambda x, i: np.pad(x, [(0, seq_pad_value[i])] + [(0, 0)] * (x.ndim - 1))
     for i in range(len(batch)):
         (seq_idx, 
         arms,
@@ -122,15 +169,15 @@ def mask_keypoint_dataset_collate_fn(batch):
         lhand_scores) = batch[i]
 
         seq_idxs.append(seq_idx) 
-        arms_seqs.append(arms)
-        rhand_seqs.append(rhand)
-        rhand_masked_seqs.append(rhand_masked)
+        arms_seqs.append(pad_seq(arms, i))
+        rhand_seqs.append(pad_seq(rhand, i))
+        rhand_masked_seqs.append(pad_seq(rhand_masked, i))
         rhand_masked_frames_idx_seqs.append(np.pad(rhand_masked_frames_idx, (0, rhand_pad_value[i]), mode='constant', constant_values=-1.))
-        rhand_scores_seqs.append(rhand_scores)
-        lhand_seqs.append(lhand) 
-        lhand_masked_seqs.append(lhand_masked)
+        rhand_scores_seqs.append(pad_seq(rhand_scores, i))
+        lhand_seqs.append(pad_seq(lhand, i)) 
+        lhand_masked_seqs.append(pad_seq(lhand_masked, i))
         lhand_masked_frames_idx_seqs.append(np.pad(lhand_masked_frames_idx, (0, lhand_pad_value[i]), mode='constant', constant_values=-1.))
-        lhand_scores_seqs.append(lhand_scores)
+        lhand_scores_seqs.append(pad_seq(lhand_scores, i))
         
     seq_idxs = np.array(seq_idxs) 
     arms_seqs = np.stack(arms_seqs)
@@ -165,4 +212,88 @@ def mask_keypoint_dataset_collate_fn(batch):
         lhand_masked_seqs,
         lhand_masked_frames_idx_seqs,
         lhand_scores_seqs,
-    )
\ No newline at end of file
+    )
+
+class TaggedConcatDataset(ConcatDataset):
+    """
+    Concatenation of datasets whose samples are tagged with the index of the
+    dataset they come from.
+
+    Samples are returned as the wrapped dataset samples followed by the
+    dataset index. Use with `tagged_mask_keypoint_dataset_collate_fn`.
+    """
+    def set_epoch(self, epoch):
+        """Forward the epoch to the wrapped datasets."""
+        for dataset in self.datasets:
+            if hasattr(dataset, "set_epoch"):
+                dataset.set_epoch(epoch)
+
+    def __getitem__(self, idx):
+        if idx < 0:
+            idx = len(self) + idx
+        # Find the dataset the index belongs to
+        dataset_idx = bisect.bisect_right(self.cumulative_sizes, idx)
+        sample = super().__getitem__(idx)
+        
+        return (*sample, dataset_idx)
+
+
+def tagged_mask_keypoint_dataset_collate_fn(batch):
+    """
+    Custom DataLoader collate function for `TaggedConcatDataset` samples.
+
+    Returns the `mask_keypoint_dataset_collate_fn` batch followed by the (N,)
+    dataset indices.
+    """
+    dataset_idxs = torch.tensor([b[-1] for b in batch], dtype=torch.int64)
+    batch = mask_keypoint_dataset_collate_fn([b[:-1] for b in batch])
+
+    return (*batch, dataset_idxs)
+
+
+class CachedSubset(Dataset):
+    """
+    A fixed subset of a dataset, whose samples are read and masked once.
+
+    Samples are materialized when the subset is created, so evaluating on it
+    repeatedly neither reads the data nor draws new masks.
+    """
+    def __init__(self, dataset, idxs):
+        super().__init__()
+        self.idxs = np.asarray(idxs)
+        self.samples = [dataset[i] for i in self.idxs]
+
+    def __len__(self):
+        return len(self.samples)
+
+    def __getitem__(self, idx):
+        return self.samples[idx]
+
+
+def stratified_subset_idxs(dataset, size, seed=0):
+    """
+    Draw sample indices stratified by sequence length.
+
+    Samples are sorted by their number of non-padding frames and split into
+    `size` strata of consecutive lengths, one sample is drawn per stratum.
+
+    Parameters:
+    dataset (PretrainMaskKeypointDataset): The dataset to draw from.
+    size (int): The number of samples to draw.
+    seed (int): The random seed. Default is 0.
+
+    Returns:
+    numpy.ndarray: The sorted indices of the drawn samples.
+    """
+    if size >= len(dataset):
+        return np.arange(len(dataset))
+    if dataset.offsets is not None:
+        lengths = np.diff(dataset.offsets)
+    else:
+        # Padding frames are all zeros
+        lengths = (dataset.data[..., :-1] != 0).any((2, 3)).sum(1)
+    order = np.argsort(lengths, kind="stable")
+    rng = np.random.RandomState(seed)
+    idxs = [rng.choice(stratum) for stratum in np.array_split(order, size)]
+
+    return np.sort(idxs)
@@ -0,0 +1,145 @@
+import numpy as np
+import torch
+from torch.utils.data import Sampler
+
+
+def derive_seed(*keys):
+    """
+    Derive a 32 bits seed from a sequence of integers, e.g. (seed, epoch, idx).
+
+    Parameters:
+    keys (int): The integers the seed is derived from.
+
+    Returns:
+    int: The derived seed.
+    """
+    return int(np.random.SeedSequence([int(k) for k in keys]).generate_state(1)[0])
+
+
+class ResumableSampler(Sampler):
+    """
+    Sampler whose order only depends on its seed and the epoch, and which can
+    resume an epoch part way through.
+
+    The order of each pass over the data is drawn from (seed, epoch, cycle),
+    where `cycle` counts the passes within an epoch (shorter loaders are cycled
+    by `CombinedLoader`). Resuming skips the consumed indices, so the skipped
+    samples are never read. When running multi-process, the sampler shards the
+    order itself, so it must not be wrapped in a `DistributedSampler`.
+
+    Attributes:
+    data_source (Dataset): The sampled dataset. If it has a `set_epoch`
+    method, it is called along with the sampler one.
+    shuffle (bool): Whether to shuffle the indices.
+    weights (Tensor): Per-sample weights, if given samples are drawn with
+    replacement.
+    num_samples (int): The number of indices drawn per pass, over all replicas.
+    seed (int): The base seed.
+    num_replicas (int): The number of processes the order is sharded across.
+    rank (int): The shard of this process.
+    epoch (int): The current epoch.
+    """
+    def __init__(self, data_source, shuffle=False, weights=None, num_samples=None, seed=0, num_replicas=1, rank=0):
+        """
+        Initialize the ResumableSampler.
+
+        Parameters:
+        data_source (Dataset): The dataset to sample from.
+        shuffle (bool): Whether to shuffle the indices. Default is False.
+        weights (Tensor, optional): Per-sample weights. If given, samples are
+        drawn with replacement according to them and `shuffle` is ignored.
+        num_samples (int, optional): The number of indices drawn per pass.
+        Default is the dataset size.
+        seed (int): The base seed. Default is 0.
+        num_replicas (int): The number of processes. Default is 1.
+        rank (int): The rank of this process. Default is 0.
+        """
+        self.data_source = data_source
+        self.shuffle = shuffle
+        self.weights = weights
+        self.num_samples = num_samples if num_samples is not None else len(data_source)
+        self.seed = seed
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.epoch = 0
+        self._cycle = 0
+        # Pending resume state: (epoch, cycle, number of indices to skip)
+        self._resume = None
+
+    def __len__(self):
+        """Returns the number of indices drawn per pass by this process."""
+        return self.num_samples // self.num_replicas
+
+    def set_epoch(self, epoch):
+        """
+        Set the epoch, called by Lightning before each training epoch.
+
+        The pass count only restarts when the epoch changes: on resume the
+        iterator may be built, and the first pass drawn, before Lightning sets
+        the epoch.
+
+        Parameters:
+        epoch (int): The epoch.
+        """
+        if epoch != self.epoch:
+            self._cycle = 0
+        self.epoch = epoch
+        if hasattr(self.data_source, "set_epoch"):
+            self.data_source.set_epoch(epoch)
+
+    def resume(self, epoch, cycle, skip):
+        """
+        Skip the first indices of a given pass, the next time it is iterated.
+
+        The sampler is moved to that pass at once, so it is resumed even when
+        iterated before `set_epoch`, e.g. by prefetching workers.
+
+        Parameters:
+        epoch (int): The epoch of the pass.
+        cycle (int): The pass within the epoch.
+        skip (int): The number of indices of this process to skip.
+        """
+        self._resume = (epoch, cycle, skip)
+        self.epoch = epoch
+        self._cycle = cycle
+        if hasattr(self.data_source, "set_epoch"):
+            self.data_source.set_epoch(epoch)
+
+    def __iter__(self):
+        generator = torch.Generator()
+        generator.manual_seed(derive_seed(self.seed, self.epoch, self._cycle))
+        if self.weights is not None:
+            order = torch.multinomial(self.weights, self.num_samples, replacement=True, generator=generator)
+        elif self.shuffle:
+            order = torch.randperm(self.num_samples, generator=generator)
+        else:
+            order = torch.arange(self.num_samples)
+        # Every process draws the same order and keeps its own shard
+        order = order[:len(self) * self.num_replicas][self.rank::self.num_replicas]
+        skip = 0
+        if self._resume is not None and self._resume[:2] == (self.epoch, self._cycle):
+            skip = self._resume[2]
+            self._resume = None
+        self._cycle += 1
+
+        return iter(order[skip:].tolist())
+
+
+if __name__ == '__main__':
+
+    sampler = ResumableSampler(range(10), shuffle=True, seed=0)
+    sampler.set_epoch(1)
+    full = list(sampler)
+    second = list(sampler)
+    # Resumed sampler, iterated before the epoch is set
+    sampler = ResumableSampler(range(10), shuffle=True, seed=0)
+    sampler.resume(1, 0, 4)
+    assert list(sampler) == full[4:]
+    sampler.set_epoch(1)
+    assert list(sampler) == second
+    # Resumed in the second pass of the epoch
+    sampler = ResumableSampler(range(10), shuffle=True, seed=0)
+    sampler.resume(1, 1, 3)
+    sampler.set_epoch(1)
+    assert list(sampler) == second[3:]
+    print(full)
@@ -8,8 +8,6 @@ from torch.utils.data import DataLoader
 
 from signbert.data_modules.PretrainMaskKeypointDataset import PretrainMaskKeypointDataset, mask_keypoint_dataset_collate_fn
 
-from IPython import embed
-
 
 class RwthPhoenixDataModule(pl.LightningDataModule):
     DPATH = '/home/tmpvideos/SLR/RWTH-PHOENIX-Weather/phoenix2014-release/phoenix-2014-multisigner/features/skeleton-fullFrame-210x260px/rtmpose-l_8xb64-270e_coco-wholebody-256x192'
@@ -253,6 +251,7 @@ class RwthPhoenixDataModule(pl.LightningDataModule):
         return seqs
 
 if __name__ == '__main__':
+    from IPython import embed
 
     d = RwthPhoenixDataModule(
         32,
@@ -7,10 +7,9 @@ import lightning.pytorch as pl
 from torch.utils.data import DataLoader
 
 from signbert.data_modules.PretrainMaskKeypointDataset import PretrainMaskKeypointDataset, mask_keypoint_dataset_collate_fn
+from signbert.data_modules.utils import save_ragged_npy_arrays
 from signbert.utils import read_json
 
-from IPython import embed
-
 
 class WLASLDataModule(pl.LightningDataModule):
 
@@ -29,9 +28,13 @@ class WLASLDataModule(pl.LightningDataModule):
     TRAIN_IDXS_FPATH = os.path.join(PREPROCESS_DPATH, 'train_idxs.npy')
     VAL_IDXS_FPATH = os.path.join(PREPROCESS_DPATH, 'val_idxs.npy')
     TEST_IDXS_FPATH = os.path.join(PREPROCESS_DPATH, 'test_idxs.npy')
+    # Full-length training sequences, without splitting nor padding
+    TRAIN_RAGGED_FPATH = os.path.join(PREPROCESS_DPATH, 'train_ragged.npy')
+    TRAIN_RAGGED_NORM_FPATH = os.path.join(PREPROCESS_DPATH, 'train_ragged_norm.npy')
+    TRAIN_OFFSETS_FPATH = os.path.join(PREPROCESS_DPATH, 'train_offsets.npy')
     SEQ_PAD_VALUE = 0.0
 
-    def __init__(self, batch_size, normalize=False, R=0.3, m=5, K=8, max_disturbance=0.25):
+    def __init__(self, batch_size, normalize=False, R=0.3, m=5, K=8, max_disturbance=0.25, crop_len=None):
         super().__init__()
         self.batch_size = batch_size
         self.normalize = normalize
@@ -39,6 +42,9 @@ class WLASLDataModule(pl.LightningDataModule):
         self.m = m
         self.K = K
         self.max_disturbance = max_disturbance
+        # Training on random crops of full-length sequences if set, otherwise
+        # on sequences split into chunks of 500 frames
+        self.crop_len = crop_len
         self.means_fpath = WLASLDataModule.MEANS_FPATH
         self.stds_fpath = WLASLDataModule.STDS_FPATH
 
@@ -105,6 +111,26 @@ class WLASLDataModule(pl.LightningDataModule):
                 WLASLDataModule.TEST_NORM_FPATH,
                 WLASLDataModule.TEST_IDXS_FPATH
             )
+        # Full-length training sequences, randomly cropped when loaded
+        if self.crop_len is not None and (
+            not os.path.exists(WLASLDataModule.TRAIN_RAGGED_FPATH) or \
+            not os.path.exists(WLASLDataModule.TRAIN_RAGGED_NORM_FPATH) or \
+            not os.path.exists(WLASLDataModule.TRAIN_OFFSETS_FPATH)):
+            splits_data = read_json(WLASLDataModule.SPLIT_DATA_JSON_FPAHT)
+            train_idxs, _, _ = self._populate_video_id_by_split(splits_data)
+            skeleton_fpaths = glob.glob(
+                os.path.join(WLASLDataModule.SKELETON_DPAHT, '*.npy')
+            )
+            train, _ = self._load_data_by_split(train_idxs, skeleton_fpaths)
+            save_ragged_npy_arrays(
+                train,
+                self._normalize_seqs(train),
+                WLASLDataModule.TRAIN_RAGGED_FPATH,
+                WLASLDataModule.TRAIN_RAGGED_NORM_FPATH,
+                WLASLDataModule.TRAIN_OFFSETS_FPATH
+            )
+            del train
+            gc.collect()
             
     def setup(self, stage=None):
         if stage == 'fit' or stage is None:
@@ -112,14 +138,27 @@ class WLASLDataModule(pl.LightningDataModule):
             X_val_fpath = WLASLDataModule.VAL_NORM_FPATH if self.normalize else WLASLDataModule.VAL_FPATH
             X_test_fpath = WLASLDataModule.TEST_NORM_FPATH if self.normalize else WLASLDataModule.TEST_FPATH
 
-            self.setup_train = PretrainMaskKeypointDataset(
-                WLASLDataModule.TRAIN_IDXS_FPATH, 
-                X_train_fpath, 
-                self.R, 
-                self.m, 
-                self.K, 
-                self.max_disturbance
-            )
+            if self.crop_len is not None:
+                X_train_ragged_fpath = WLASLDataModule.TRAIN_RAGGED_NORM_FPATH if self.normalize else WLASLDataModule.TRAIN_RAGGED_FPATH
+                self.setup_train = PretrainMaskKeypointDataset(
+                    None,
+                    X_train_ragged_fpath,
+                    self.R,
+                    self.m,
+                    self.K,
+                    self.max_disturbance,
+                    offsets_fpath=WLASLDataModule.TRAIN_OFFSETS_FPATH,
+                    crop_len=self.crop_len
+                )
+            else:
+                self.setup_train = PretrainMaskKeypointDataset(
+                    WLASLDataModule.TRAIN_IDXS_FPATH, 
+                    X_train_fpath, 
+                    self.R, 
+                    self.m, 
+                    self.K, 
+                    self.max_disturbance
+                )
             self.setup_val = PretrainMaskKeypointDataset(
                 WLASLDataModule.VAL_IDXS_FPATH,
                 X_val_fpath, 
@@ -317,6 +356,7 @@ class WLASLDataModule(pl.LightningDataModule):
 
 
 if __name__ == '__main__':
+    from IPython import embed
 
     d = WLASLDataModule(
         batch_size=32,
@@ -1,7 +1,18 @@
-from signbert.data_modules import (
-    HANDS17DataModule, 
-    MSASLDataModule,
-    RwthPhoenixDataModule,
-    WLASLDataModule,
-    How2SignDataModule
-)
\ No newline at end of file
+import importlib
+
+
+# Modules are imported on first access, so importing a single data module does
+# not pull in the dependencies of every dataset
+_SUBMODULES = (
+    "HANDS17DataModule",
+    "MSASLDataModule",
+    "RwthPhoenixDataModule",
+    "WLASLDataModule",
+    "How2SignDataModule",
+)
+
+
+def __getattr__(name):
+    if name in _SUBMODULES:
+        return importlib.import_module(f"{__name__}.{name}")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
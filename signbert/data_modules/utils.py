@@ -1,6 +1,56 @@
+import os
+
 import numpy as np
 
-def mask_transform_identity(seq, R, max_disturbance, no_mask_joint, K, m):
+
+# Memory-mapped arrays opened by this process, reused by later datasets
+_MMAP_CACHE = {}
+
+
+def load_npy(fpath, mmap_mode=None):
+    """
+    Load a .npy array.
+
+    Memory-mapped arrays are opened once per process and shared by every
+    dataset reading them, their pages are shared between processes through
+    the page cache.
+
+    Parameters:
+    fpath (str): The array file path.
+    mmap_mode (str, optional): The numpy memory-map mode, e.g. "r". If None,
+    the array is read into memory.
+
+    Returns:
+    numpy.ndarray: The array.
+    """
+    if mmap_mode is None:
+        return np.load(fpath)
+    key = (os.path.abspath(fpath), mmap_mode)
+    if key not in _MMAP_CACHE:
+        _MMAP_CACHE[key] = np.load(fpath, mmap_mode=mmap_mode)
+
+    return _MMAP_CACHE[key]
+
+def save_ragged_npy_arrays(seqs, seqs_norm, out_fpath, norm_out_fpath, offsets_out_fpath):
+    """
+    Save full-length sequences of different lengths without padding.
+
+    The frames of all sequences are concatenated into a single array, sequence
+    i spans the frames offsets[i]:offsets[i+1].
+
+    Parameters:
+    seqs (list): Sequences (numpy arrays) to be saved.
+    seqs_norm (list): The normalized sequences.
+    out_fpath (str): File path for saving the concatenated sequences.
+    norm_out_fpath (str): File path for saving the concatenated normalized sequences.
+    offsets_out_fpath (str): File path for saving the (N+1,) offsets.
+    """
+    offsets = np.cumsum([0] + [len(s) for s in seqs], dtype=np.int64)
+    np.save(out_fpath, np.concatenate(seqs).astype(np.float32))
+    np.save(norm_out_fpath, np.concatenate(seqs_norm).astype(np.float32))
+    np.save(offsets_out_fpath, offsets)
+
+def mask_transform_identity(seq, R, max_disturbance, no_mask_joint, K, m, rng=np.random):
     """
     Apply different types of masking transformations to a sequence of frames.
 
@@ -10,6 +60,8 @@ def mask_transform_identity(seq, R, max_disturbance, no_mask_joint, K, m):
 
     Parameters:
     seq (numpy.ndarray): A sequence of frames to be masked.
+    rng (numpy.random.RandomState): Random state used for masking. Default is
+    the global numpy one.
 
     Returns:
     tuple:
@@ -23,17 +75,17 @@ def mask_transform_identity(seq, R, max_disturbance, no_mask_joint, K, m):
     # Calculate the total number of frames to mask based on a predefined ratio R
     n_frames_to_mask = int(np.ceil(R * n_frames))
     # Randomly select frame indices to mask
-    frames_to_mask = np.random.choice(n_frames, size=n_frames_to_mask, replace=False)
+    frames_to_mask = rng.choice(n_frames, size=n_frames_to_mask, replace=False)
     clipped_masked_frames = []
     for f in frames_to_mask:
         # Grab frame to be masked
         curr_frame = toret[f]
         # Randomly select the type of masking operation
-        op_idx = np.random.choice(4) # 0: joint, 1: frame, 2: clip, 3: identity
+        op_idx = rng.choice(4) # 0: joint, 1: frame, 2: clip, 3: identity
         
         if op_idx == 0:
             # Apply joint masking
-            curr_frame = mask_joint(curr_frame, max_disturbance, no_mask_joint, m)
+            curr_frame = mask_joint(curr_frame, max_disturbance, no_mask_joint, m, rng)
             toret[f] = curr_frame
         elif op_idx == 1:
             # Apply frame masking
@@ -41,7 +93,7 @@ def mask_transform_identity(seq, R, max_disturbance, no_mask_joint, K, m):
             toret[f] = curr_frame
         elif op_idx == 2:
             # Apply clip masking
-            curr_frame, masked_frames_idx = mask_clip(f, toret, n_frames, K)
+            curr_frame, masked_frames_idx = mask_clip(f, toret, n_frames, K, rng)
             clipped_masked_frames.extend(masked_frames_idx)
         else:
             # Identity operation (no change)
@@ -51,7 +103,7 @@ def mask_transform_identity(seq, R, max_disturbance, no_mask_joint, K, m):
     
     return toret, masked_frames_idx
 
-def mask_transform(seq, R, max_disturbance, no_mask_joint, K, m):
+def mask_transform(seq, R, max_disturbance, no_mask_joint, K, m, rng=np.random):
     """
     Apply different types of masking transformations to a sequence of frames.
 
@@ -61,6 +113,8 @@ def mask_transform(seq, R, max_disturbance, no_mask_joint, K, m):
 
     Parameters:
     seq (numpy.ndarray): A sequence of frames to be masked.
+    rng (numpy.random.RandomState): Random state used for masking. Default is
+    the global numpy one.
 
     Returns:
     tuple:
@@ -74,16 +128,16 @@ def mask_transform(seq, R, max_disturbance, no_mask_joint, K, m):
     # Calculate the total number of frames to mask based on a predefined ratio R
     n_frames_to_mask = int(np.ceil(R * n_frames))
     # Randomly select frame indices to mask
-    frames_to_mask = np.random.choice(n_frames, size=n_frames_to_mask, replace=False)
+    frames_to_mask = rng.choice(n_frames, size=n_frames_to_mask, replace=False)
     clipped_masked_frames = []
     for f in frames_to_mask:
         # Grab frame to be masked
         curr_frame = toret[f]
         # Randomly select the type of masking operation
-        op_idx = np.random.choice(3) # 0: joint, 1: frame, 2: clip
+        op_idx = rng.choice(3) # 0: joint, 1: frame, 2: clip
         if op_idx == 0:
             # Apply joint masking
-            curr_frame = mask_joint(curr_frame, max_disturbance, no_mask_joint, m)
+            curr_frame = mask_joint(curr_frame, max_disturbance, no_mask_joint, m, rng)
             toret[f] = curr_frame
         elif op_idx == 1:
             # Apply frame masking
@@ -91,14 +145,14 @@ def mask_transform(seq, R, max_disturbance, no_mask_joint, K, m):
             toret[f] = curr_frame
         else:
             # Apply clip masking
-            curr_frame, masked_frames_idx = mask_clip(f, toret, n_frames, K)
+            curr_frame, masked_frames_idx = mask_clip(f, toret, n_frames, K, rng)
             clipped_masked_frames.extend(masked_frames_idx)
     # Compile a list of all masked frames for use in loss calculation
     masked_frames_idx = np.unique(np.concatenate((frames_to_mask, clipped_masked_frames)))
     
     return toret, masked_frames_idx
 
-def mask_clip(frame_idx, seq, n_frames, K):
+def mask_clip(frame_idx, seq, n_frames, K, rng=np.random):
     """
     Apply clip masking to a sequence of frames.
 
@@ -110,6 +164,8 @@ def mask_clip(frame_idx, seq, n_frames, K):
     frame_idx (int): Index of the frame around which the clip is centered.
     seq (numpy.ndarray): The sequence of frames to which the masking will be applied.
     n_frames (int): The total number of frames in the sequence.
+    rng (numpy.random.RandomState): Random state used for masking. Default is
+    the global numpy one.
 
     Returns:
     tuple:
@@ -117,7 +173,7 @@ def mask_clip(frame_idx, seq, n_frames, K):
         - list: Indices of the frames that have been masked.
     """
     # Randomly decide the number of frames to mask, with a maximum of K frames
-    n_frames_to_mask = np.random.randint(2, K+1)
+    n_frames_to_mask = rng.randint(2, K+1)
     n_frames_to_mask_half = n_frames_to_mask // 2
     # Calculate the start and end indices for the clip to be masked
     start_idx = frame_idx - n_frames_to_mask_half
@@ -138,7 +194,7 @@ def mask_clip(frame_idx, seq, n_frames, K):
 
     return seq, masked_frames_idx
 
-def mask_joint(frame, max_disturbance, no_mask_joint, m):
+def mask_joint(frame, max_disturbance, no_mask_joint, m, rng=np.random):
     """
     Apply masking to specific joints in a frame.
 
@@ -149,6 +205,8 @@ def mask_joint(frame, max_disturbance, no_mask_joint, m):
 
     Parameters:
     frame (numpy.ndarray): The frame (array of joint coordinates) to be masked.
+    rng (numpy.random.RandomState): Random state used for masking. Default is
+    the global numpy one.
 
     Returns:
     numpy.ndarray: The frame with masking applied to specific joints.
@@ -156,14 +214,14 @@ def mask_joint(frame, max_disturbance, no_mask_joint, m):
     # Define a function for spatial disturbance
     def spatial_disturbance(xy):
         # Add a random disturbance within the range [-max_disturbance, max_disturbance]
-        return xy + [np.random.uniform(-max_disturbance, max_disturbance), np.random.uniform(-max_disturbance, max_disturbance)]
+        return xy + [rng.uniform(-max_disturbance, max_disturbance), rng.uniform(-max_disturbance, max_disturbance)]
     
     # Randomly decide the number of joints to mask, with a maximum of 'm'
-    m = np.random.randint(1, m+1)
+    m = rng.randint(1, m+1)
     # Randomly select joint indices to mask
-    joint_idxs_to_mask = np.random.choice(21, size=m, replace=False)
+    joint_idxs_to_mask = rng.choice(21, size=m, replace=False)
     # Randomly decide the operation to be applied: zero-masking or spatial disturbance
-    op_idx = np.random.binomial(1, p=0.5, size=m).reshape(-1, 1)
+    op_idx = rng.binomial(1, p=0.5, size=m).reshape(-1, 1)
     # Apply the chosen masking operation to the selected joints
     frame[joint_idxs_to_mask] = np.where(
         op_idx, 
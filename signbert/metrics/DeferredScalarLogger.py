@@ -0,0 +1,122 @@
+import queue
+import threading
+
+import torch
+
+
+class DeferredScalarLogger:
+    """
+    Scalar logger that keeps training loops free of host-device syncs.
+
+    Scalars are accumulated on their device and averaged over a logging
+    interval. On flush, the accumulated values are stacked into a single tensor
+    and handed over to a background thread, which copies them to the host and
+    writes them to TensorBoard. The training loop never waits for the device.
+
+    Attributes:
+    writer (SummaryWriter): The TensorBoard writer, if None scalars are discarded.
+    flush_every (int): The number of steps between flushes.
+    """
+    def __init__(self, writer, flush_every=50):
+        """
+        Initialize the DeferredScalarLogger.
+
+        Parameters:
+        writer (SummaryWriter): The TensorBoard writer, e.g. the `experiment`
+        of a Lightning `TensorBoardLogger`. If None, scalars are discarded.
+        flush_every (int): The number of steps between flushes. Default is 50.
+        """
+        self.writer = writer
+        self.flush_every = flush_every
+        self._sums = {}
+        self._counts = {}
+        self._steps = 0
+        self._queue = queue.Queue()
+        self._thread = None
+
+    def add(self, name, value):
+        """
+        Accumulate a scalar, without synchronizing with its device.
+
+        Parameters:
+        name (str): The scalar tag.
+        value (Tensor or float): The scalar value.
+        """
+        if torch.is_tensor(value):
+            value = value.detach().float()
+        if name in self._sums:
+            self._sums[name] = self._sums[name] + value
+            self._counts[name] += 1
+        else:
+            self._sums[name] = value
+            self._counts[name] = 1
+
+    def step(self, global_step):
+        """
+        Mark the end of a step, flushing if the logging interval is reached.
+
+        Parameters:
+        global_step (int): The step the flushed scalars are logged at.
+        """
+        self._steps += 1
+        if self._steps % self.flush_every == 0:
+            self.flush(global_step)
+
+    def flush(self, global_step):
+        """
+        Hand the averages of the accumulated scalars over to the writer thread.
+
+        Parameters:
+        global_step (int): The step the scalars are logged at.
+        """
+        if not self._sums:
+            return
+        names = list(self._sums.keys())
+        means = [
+            torch.as_tensor(self._sums[n] / self._counts[n], dtype=torch.float)
+            for n in names
+        ]
+        # A single tensor, so the copy to the host is done at once
+        devices = {m.device for m in means}
+        if len(devices) > 1:
+            means = [m.cpu() for m in means]
+        values = torch.stack(means)
+        self._sums.clear()
+        self._counts.clear()
+        if self.writer is None:
+            return
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._write, daemon=True)
+            self._thread.start()
+        self._queue.put((names, values, global_step))
+
+    def close(self):
+        """Wait until every flushed scalar is written and stop the writer thread."""
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+        self.writer.flush()
+
+    def _write(self):
+        """Writer thread loop, the device to host copy happens here."""
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            names, values, global_step = item
+            for name, value in zip(names, values.tolist()):
+                self.writer.add_scalar(name, value, global_step=global_step)
+
+
+if __name__ == '__main__':
+
+    from torch.utils.tensorboard import SummaryWriter
+
+    writer = SummaryWriter('/tmp/deferred_scalar_logger')
+    scalar_logger = DeferredScalarLogger(writer, flush_every=10)
+    for step in range(100):
+        scalar_logger.add('loss', torch.rand(()))
+        scalar_logger.step(step)
+    scalar_logger.close()
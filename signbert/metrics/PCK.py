@@ -1,17 +1,116 @@
 import torch
 import numpy as np
 from torch import Tensor
-from torch.nn import ModuleList
-from torchmetrics import Metric, MetricCollection
+from torchmetrics import Metric
 
-from IPython import embed; from sys import exit
 
+class PCKCurve(Metric):
+    """
+    Percentage of Correct Keypoints (PCK) at several thresholds.
+
+    Distances between predicted and ground truth keypoints are computed once 
+    per update and binned into a histogram whose edges are the thresholds. The
+    number of correct keypoints at each threshold is read from the cumulative 
+    counts, so PCK at any threshold and the AUC over any range of thresholds
+    come from a single pass. States are summed across processes.
+
+    Attributes:
+    thresholds (Tensor): The sorted thresholds.
+    correct (Tensor): The count of keypoints within each threshold.
+    total (Tensor): The total count of keypoints.
+    """
+    def __init__(self, thresholds=tuple(range(0, 101))):
+        """
+        Initialize the PCKCurve metric.
+
+        Parameters:
+        thresholds (sequence): The thresholds the PCK is computed at. Default 
+        is every integer from 0 to 100.
+        """
+        super().__init__()
+        thresholds = torch.as_tensor(thresholds, dtype=torch.float).sort().values
+        self.register_buffer("thresholds", thresholds, persistent=False)
+        # Host copy, to look up thresholds without synchronizing with the device
+        self._threshold_values = thresholds.tolist()
+        self.add_state("correct", default=torch.zeros(len(thresholds), dtype=torch.long), dist_reduce_fx="sum")
+        self.add_state("total", default=torch.tensor(0), dist_reduce_fx="sum")
+
+    def update(self, preds: Tensor, target: Tensor, mask: Tensor = None):
+        """
+        Update the state of the metric with new predictions and targets.
+
+        Parameters:
+        preds (Tensor): (..., D) predicted keypoints.
+        target (Tensor): (..., D) ground truth keypoints.
+        mask (Tensor, optional): Boolean mask broadcastable to the leading 
+        dimensions of the keypoints, e.g. (N, T, 1) for (N, T, V, D) 
+        keypoints. Only keypoints where it is True are taken into account.
+        """
+        assert preds.shape == target.shape
+        # Calculate the L2 distance between predictions and targets, in 
+        # float32 even if the inputs come from a reduced precision region
+        distances = torch.norm(target.float() - preds.float(), dim=-1)
+        # Index of the first threshold each distance is under (strictly)
+        bins = torch.bucketize(distances, self.thresholds, right=True)
+        if mask is None:
+            weights = torch.ones_like(bins)
+        else:
+            weights = mask.expand(distances.shape).long()
+        # Histogram of the distances, the extra bin holds the ones over all thresholds
+        counts = torch.zeros(len(self.thresholds) + 1, dtype=torch.long, device=bins.device)
+        counts.scatter_add_(0, bins.flatten(), weights.flatten())
+        self.correct += counts.cumsum(0)[:-1]
+        self.total += weights.sum()
+
+    def compute(self):
+        """
+        Compute the PCK curve.
+
+        Returns:
+        Tensor: The percentage of correctly predicted keypoints at each threshold.
+        """
+        return self.correct.float() / self.total
+
+    def pck(self, thr: float):
+        """
+        Compute the PCK at one of the thresholds.
+
+        Parameters:
+        thr (float): The threshold, it must be one of `thresholds`.
+
+        Returns:
+        Tensor: The percentage of keypoints within the threshold.
+        """
+        idx = self._threshold_idx(thr)
+        return self.correct[idx].float() / self.total
+
+    def auc(self, thr_min: float, thr_max: float):
+        """
+        Compute the normalized area under the PCK curve.
 
-class PCK(Metric):
+        Parameters:
+        thr_min (float): The lower bound of the range, one of `thresholds`.
+        thr_max (float): The upper bound of the range, one of `thresholds`.
+
+        Returns:
+        Tensor: The AUC over the range, normalized to [0,1].
+        """
+        assert thr_min < thr_max
+        start, end = self._threshold_idx(thr_min), self._threshold_idx(thr_max) + 1
+        curve = self.correct[start:end].float() / self.total
+        return torch.trapz(curve, self.thresholds[start:end]) / (thr_max - thr_min)
+
+    def _threshold_idx(self, thr):
+        """Return the index of a threshold, which must have been given at initialization."""
+        assert thr in self._threshold_values, f"PCK threshold {thr} is not being tracked"
+        return self._threshold_values.index(thr)
+
+
+class PCK(PCKCurve):
     """
     Percentage of Correct Keypoints (PCK) metric class.
 
-    This class extends PyTorch's Metric class to calculate the PCK metric. 
+    This class extends PCKCurve to calculate the PCK metric at a single threshold.
     PCK measures the percentage of predicted keypoints that are within a certain 
     threshold distance from the ground truth keypoints.
 
@@ -27,47 +126,29 @@ class PCK(Metric):
         Parameters:
         thr (float): The threshold for considering a keypoint as correctly predicted. Default is 20.
         """
-        super().__init__()
+        super().__init__(thresholds=(thr,))
         self.threshold = thr
-        self.add_state("correct", default=torch.tensor(0), dist_reduce_fx="sum")
-        self.add_state("total", default=torch.tensor(0), dist_reduce_fx="sum")
-
-    def update(self, preds: Tensor, target: Tensor):
-        """
-        Update the state of the metric with new predictions and targets.
-
-        Parameters:
-        preds (Tensor): Predicted keypoints.
-        target (Tensor): Ground truth keypoints.
-        """
-        assert preds.shape == target.shape
-        # Calculate the L2 distance between predictions and targets
-        distances = torch.norm(target - preds, dim=-1)
-        # Count how many predictions are within the threshold distance
-        correct = (distances < self.threshold).sum()
-        self.correct += correct
-        self.total += distances.numel()
 
     def compute(self): 
         """
         Compute the PCK value.
 
         Returns:
-        float: The percentage of correctly predicted keypoints.
+        Tensor: The percentage of correctly predicted keypoints.
         """
-        return self.correct.float() / self.total
+        return self.correct[0].float() / self.total
 
 
-class PCKAUC(Metric):
+class PCKAUC(PCKCurve):
     """
     Area Under Curve (AUC) for the Percentage of Correct Keypoints (PCK) metric class.
 
-    This class calculates the AUC of the PCK metric across a range of thresholds. 
+    This class calculates the AUC of the PCK metric across a range of thresholds,
+    spaced by 1, from a single histogram of the distances.
 
     Attributes:
-    metrics (ModuleList): A list of PCK metrics, each with a different threshold.
-    thresholds (Tensor): A tensor of thresholds used to calculate PCK.
-    diff (Tensor): The difference between the maximum and minimum thresholds.
+    thr_min (float): The minimum threshold.
+    thr_max (float): The maximum threshold.
     """
     def __init__(self, thr_min: float = 20, thr_max: float = 40):
         """
@@ -77,26 +158,11 @@ class PCKAUC(Metric):
         thr_min (float): The minimum threshold for PCK calculation. Default is 20.
         thr_max (float): The maximum threshold for PCK calculation. Default is 40.
         """
-        super().__init__()
         assert thr_min < thr_max
         step = 1
-        thresholds = torch.arange(thr_min, thr_max+step, step)
-        # Create a PCK metric for each threshold
-        self.metrics = ModuleList([PCK(thr) for thr in thresholds])
-        self.add_state("thresholds", default=thresholds, dist_reduce_fx=None)
-        self.add_state("diff", default=torch.tensor(thr_max-thr_min), dist_reduce_fx=None)
-    
-    def update(self, preds: Tensor, target: Tensor):
-        """
-        Update the state of the metric with new predictions and targets.
-
-        Parameters:
-        preds (Tensor): Predicted keypoints.
-        target (Tensor): Ground truth keypoints.
-        """
-        assert preds.shape == target.shape
-        # Update each PCK metric with the new predictions and targets
-        for m in self.metrics: m.update(preds, target)
+        super().__init__(thresholds=torch.arange(thr_min, thr_max+step, step))
+        self.thr_min = thr_min
+        self.thr_max = thr_max
 
     def compute(self):
         """
@@ -105,24 +171,12 @@ class PCKAUC(Metric):
         Returns:
         Tensor: The AUC of the PCK metric across the range of thresholds.
         """
-        # Calculate PCK for each threshold and concatenate results
-        result = torch.cat([m.compute().reshape(1) for m in self.metrics])
-        # Calculate the area under the curve (AUC) and normalize so its between [0,1]
-        return torch.trapz(result, self.thresholds) / self.diff
-    
-    def reset(self):
-        """Reset the state of the metric."""
-        self._update_count = 0
-        self._forward_cache = None
-        self._computed = None
-        # reset internal states
-        self._cache = None
-        self._is_synced = False
-        for m in self.metrics: m.reset()
-        self.auc = 0.
+        return self.auc(self.thr_min, self.thr_max)
 
 
 if __name__ == '__main__':
+    from sys import exit
+    from IPython import embed
 
     gt = torch.rand(16, 2361, 21, 2)
     pred = torch.rand(16, 2361, 21, 2)
@@ -134,4 +188,8 @@ if __name__ == '__main__':
     pck_auc = PCKAUC()
     pck_auc.update(gt, pred)
     print(f'{pck_auc.compute()=}')
+
+    pck_curve = PCKCurve()
+    pck_curve.update(gt, pred)
+    print(f'{pck_curve.pck(20)=}, {pck_curve.auc(20, 40)=}')
     embed(); exit()
\ No newline at end of file
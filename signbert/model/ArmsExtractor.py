@@ -2,8 +2,8 @@ import torch
 import torch.nn as nn
 
 from signbert.model.thirdparty.st_gcn.net.st_gcn import HeadlessModel as STGCN
+from signbert.utils import maybe_checkpoint
 
-from IPython import embed
 
 class ArmsExtractor(nn.Module):
     """
@@ -20,7 +20,8 @@ class ArmsExtractor(nn.Module):
         self,
         in_channels,
         hid_dim,
-        dropout
+        dropout,
+        checkpoint=False
     ):
         """
         Initialize the ArmsExtractor module.
@@ -29,8 +30,10 @@ class ArmsExtractor(nn.Module):
         in_channels (int): The number of input channels (features).
         hid_dim (int): The dimensionality of the hidden layers in STGCN.
         dropout (float): The dropout rate for regularization in STGCN.
+        checkpoint (bool): Whether to apply activation checkpointing to STGCN. Default is False.
         """
         super().__init__()
+        self.checkpoint = checkpoint
         self.stgcn = STGCN(
             in_channels=in_channels,
             num_hid=hid_dim,
@@ -54,7 +57,7 @@ class ArmsExtractor(nn.Module):
         # Permute and reshape the input tensor for STGCN
         x = x.permute(0, 3, 1, 2).unsqueeze(-1)
         # Process the input using STGCN
-        x = self.stgcn(x, lens)
+        x = maybe_checkpoint(self.checkpoint, self.stgcn, x, lens)
         # Extract right and left arm keypoints indices
         rarm = x[:, :, :, (1,3,5)]
         larm = x[:, :, :, (0,2,4)]
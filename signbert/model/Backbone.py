@@ -0,0 +1,304 @@
+import inspect
+
+import torch
+import torch.nn as nn
+
+from signbert.utils import my_import, maybe_checkpoint, fork, lengths_to_padding_mask
+from signbert.model.PositionalEncoding import PositionalEncoding
+from signbert.model.sliding_window import sliding_window_encode
+
+
+class Backbone(nn.Module):
+    """
+    Inference-only SignBERT backbone: extractors, positional encoding and 
+    transformer encoder, without the MANO decoder, metrics nor training state.
+
+    Exported from a pre-training checkpoint with `Backbone.export`, it is 
+    rebuilt from a compact config and its weights are memory-mapped on 
+    `Backbone.load`, instead of building the whole pre-training module.
+
+    Attributes:
+    config (dict): The arguments needed to rebuild the backbone.
+    ge (nn.Module): Gesture extractor.
+    stpe (nn.Module): Arms extractor.
+    pe (PositionalEncoding): Positional encoding.
+    te (TransformerEncoder): Transformer encoder.
+    """
+    # Pre-training model submodules kept in the export
+    SUBMODULES = ("ge", "stpe", "pe", "te")
+
+    def __init__(
+            self,
+            gesture_extractor_cls,
+            gesture_extractor_args,
+            arms_extractor_cls,
+            arms_extractor_args,
+            d_model,
+            num_heads,
+            tformer_n_layers,
+            tformer_dropout,
+            pe_max_len=1000,
+            pe_batch_first=False,
+            parallel_branches=False,
+        ):
+        """
+        Initialize the Backbone.
+
+        Parameters:
+        gesture_extractor_cls (str): Full name of the gesture extractor class.
+        gesture_extractor_args (dict): Gesture extractor arguments.
+        arms_extractor_cls (str): Full name of the arms extractor class.
+        arms_extractor_args (dict): Arms extractor arguments.
+        d_model (int): Transformer dimension.
+        num_heads (int): Number of attention heads.
+        tformer_n_layers (int): Number of transformer layers.
+        tformer_dropout (float): Transformer dropout.
+        pe_max_len (int): Initial positional encoding length. Default is 1000.
+        pe_batch_first (bool): Whether frame positions are encoded, see 
+        `PositionalEncoding`. Default is False.
+        parallel_branches (bool): Whether to run both extractors concurrently. Default is False.
+        """
+        super().__init__()
+        self.config = dict(
+            gesture_extractor_cls=gesture_extractor_cls,
+            gesture_extractor_args=gesture_extractor_args,
+            arms_extractor_cls=arms_extractor_cls,
+            arms_extractor_args=arms_extractor_args,
+            d_model=d_model,
+            num_heads=num_heads,
+            tformer_n_layers=tformer_n_layers,
+            tformer_dropout=tformer_dropout,
+            pe_max_len=pe_max_len,
+            pe_batch_first=pe_batch_first,
+        )
+        self.parallel_branches = parallel_branches
+        self.tformer_checkpoint = False
+        self.ge = my_import(gesture_extractor_cls)(**gesture_extractor_args)
+        self.stpe = my_import(arms_extractor_cls)(**arms_extractor_args)
+        self.pe = PositionalEncoding(d_model=d_model, dropout=0.1, max_len=pe_max_len, batch_first=pe_batch_first)
+        el = nn.TransformerEncoderLayer(d_model=d_model, nhead=num_heads, batch_first=True, dropout=tformer_dropout)
+        self.te = nn.TransformerEncoder(el, num_layers=tformer_n_layers)
+
+    @staticmethod
+    def export(model, fpath):
+        """
+        Write the backbone config and weights of a pre-training model.
+
+        Parameters:
+        model (SignBertModel): The pre-training model.
+        fpath (str): Output file path.
+        """
+        hparams = model.hparams
+        num_hid_mult = 1 if hparams.hand_cluster else 21
+        config = dict(
+            gesture_extractor_cls=hparams.gesture_extractor_cls,
+            gesture_extractor_args=dict(hparams.gesture_extractor_args),
+            arms_extractor_cls=hparams.arms_extractor_cls,
+            arms_extractor_args=dict(hparams.arms_extractor_args),
+            d_model=hparams.num_hid * num_hid_mult,
+            num_heads=hparams.num_heads,
+            tformer_n_layers=hparams.tformer_n_layers,
+            tformer_dropout=hparams.tformer_dropout,
+            pe_max_len=model.pe.pe.size(0),
+            pe_batch_first=model.pe.batch_first,
+        )
+        # Training-only options are not part of the inference config
+        config["gesture_extractor_args"].pop("checkpoint", None)
+        config["arms_extractor_args"].pop("checkpoint", None)
+        state_dict = {
+            k: v.detach().cpu().contiguous()
+            for k, v in model.state_dict().items()
+            if k.split(".")[0] in Backbone.SUBMODULES
+        }
+        torch.save({"config": config, "state_dict": state_dict}, fpath)
+
+    @staticmethod
+    def load(fpath, map_location="cpu", **kwargs):
+        """
+        Build a backbone from an export, memory-mapping its weights.
+
+        Memory-mapped tensors are assigned to the modules instead of being
+        copied, initial weights are then freed. Modules are not created on the
+        meta device since third-party extractors keep graph tensors outside of
+        their state dict. Falls back to a regular load on PyTorch versions 
+        without memory-mapped loading.
+
+        Parameters:
+        fpath (str): File written by `Backbone.export`.
+        map_location (str): Device the weights are loaded to. Default is "cpu".
+        **kwargs: Overrides of the config, e.g. `parallel_branches`.
+
+        Returns:
+        Backbone: The backbone, in evaluation mode.
+        """
+        mmap = "mmap" in inspect.signature(torch.load).parameters
+        if mmap:
+            export = torch.load(fpath, map_location=map_location, mmap=True, weights_only=True)
+        else:
+            export = torch.load(fpath, map_location=map_location)
+        config = {**export["config"], **kwargs}
+        backbone = Backbone(**config)
+        if "assign" in inspect.signature(nn.Module.load_state_dict).parameters:
+            backbone.load_state_dict(export["state_dict"], assign=True)
+        else:
+            backbone.load_state_dict(export["state_dict"])
+
+        return backbone.eval()
+
+    def forward(self, arms, rhand, lhand):
+        """See `encode`."""
+        return self.encode(arms, rhand, lhand)
+
+    def encode(self, arms, rhand, lhand, lengths=None):
+        """
+        Encode keypoints into per-frame hand features.
+
+        Parameters:
+        arms (Tensor): (N, T, 6, 2) arms keypoints.
+        rhand (Tensor): (N, T, 21, 2) right hand keypoints.
+        lhand (Tensor): (N, T, 21, 2) left hand keypoints.
+        lengths (Tensor, optional): (N,) sequence lengths, if given the 
+        transformer does not attend to the padding frames.
+
+        Returns:
+        tuple: (N, T, C) right and left hand transformer outputs.
+        """
+        rhand, lhand = self.extract_tokens(arms, rhand, lhand)
+
+        return self.encode_tokens(rhand, lhand, lengths)
+
+    def extract_tokens(self, arms, rhand, lhand):
+        """
+        Compute the per-frame hand tokens fed to the transformer.
+
+        Only the extractors run here, their temporal receptive field is finite
+        so a token only depends on the frames around it.
+
+        Parameters:
+        arms (Tensor): (N, T, 6, 2) arms keypoints.
+        rhand (Tensor): (N, T, 21, 2) right hand keypoints.
+        lhand (Tensor): (N, T, 21, 2) left hand keypoints.
+
+        Returns:
+        tuple: (N, T, C) right and left hand tokens, before positional encoding.
+        """
+        # Concatenate right and left hand data
+        x = torch.concat((rhand, lhand), dim=2)
+        # Start the arms extractor in the background, it is independent of the
+        # gesture extractor
+        if self.parallel_branches:
+            arms_future = fork(self.stpe, arms)
+        else:
+            arms_future = None
+        # Extract hand tokens using gesture extractor
+        rhand, lhand = self.ge(x)
+        rhand = rhand.squeeze(-1).permute(0, 2, 1, 3).contiguous()
+        lhand = lhand.squeeze(-1).permute(0, 2, 1, 3).contiguous()
+        # Extract arm tokens using spatial-temporal arm extractor
+        if arms_future is not None:
+            rarm, larm = arms_future.result()
+        else:
+            rarm, larm = self.stpe(arms)
+        rarm = rarm.squeeze(-1).permute(0, 2, 1, 3).contiguous()
+        larm = larm.squeeze(-1).permute(0, 2, 1, 3).contiguous()
+        N, T, C, V = rhand.shape
+        # Combine hands tokens with spatio-temporal positional tokens
+        rhand = rhand + rarm 
+        lhand = lhand + larm 
+        # Reshape hand data for processing
+        rhand = rhand.view(N, T, C*V)
+        lhand = lhand.view(N, T, C*V)
+
+        return rhand, lhand
+
+    def encode_tokens(self, rhand, lhand, lengths=None):
+        """
+        Apply the positional encoding and the transformer encoder to tokens.
+
+        Parameters:
+        rhand (Tensor): (N, T, C) right hand tokens, see `extract_tokens`.
+        lhand (Tensor): (N, T, C) left hand tokens.
+        lengths (Tensor, optional): (N,) sequence lengths, padding frames are
+        masked from the attention if given.
+
+        Returns:
+        tuple: (N, T, C) right and left hand transformer outputs.
+        """
+        padding_mask = None
+        if lengths is not None:
+            padding_mask = lengths_to_padding_mask(lengths.to(rhand.device), rhand.shape[1])
+        # Apply positional encoding
+        rhand = self.pe(rhand) 
+        lhand = self.pe(lhand) 
+        # Process data through the transformer encoder
+        rhand = self._transformer(rhand, padding_mask)
+        lhand = self._transformer(lhand, padding_mask)
+
+        return rhand, lhand
+
+    def encode_windowed(self, arms, rhand, lhand, window_size=500, overlap=100, lengths=None):
+        """
+        Encode sequences of any length with overlapping windows.
+
+        Meant for inference over full-length videos: memory is bounded by the
+        window size and time grows linearly with the sequence length, instead 
+        of quadratically with a single transformer pass. Sequences of at most
+        `window_size` frames are encoded at once, as with `encode`.
+
+        Parameters:
+        arms (Tensor): (N, T, 6, 2) arms keypoints.
+        rhand (Tensor): (N, T, 21, 2) right hand keypoints.
+        lhand (Tensor): (N, T, 21, 2) left hand keypoints.
+        window_size (int): The number of frames of a window. Default is 500.
+        overlap (int): The number of frames shared by consecutive windows. Default is 100.
+        lengths (Tensor, optional): (N,) sequence lengths, see `encode`.
+
+        Returns:
+        tuple: (N, T, C) stitched right and left hand transformer outputs.
+        """
+        return sliding_window_encode(
+            self.encode, 
+            (arms, rhand, lhand), 
+            window_size=window_size, 
+            overlap=overlap,
+            lengths=lengths
+        )
+
+    def _transformer(self, x, padding_mask=None):
+        """
+        Apply the transformer encoder.
+
+        Layers are called one by one when activation checkpointing is 
+        enabled, so only their inputs are kept for the backward pass.
+
+        Parameters:
+        x (Tensor): (N, T, C) input tokens.
+        padding_mask (Tensor, optional): (N, T) mask, True on the padding 
+        frames, which are not attended to.
+
+        Returns:
+        Tensor: (N, T, C) encoded tokens.
+        """
+        if not self.tformer_checkpoint:
+            return self.te(x, src_key_padding_mask=padding_mask)
+        for layer in self.te.layers:
+            # Positional arguments: source, attention mask and padding mask
+            x = maybe_checkpoint(True, layer, x, None, padding_mask)
+        if self.te.norm is not None:
+            x = self.te.norm(x)
+
+        return x
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--export', required=True, type=str)
+    args = parser.parse_args()
+
+    backbone = Backbone.load(args.export)
+    N, T = 1, 64
+    with torch.inference_mode():
+        rhand, lhand = backbone(torch.rand(N, T, 6, 2), torch.rand(N, T, 21, 2), torch.rand(N, T, 21, 2))
+    print(f'{rhand.shape=}, {lhand.shape=}')
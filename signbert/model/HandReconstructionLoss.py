@@ -0,0 +1,78 @@
+import torch
+import torch.nn as nn
+
+
+class HandReconstructionLoss(nn.Module):
+    """
+    SignBERT pre-training objective, LRec + lambda * LReg, for stacked hands.
+
+    All hands are processed in a single pass with dense masks, so the loss has
+    static shapes and no host-device synchronization.
+
+    Attributes:
+    eps (float): Confidence score threshold.
+    lmbd (float): Weight of the regularization loss.
+    weight_beta (float): Weight of the shape parameters regularization.
+    weight_delta (float): Weight of the temporal shape smoothness regularization.
+    score_weighted (bool): If True, joints with a score under `eps` are
+    weighted by their score. Otherwise only joints with a score over `eps` are
+    taken into account.
+    """
+    def __init__(self, eps, lmbd, weight_beta, weight_delta, score_weighted=True):
+        """
+        Initialize the HandReconstructionLoss module.
+
+        Parameters:
+        eps (float): Confidence score threshold.
+        lmbd (float): Weight of the regularization loss.
+        weight_beta (float): Weight of the shape parameters regularization.
+        weight_delta (float): Weight of the temporal shape smoothness regularization.
+        score_weighted (bool): Whether low confidence joints are weighted by
+        their score instead of being left out. Default is True.
+        """
+        super().__init__()
+        self.eps = eps
+        self.lmbd = lmbd
+        self.weight_beta = weight_beta
+        self.weight_delta = weight_delta
+        self.score_weighted = score_weighted
+
+    def forward(self, logits, target, scores, frame_mask, theta, beta, seq_mask=None):
+        """
+        Compute the loss, summed over hands.
+
+        Parameters:
+        logits (Tensor): (H, N, T, V, 2) predicted keypoints.
+        target (Tensor): (H, N, T, V, 2) ground truth keypoints.
+        scores (Tensor): (H, N, T, V) keypoints confidence scores.
+        frame_mask (Tensor): (H, N, T) boolean mask of the masked frames.
+        theta (Tensor): (H, N, T, P) predicted pose coefficients.
+        beta (Tensor): (H, N, T, 10) predicted shape parameters.
+        seq_mask (Tensor, optional): (T,) boolean mask of the frames that are
+        not padding. If None, all frames are used.
+
+        Returns:
+        Tensor: The scalar loss.
+        """
+        # Reconstruction loss (LRec) on the joints of the masked frames
+        if self.score_weighted:
+            weights = torch.where(scores >= self.eps, 1., scores)
+        else:
+            weights = (scores > self.eps).to(logits.dtype)
+        weights = weights * frame_mask.unsqueeze(-1)
+        lrec = (torch.abs(logits - target).sum(-1) * weights).sum()
+        # Padding frames are left out of the regularization
+        if seq_mask is not None:
+            seq_mask = seq_mask.view(1, 1, -1, 1)
+            theta = theta * seq_mask
+            beta = beta * seq_mask
+        beta_t_minus_one = torch.cat((torch.zeros_like(beta[:, :, :1]), beta[:, :, :-1]), dim=2)
+        beta_delta = beta - beta_t_minus_one
+        if seq_mask is not None:
+            beta_delta = beta_delta * seq_mask
+        # Regularization loss (LReg), norms are computed per hand
+        lreg = torch.linalg.vector_norm(theta.flatten(1), dim=1) + \
+            self.weight_beta * torch.linalg.vector_norm(beta.flatten(1), dim=1) + \
+            self.weight_delta * torch.linalg.vector_norm(beta_delta.flatten(1), dim=1)
+
+        return lrec + (self.lmbd * lreg.sum())
@@ -6,8 +6,8 @@ import torch.nn.functional as F
 from signbert.model.thirdparty.MS_G3D.model.msg3d import HeadlessModel as MSG3D
 from signbert.model.MediapipeHandPooling import MediapipeHandPooling
 from signbert.model.thirdparty.st_gcn.net.st_gcn import HeadlessModel as STGCN
+from signbert.utils import maybe_checkpoint
 from torch.nn.functional import dropout
-from IPython import embed
 
 
 class Hands17Graph:
@@ -159,12 +159,17 @@ class PretrainGestureExtractor(nn.Module):
             st_gcn_dropout=0.0,
             dropout=0.0,
             relu_between=False,
-            input_both_hands=False
+            input_both_hands=False,
+            checkpoint=None
         ):
         super().__init__()
+        # Activation checkpointing granularity: None (disabled), "msg3d" 
+        # (MSG3D only) or "all" (MSG3D and the clusters STGCN)
+        assert checkpoint in (None, "msg3d", "all")
         self.do_cluster = do_cluster
         self.relu_between = relu_between
         self.input_both_hands = input_both_hands
+        self.checkpoint = checkpoint
         # Initialize the MSG3D model
         self.model = MSG3D(
             num_point,
@@ -203,7 +208,7 @@ class PretrainGestureExtractor(nn.Module):
         lens = (x!=0.0).all(-1).all(-1).sum(1)
         # MSG3D expects data in (N, C, T, V, M) format
         x = x.permute(0, 3, 1, 2).unsqueeze(-1)
-        x = self.model(x, lens)
+        x = maybe_checkpoint(self.checkpoint is not None, self.model, x, lens)
         # Apply clustering and pooling if enabled
         if self.do_cluster:
             rhand = x[...,:21]
@@ -218,8 +223,8 @@ class PretrainGestureExtractor(nn.Module):
             rhand = rhand.unsqueeze(-1)
             lhand = lhand.unsqueeze(-1)
             # Extract features with STGCN
-            rhand = self.stgcn(rhand, lens)
-            lhand = self.stgcn(lhand, lens)
+            rhand = maybe_checkpoint(self.checkpoint == "all", self.stgcn, rhand, lens)
+            lhand = maybe_checkpoint(self.checkpoint == "all", self.stgcn, lhand, lens)
             rhand = rhand.squeeze(1)
             lhand = lhand.squeeze(1)
             # Apply second max-pooling
@@ -268,12 +273,17 @@ class GestureExtractor(nn.Module):
             st_gcn_dropout=0.0,
             dropout=0.0,
             relu_between=False,
-            input_both_hands=False
+            input_both_hands=False,
+            checkpoint=None
         ):
         super().__init__()
+        # Activation checkpointing granularity: None (disabled), "msg3d" 
+        # (MSG3D only) or "all" (MSG3D and the clusters STGCN)
+        assert checkpoint in (None, "msg3d", "all")
         self.do_cluster = do_cluster
         self.relu_between = relu_between
         self.input_both_hands = input_both_hands
+        self.checkpoint = checkpoint
         # Initialize the MSG3D model
         self.model = MSG3D(
             num_point,
@@ -312,7 +322,7 @@ class GestureExtractor(nn.Module):
         lens = (x!=0.0).all(-1).all(-1).sum(1)
         # MSG3D expects data in (N, C, T, V, M) format
         x = x.permute(0, 3, 1, 2).unsqueeze(-1)
-        x = self.model(x, lens)
+        x = maybe_checkpoint(self.checkpoint is not None, self.model, x, lens)
         # Apply clustering and pooling if enabled 
         if self.do_cluster:
             # Apply first max-pooling
@@ -322,7 +332,7 @@ class GestureExtractor(nn.Module):
                 x = F.relu(x)
             x = x.unsqueeze(-1)
             # Extract features with STGCN
-            x = self.stgcn(x, lens)
+            x = maybe_checkpoint(self.checkpoint == "all", self.stgcn, x, lens)
             x = x.squeeze(-1)
             # Apply second max-pooling
             x = self.maxpool2(x)
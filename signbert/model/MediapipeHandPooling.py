@@ -1,7 +1,6 @@
 import torch
 from torch import nn
 
-from IPython import embed; from sys import exit
 
 class MediapipeHandPooling(nn.Module):
     """
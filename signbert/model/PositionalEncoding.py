@@ -12,40 +12,106 @@ class PositionalEncoding(nn.Module):
     order of elements in a sequence. This is especially important in tasks where 
     the relative positions of elements carry significant meaning.
 
+    The encoding table is grown lazily when a longer input is received, so 
+    `max_len` is only the initial size and not a hard limit.
+
+    Inputs are indexed along their first dimension unless `batch_first` is 
+    set. Models passing (N, T, D) inputs without `batch_first` add the 
+    encoding of the sample index in the batch to all its frames, instead of 
+    the encoding of each frame position. Their outputs then depend on where 
+    a sample sits in the batch. `batch_first` is off by default so that 
+    checkpoints trained this way keep their behaviour.
+
     Attributes:
     dropout (nn.Dropout): Dropout layer for regularization.
     pe (Tensor): The positional encoding tensor.
+    batch_first (bool): Whether inputs are (N, T, D) and encoded along T.
     """
-    def __init__(self, d_model, dropout=0.1, max_len=5000):
+    def __init__(self, d_model, dropout=0.1, max_len=5000, batch_first=False):
         """
         Initialize the PositionalEncoding module.
 
         Parameters:
         d_model (int): The dimension of the embeddings (and therefore the positional encodings).
         dropout (float): The dropout rate. Default is 0.1.
-        max_len (int): The maximum length of the input sequences. Default is 5000.
+        max_len (int): The initial length of the encoding table. Default is 5000.
+        batch_first (bool): Whether inputs are (N, T, D), otherwise they are 
+        encoded along their first dimension. Default is False.
         """
         super(PositionalEncoding, self).__init__()
+        self.d_model = d_model
+        self.batch_first = batch_first
         self.dropout = nn.Dropout(p=dropout)
-        # Create a positional encoding matrix with sinusoidal functions
-        pe = torch.zeros(max_len, d_model)
-        position = torch.arange(0, max_len, dtype=torch.float).unsqueeze(1)
-        div_term = torch.exp(torch.arange(0, d_model, 2).float() * (-math.log(10000.0) / d_model))
+        # Register pe as a buffer so it's not considered a model parameter
+        self.register_buffer('pe', PositionalEncoding._build_pe(max_len, d_model))
+
+    @staticmethod
+    def _build_pe(max_len, d_model, device=None):
+        """
+        Create a positional encoding matrix with sinusoidal functions.
+
+        Parameters:
+        max_len (int): The number of positions.
+        d_model (int): The dimension of the encodings.
+        device (torch.device, optional): The device to create the matrix on.
+
+        Returns:
+        Tensor: (max_len, 1, d_model) positional encodings.
+        """
+        pe = torch.zeros(max_len, d_model, device=device)
+        position = torch.arange(0, max_len, dtype=torch.float, device=device).unsqueeze(1)
+        div_term = torch.exp(torch.arange(0, d_model, 2, device=device).float() * (-math.log(10000.0) / d_model))
         pe[:, 0::2] = torch.sin(position * div_term)
         pe[:, 1::2] = torch.cos(position * div_term)
         pe = pe.unsqueeze(0).transpose(0, 1)
-        # Register pe as a buffer so it's not considered a model parameter
-        self.register_buffer('pe', pe)
+
+        return pe
+
+    def _grow(self, length):
+        """Grow the encoding table to, at least, the given length."""
+        # Double the size so repeated growth is amortized
+        new_len = max(length, 2 * self.pe.size(0))
+        pe = PositionalEncoding._build_pe(new_len, self.d_model, device=self.pe.device)
+        self.pe = pe.to(self.pe.dtype)
+
+    def _load_from_state_dict(self, state_dict, prefix, *args, **kwargs):
+        # Checkpoints might hold a table grown past the initial `max_len`
+        key = prefix + 'pe'
+        if key in state_dict and state_dict[key].shape != self.pe.shape:
+            self.pe = torch.empty_like(state_dict[key], device=self.pe.device)
+        super()._load_from_state_dict(state_dict, prefix, *args, **kwargs)
 
     def forward(self, x):
         """
         Forward pass of the PositionalEncoding module.
 
         Parameters:
-        x (Tensor): The input tensor to which positional encoding will be added.
+        x (Tensor): (N, T, D) input if `batch_first`, otherwise (T, ..., D) 
+        input, to which positional encoding will be added.
 
         Returns:
         Tensor: The input tensor with positional encoding added.
         """
-        x = x + self.pe[:x.size(0)]
-        return self.dropout(x)
\ No newline at end of file
+        dim = 1 if self.batch_first else 0
+        if x.size(dim) > self.pe.size(0):
+            self._grow(x.size(dim))
+        if self.batch_first:
+            # (T, 1, D) table, broadcast over the batch
+            x = x + self.pe[:x.size(1)].transpose(0, 1)
+        else:
+            x = x + self.pe[:x.size(0)]
+        return self.dropout(x)
+
+
+if __name__ == '__main__':
+    pe = PositionalEncoding(d_model=8, dropout=0., max_len=4, batch_first=True)
+    x = torch.rand(3, 10, 8)
+    # A sample is encoded the same whatever its batch and slot
+    batched = pe(x)
+    for i in range(len(x)):
+        assert torch.equal(batched[i], pe(x[i:i + 1])[0])
+    assert torch.equal(batched[1], pe(x.flip(0))[1])
+    # Frames are encoded by their position, the table grew along T
+    assert pe.pe.size(0) >= 10
+    assert not torch.equal(batched[0, 0] - x[0, 0], batched[0, 1] - x[0, 1])
+    print('Positional encoding is batch invariant')
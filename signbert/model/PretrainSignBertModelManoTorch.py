@@ -1,14 +1,25 @@
 import os
+from typing import TYPE_CHECKING
+import math
 
 import torch
 import numpy as np
 import lightning.pytorch as pl
+from torchmetrics import MeanMetric
 
-from signbert.utils import my_import
+from signbert.utils import (
+    my_import, 
+    pad_to_bucket, 
+    masked_frames_to_mask, 
+    disable_autocast
+)
 from signbert.model.PositionalEncoding import PositionalEncoding
-from signbert.metrics.PCK import PCK, PCKAUC
-from manotorch.manolayer import ManoLayer, MANOOutput
-from IPython import embed; from sys import exit
+from signbert.model.Backbone import Backbone
+from signbert.model.HandReconstructionLoss import HandReconstructionLoss
+from signbert.metrics.PCK import PCKCurve
+from signbert.metrics.DeferredScalarLogger import DeferredScalarLogger
+if TYPE_CHECKING:
+    from manotorch.manolayer import MANOOutput
 
 
 class SignBertModel(pl.LightningModule):
@@ -28,8 +39,11 @@ class SignBertModel(pl.LightningModule):
     te (TransformerEncoder): Transformer encoder for sequence processing.
     pg (Linear): Linear layer for prediction.
     rhand_hd, lhand_hd (ManoLayer): MANO layers for detailed hand pose estimation.
-    PCK and PCKAUC metrics for training and validation.
+    PCK curves for training and validation.
     """
+    # Sequence lengths the time dimension is padded to when compiling
+    COMPILE_BUCKETS = (128, 256, 512, 1024)
+
     def __init__(
             self, 
             in_channels, 
@@ -55,6 +69,13 @@ class SignBertModel(pl.LightningModule):
             weight_decay=0.01,
             use_onecycle_lr=False,
             pct_start=None,
+            compile_args=None,
+            tformer_checkpoint=False,
+            parallel_branches=False,
+            pe_batch_first=False,
+            log_every_n_steps=50,
+            accumulate_grad_batches=1,
+            gradient_clip_val=None,
             *args,
             **kwargs,
         ):
@@ -64,6 +85,11 @@ class SignBertModel(pl.LightningModule):
         # examples from one dataset) can be backpropagated independently, so it
         # has to be done manually
         self.automatic_optimization = False
+        # The Trainer does not accumulate nor clip gradients under manual 
+        # optimization, so both are handled in `_optimizer_step`
+        self.accumulate_grad_batches = accumulate_grad_batches
+        self.gradient_clip_val = gradient_clip_val
+        self._n_accumulated = 0
 
         self.in_channels = in_channels
         self.num_hid = num_hid
@@ -88,14 +114,31 @@ class SignBertModel(pl.LightningModule):
         self.weight_decay = weight_decay
         self.use_onecycle_lr = use_onecycle_lr
         self.pct_start = pct_start
+        # If set, forward and loss are compiled with `torch.compile`. Accepted
+        # keys: `mode` (compilation mode) and `buckets` (sequence lengths)
+        self.compile_args = compile_args
+        self._compiled_forward_loss = None
+        # Whether to apply activation checkpointing to each transformer layer
+        self.tformer_checkpoint = tformer_checkpoint
+        # Whether to run the gesture and arms extractors concurrently. Meant
+        # for full precision inference: helps when a single branch does not 
+        # saturate the CPU. Autocast does not apply to the forked arms branch
+        self.parallel_branches = parallel_branches
+        # Per-step scalars are averaged on-device and written every 
+        # `log_every_n_steps` steps, see `setup`
+        self.log_every_n_steps = log_every_n_steps
+        self.scalar_logger = None
         # Variable to control the input channels dynamically based if clustering is enabled
         num_hid_mult = 1 if hand_cluster else 21
         # Initialization of various components of the model
         self.ge = self.gesture_extractor_cls(**gesture_extractor_args)
+        # Frame positions are only encoded with `pe_batch_first`, it is off 
+        # for checkpoints trained with the batch index encoding
         self.pe = PositionalEncoding(
             d_model=num_hid*num_hid_mult,
             dropout=0.1,
             max_len=1000,
+            batch_first=pe_batch_first,
         )
         self.stpe = self.arms_extractor_cls(**arms_extractor_args)
         el = torch.nn.TransformerEncoderLayer(d_model=num_hid*num_hid_mult, nhead=num_heads, batch_first=True, dropout=tformer_dropout)
@@ -114,6 +157,8 @@ class SignBertModel(pl.LightningModule):
         mano_assets_root = os.path.split(__file__)[0]
         mano_assets_root = os.path.join(mano_assets_root, "thirdparty", "mano_assets")
         assert os.path.isdir(mano_assets_root), "Download MANO files, check README."
+        # manotorch is slow to import, it is only needed to build the MANO layers
+        from manotorch.manolayer import ManoLayer
         self.rhand_hd = ManoLayer(
             center_idx=0,
             flat_hand_mean=flat_hand,
@@ -129,39 +174,51 @@ class SignBertModel(pl.LightningModule):
             ncomps=n_pca_components,
             side="left"
         )
+        # Reconstruction and regularization loss, applied to both hands at once
+        self.criterion = HandReconstructionLoss(
+            eps=eps, 
+            lmbd=lmbd, 
+            weight_beta=weight_beta, 
+            weight_delta=weight_delta, 
+            score_weighted=True
+        )
         # PCK and PCKAUC metrics for training and validation
-        self.train_pck_20 = PCK(thr=20)
-        self.train_pck_auc_20_40 = PCKAUC(thr_min=20, thr_max=40)
-        self.val_pck_20 = PCK(thr=20)
-        self.val_pck_auc_20_40 = PCKAUC(thr_min=20, thr_max=40)
-        # Placeholders
-        self.mean_loss = []
-        self.mean_pck_20 = []
+        self.train_pck = PCKCurve(thresholds=range(20, 41))
+        self.val_pck = PCKCurve(thresholds=range(20, 41))
+        # Epoch level validation averages, accumulated on-device
+        self.val_mean_loss = MeanMetric()
+        self.val_mean_pck_20 = MeanMetric()
+        # Full validation sets averages, when validating on subsets
+        self.val_full_mean_loss = MeanMetric()
+        self.val_full_mean_pck_20 = MeanMetric()
 
     def forward(self, arms, rhand, lhand):
-        # Concatenate right and left hand data
-        x = torch.concat((rhand, lhand), dim=2)
-        # Extract hand tokens using gesture extractor
-        rhand, lhand = self.ge(x)
-        rhand = rhand.squeeze(-1).permute(0, 2, 1, 3).contiguous()
-        lhand = lhand.squeeze(-1).permute(0, 2, 1, 3).contiguous()
-        # Extract arm tokens using spatial-temporal arm extractor
-        rarm, larm = self.stpe(arms)
-        rarm = rarm.squeeze(-1).permute(0, 2, 1, 3).contiguous()
-        larm = larm.squeeze(-1).permute(0, 2, 1, 3).contiguous()
-        N, T, C, V = rhand.shape
-        # Combine hands tokens with spatio-temporal positional tokens
-        rhand = rhand + rarm 
-        lhand = lhand + larm 
-        # Reshape hand data for processing
-        rhand = rhand.view(N, T, C*V)
-        lhand = lhand.view(N, T, C*V)
-        # Apply positional encoding
-        rhand = self.pe(rhand) 
-        lhand = self.pe(lhand) 
-        # Process data through the transformer encoder
-        rhand = self.te(rhand)
-        lhand = self.te(lhand)
+        # Encode hand keypoints into per-frame features
+        rhand, lhand = self.encode(arms, rhand, lhand)
+        # Parameters regression, MANO and the projection are numerically 
+        # fragile in reduced precision, so they always run in float32
+        with disable_autocast(self.device):
+            return self._decode(rhand.float(), lhand.float())
+
+    # Keypoints encoding is shared with the exported inference backbone
+    encode = Backbone.encode
+    extract_tokens = Backbone.extract_tokens
+    encode_tokens = Backbone.encode_tokens
+    encode_windowed = Backbone.encode_windowed
+    _transformer = Backbone._transformer
+
+    def _decode(self, rhand, lhand):
+        """
+        Predict hand and camera parameters and project MANO joints to 2D.
+
+        Parameters:
+        rhand (Tensor): (N, T, C) right hand transformer outputs.
+        lhand (Tensor): (N, T, C) left hand transformer outputs.
+
+        Returns:
+        dict: Right and left hand outputs, see `forward`.
+        """
+        N, T = rhand.shape[:2]
         # Predict hand and camera parameters for right and left hands
         rhand_params = self.pg(rhand)
         lhand_params = self.pg(lhand)
@@ -186,7 +243,9 @@ class SignBertModel(pl.LightningModule):
         lhand_pose_coeffs = lhand_pose_coeffs.view(N*T, -1)
         rhand_betas = rhand_betas.view(N*T, -1)
         lhand_betas = lhand_betas.view(N*T, -1)
-        # Apply the MANO model to obtain 3D joints and vertices
+        # Apply the MANO model to obtain 3D joints and vertices. Vertices and
+        # center joints are only used for visualization, they stay on the 
+        # device so training steps do not wait on a copy to the host
         rhand_mano_output: MANOOutput = self.rhand_hd(rhand_pose_coeffs, rhand_betas)
         lhand_mano_output: MANOOutput = self.lhand_hd(lhand_pose_coeffs, lhand_betas)
         # Extract and reshape the MANO output for both hands
@@ -194,15 +253,15 @@ class SignBertModel(pl.LightningModule):
         rhand_joints_3d = rhand_mano_output.joints
         rhand_pose_coeffs = rhand_pose_coeffs.view(N, T, -1)
         rhand_betas = rhand_betas.view(N, T, -1)
-        rhand_vertices = rhand_vertices.view(N, T, 778, 3).detach().cpu()
-        rhand_center_joint = rhand_mano_output.center_joint.detach().cpu()
+        rhand_vertices = rhand_vertices.view(N, T, 778, 3).detach()
+        rhand_center_joint = rhand_mano_output.center_joint.detach()
         rhand_joints_3d = rhand_joints_3d.view(N, T, 21, 3)
         lhand_vertices = lhand_mano_output.verts
         lhand_joints_3d = lhand_mano_output.joints
         lhand_pose_coeffs = lhand_pose_coeffs.view(N, T, -1)
         lhand_betas = lhand_betas.view(N, T, -1)
-        lhand_vertices = lhand_vertices.view(N, T, 778, 3).detach().cpu()
-        lhand_center_joint = lhand_mano_output.center_joint.detach().cpu()
+        lhand_vertices = lhand_vertices.view(N, T, 778, 3).detach()
+        lhand_center_joint = lhand_mano_output.center_joint.detach()
         lhand_joints_3d = lhand_joints_3d.view(N, T, 21, 3)
         # Apply ortographic projection to the 3D joints to obtain 2D image coordinates
         rhand = torch.matmul(rhand_R, rhand_joints_3d.permute(0, 1, 3, 2)).permute(0, 1, 3, 2)
@@ -219,101 +278,204 @@ class SignBertModel(pl.LightningModule):
             "lhand": (lhand, lhand_pose_coeffs, lhand_betas, lhand_vertices, lhand_R, lhand_S, lhand_O, lhand_center_joint, lhand_joints_3d)
         }
 
+    def setup(self, stage):
+        # Per-step scalars are written to TensorBoard from a background thread
+        writer = self.logger.experiment if self.logger is not None else None
+        self.scalar_logger = DeferredScalarLogger(writer, flush_every=self.log_every_n_steps)
+
+    def teardown(self, stage):
+        # Write the remaining scalars
+        if self.scalar_logger is not None:
+            self.scalar_logger.flush(self.global_step)
+            self.scalar_logger.close()
+
     def training_step(self, batch, batch_idx):
         # Get optimizer and scheduler (part of the manual optimization)
         opt = self.optimizers()
         sch = self.lr_schedulers()
+        # Mixed batches (see `PretrainDataModule`) hold samples from all the 
+        # datasets, followed by the dataset index of each sample. They are 
+        # processed with a single optimizer step
+        mixed = not isinstance(batch, dict)
+        if mixed:
+            batch = {"mixed": batch}
         # Process <key-value> pairs in the batch (<dataset_name:batch_data>)
-        for k, v in batch.items():
-            # Unpack the batch data
-            (seq_idx, 
-            arms,
-            rhand, 
-            rhand_masked,
-            rhand_masked_frames_idx,
-            rhand_scores,
-            lhand, 
-            lhand_masked,
-            lhand_masked_frames_idx,
-            lhand_scores) = v
-            # Forward pass through the model
-            hand_data = self(arms, rhand_masked, lhand_masked)
-            # Extract logits, pose coefficients, and betas from the model's output
-            (rhand_logits, rhand_theta, rhand_beta, _, _, _, _, _, _) = hand_data["rhand"]
-            (lhand_logits, lhand_theta, lhand_beta, _, _, _, _, _, _) = hand_data["lhand"]
-            # Loss only applied on frames with masked joints
-            rhand_valid_idxs = torch.where(rhand_masked_frames_idx != -1.)
-            rhand_logits = rhand_logits[rhand_valid_idxs]
-            rhand = rhand[rhand_valid_idxs]
-            rhand_scores = rhand_scores[rhand_valid_idxs]
-            lhand_valid_idxs = torch.where(lhand_masked_frames_idx != -1.)
-            lhand_logits = lhand_logits[lhand_valid_idxs]
-            lhand = lhand[lhand_valid_idxs]
-            lhand_scores = lhand_scores[lhand_valid_idxs]
-            # Compute reconstruction loss (LRec) and regularization loss (LReg) for both hands
-            rhand_lrec = torch.norm(rhand_logits - rhand, p=1, dim=2)
-            rhand_scores = torch.where(rhand_scores >= self.eps, 1., rhand_scores)
-            rhand_lrec = (rhand_lrec * rhand_scores).sum()
-            lhand_lrec = torch.norm(lhand_logits - lhand, p=1, dim=2)
-            lhand_scores = torch.where(lhand_scores >= self.eps, 1., lhand_scores)
-            lhand_lrec = (lhand_lrec * lhand_scores).sum()
-            rhand_beta_t_minus_one = torch.roll(rhand_beta, shifts=1, dims=1)
-            rhand_beta_t_minus_one[:, 0] = 0.
-            rhand_lreg = torch.norm(rhand_theta, 2) + self.weight_beta * torch.norm(rhand_beta, 2) + \
-                self.weight_delta * torch.norm(rhand_beta - rhand_beta_t_minus_one, 2)
-            # Combine right hand LRec and LReg
-            rhand_loss = rhand_lrec + (self.lmbd * rhand_lreg)
-            lhand_lrec = torch.norm(lhand_logits[lhand_scores>self.eps] - lhand[lhand_scores>self.eps], p=1, dim=1).sum()
-            lhand_beta_t_minus_one = torch.roll(lhand_beta, shifts=1, dims=1)
-            lhand_beta_t_minus_one[:, 0] = 0.
-            lhand_lreg = torch.norm(lhand_theta, 2) + self.weight_beta * torch.norm(lhand_beta, 2) + \
-                self.weight_delta * torch.norm(lhand_beta - lhand_beta_t_minus_one, 2)
-            # Combine left hand LRec and LReg
-            lhand_loss = lhand_lrec + (self.lmbd * lhand_lreg)
-            # Combine both losses
-            loss = rhand_loss + lhand_loss
-            # Manual backward pass
-            opt.zero_grad()
-            self.manual_backward(loss)
-            opt.step()
-            if isinstance(sch, torch.optim.lr_scheduler.OneCycleLR):
-                sch.step()
-            if self.normalize_inputs:
-                # Check that means and stds are in the same device as trainer
-                if self.device != self.trainer.datamodule.means[k].device:
-                   self.trainer.datamodule.means[k] = self.trainer.datamodule.means[k].to(self.device)
-                if self.device != self.trainer.datamodule.stds[k].device:
-                    self.trainer.datamodule.stds[k] = self.trainer.datamodule.stds[k].to(self.device)
-                # Reverse mean 0 and std 1 normalization to obtain 2D image coordinates
-                means = self.trainer.datamodule.means[k]
-                stds = self.trainer.datamodule.stds[k]
-                rhand_logits = (rhand_logits * stds) + means
-                lhand_logits = (lhand_logits * stds) + means
-                rhand = (rhand * stds) + means
-                lhand = (lhand * stds) + means
+        for i, (k, v) in enumerate(batch.items()):
+            if mixed:
+                v, dataset_idxs = v[:-1], v[-1]
+                means, stds = self._norm_stats(dataset_idxs=dataset_idxs)
+            else:
+                means, stds = self._norm_stats(dataset_key=k)
+            # Forward pass through the model and loss computation
+            loss, (rhand_logits, rhand, rhand_frame_mask), (lhand_logits, lhand, lhand_frame_mask) = \
+                self._shared_step(v)
+            # Manual backward pass, the loss is scaled so accumulated gradients
+            # are averaged over the accumulated batches
+            self.manual_backward(loss / self.accumulate_grad_batches)
+            self._n_accumulated += 1
+            # Accumulated gradients are not carried over epochs
+            is_last = self.trainer.is_last_batch and i == len(batch) - 1
+            if self._n_accumulated == self.accumulate_grad_batches or is_last:
+                self._optimizer_step(opt, sch)
             # Compute PCK (Percentage of Correct Keypoints) metrics
-            rhand_pck_20 = self.train_pck_20.update(preds=rhand_logits, target=rhand)
-            rhand_pck_20 = self.train_pck_20.compute()
-            self.train_pck_20.reset()
-            lhand_pck_20 = self.train_pck_20(preds=lhand_logits, target=lhand)
-            lhand_pck_20 = self.train_pck_20.compute()
-            self.train_pck_20.reset()
-            rhand_pck_auc_20_40 = self.train_pck_auc_20_40(preds=rhand_logits, target=rhand)
-            rhand_pck_auc_20_40 = self.train_pck_auc_20_40.compute()
-            self.train_pck_auc_20_40.reset()
-            lhand_pck_auc_20_40 = self.train_pck_auc_20_40(preds=lhand_logits, target=lhand)
-            lhand_pck_auc_20_40 = self.train_pck_auc_20_40.compute()
-            self.train_pck_auc_20_40.reset()
-            # Log metrics
-            self.log(f"{k}_train_loss", loss, prog_bar=False)
-            self.log(f"{k}_train_rhand_PCK_20", rhand_pck_20, prog_bar=False)
-            self.log(f"{k}_train_lhand_PCK_20", lhand_pck_20, prog_bar=False)
-            self.log(f"{k}_train_rhand_PCK_auc_20_40", rhand_pck_auc_20_40, prog_bar=False)
-            self.log(f"{k}_train_lhand_PCK_auc_20_40", lhand_pck_auc_20_40, prog_bar=False)
+            rhand_pck_20, rhand_pck_auc_20_40 = self._pck(
+                self.train_pck, means, stds, rhand_logits, rhand, rhand_frame_mask
+            )
+            lhand_pck_20, lhand_pck_auc_20_40 = self._pck(
+                self.train_pck, means, stds, lhand_logits, lhand, lhand_frame_mask
+            )
+            # Log metrics, they stay on-device until the next flush
+            self.scalar_logger.add(f"{k}_train_loss", loss)
+            self.scalar_logger.add(f"{k}_train_rhand_PCK_20", rhand_pck_20)
+            self.scalar_logger.add(f"{k}_train_lhand_PCK_20", lhand_pck_20)
+            self.scalar_logger.add(f"{k}_train_rhand_PCK_auc_20_40", rhand_pck_auc_20_40)
+            self.scalar_logger.add(f"{k}_train_lhand_PCK_auc_20_40", lhand_pck_auc_20_40)
+        self.scalar_logger.step(self.global_step)
+
+    def _optimizer_step(self, opt, sch):
+        """
+        Clip the accumulated gradients if enabled, step and reset them.
+
+        Parameters:
+        opt (LightningOptimizer): The optimizer.
+        sch (LRScheduler): The learning rate scheduler, if any.
+        """
+        if self.gradient_clip_val is not None:
+            self.clip_gradients(opt, gradient_clip_val=self.gradient_clip_val, gradient_clip_algorithm="norm")
+        opt.step()
+        opt.zero_grad()
+        self._n_accumulated = 0
+        if isinstance(sch, torch.optim.lr_scheduler.OneCycleLR):
+            sch.step()
+
+    def on_train_epoch_end(self):
+        # Do not carry partial logging intervals over epochs
+        self.scalar_logger.flush(self.global_step)
         
     def validation_step(self, batch, batch_idx, dataloader_idx):
-        # Identify the dataset key based on the dataloader index
-        dataset_key = list(self.trainer.datamodule.val_dataloaders.keys())[dataloader_idx]
+        # Identify the dataset key based on the dataloader index, and whether
+        # the batch is from a full validation set while validating on subsets
+        dataset_key, full = self.trainer.datamodule.val_dataloader_info(dataloader_idx)
+        prefix = "val_full" if full else "val"
+        # Process data through the model and compute the loss
+        loss, (rhand_logits, rhand, rhand_frame_mask), (lhand_logits, lhand, lhand_frame_mask) = \
+            self._shared_step(batch)
+        # Compute metrics
+        means, stds = self._norm_stats(dataset_key=dataset_key)
+        rhand_pck_20, rhand_pck_auc_20_40 = self._pck(
+            self.val_pck, means, stds, rhand_logits, rhand, rhand_frame_mask
+        )
+        lhand_pck_20, lhand_pck_auc_20_40 = self._pck(
+            self.val_pck, means, stds, lhand_logits, lhand, lhand_frame_mask
+        )
+        # Log metrics, averaged over the validation epoch
+        self.scalar_logger.add(f"{dataset_key}_{prefix}_loss", loss)
+        self.scalar_logger.add(f"{dataset_key}_{prefix}_rhand_pck_20", rhand_pck_20)
+        self.scalar_logger.add(f"{dataset_key}_{prefix}_lhand_pck_20", lhand_pck_20)
+        self.scalar_logger.add(f"{dataset_key}_{prefix}_rhand_pck_auc_20_40", rhand_pck_auc_20_40)
+        self.scalar_logger.add(f"{dataset_key}_{prefix}_lhand_pck_auc_20_40", lhand_pck_auc_20_40)
+        # Accumulate epoch level average results
+        mean_loss = self.val_full_mean_loss if full else self.val_mean_loss
+        mean_pck_20 = self.val_full_mean_pck_20 if full else self.val_mean_pck_20
+        mean_loss.update(loss.detach())
+        mean_pck_20.update(rhand_pck_20)
+        mean_pck_20.update(lhand_pck_20)
+    
+    def on_validation_epoch_end(self):
+        # Write the per-dataset means of the epoch
+        self.scalar_logger.flush(self.global_step)
+        # The averages are shared by all the validation dataloaders, logging 
+        # them from `validation_step` would log the same keys once per 
+        # dataloader. `compute` syncs them across processes
+        self.log("val_loss", self.val_mean_loss.compute())
+        self.log("val_PCK_20", self.val_mean_pck_20.compute())
+        self.val_mean_loss.reset()
+        self.val_mean_pck_20.reset()
+        # Full validation sets only run on some epochs
+        if self.val_full_mean_loss.update_called:
+            self.log("val_full_loss", self.val_full_mean_loss.compute())
+            self.log("val_full_PCK_20", self.val_full_mean_pck_20.compute())
+            self.val_full_mean_loss.reset()
+            self.val_full_mean_pck_20.reset()
+
+    def _norm_stats(self, dataset_key=None, dataset_idxs=None):
+        """
+        Get the means and stds used to reverse the inputs normalization.
+
+        Parameters:
+        dataset_key (str, optional): The dataset a whole batch comes from.
+        dataset_idxs (Tensor, optional): (N,) dataset index of each sample of 
+        a mixed batch.
+
+        Returns:
+        tuple: Means and stds broadcastable to (N, T, V, 2) keypoints, or 
+        None if inputs are not normalized.
+        """
+        if not self.normalize_inputs:
+            return None, None
+        datamodule = self.trainer.datamodule
+        if dataset_idxs is not None:
+            # Check that means and stds are in the same device as trainer
+            if self.device != datamodule.means_table.device:
+                datamodule.means_table = datamodule.means_table.to(self.device)
+                datamodule.stds_table = datamodule.stds_table.to(self.device)
+            # Per-sample statistics
+            means = datamodule.means_table[dataset_idxs].view(-1, 1, 1, 2)
+            stds = datamodule.stds_table[dataset_idxs].view(-1, 1, 1, 2)
+            return means, stds
+        # Check that means and stds are in the same device as trainer
+        if self.device != datamodule.means[dataset_key].device:
+            datamodule.means[dataset_key] = datamodule.means[dataset_key].to(self.device)
+        if self.device != datamodule.stds[dataset_key].device:
+            datamodule.stds[dataset_key] = datamodule.stds[dataset_key].to(self.device)
+
+        return datamodule.means[dataset_key], datamodule.stds[dataset_key]
+
+    def _pck(self, metric, means, stds, logits, target, frame_mask):
+        """
+        Compute PCK@20 and PCK AUC 20-40 of one hand for a single step.
+
+        Parameters:
+        metric (PCKCurve): The metric to use, it is reset afterwards.
+        means (Tensor): Normalization means, see `_norm_stats`. None if inputs
+        are not normalized.
+        stds (Tensor): Normalization stds, see `_norm_stats`. None if inputs
+        are not normalized.
+        logits (Tensor): (N, T, V, 2) predicted keypoints.
+        target (Tensor): (N, T, V, 2) ground truth keypoints.
+        frame_mask (Tensor): (N, T) boolean mask of the masked frames, metrics
+        are only computed on them.
+
+        Returns:
+        tuple: PCK@20 and PCK AUC 20-40.
+        """
+        if means is not None:
+            # Reverse mean 0 and std 1 normalization to obtain 2D image coordinates
+            logits = (logits * stds) + means
+            target = (target * stds) + means
+        # Distances are binned once for all thresholds, with a dense mask
+        metric.update(preds=logits, target=target, mask=frame_mask.unsqueeze(-1))
+        pck_20 = metric.pck(20)
+        pck_auc_20_40 = metric.auc(20, 40)
+        metric.reset()
+
+        return pck_20, pck_auc_20_40
+
+    def _shared_step(self, batch):
+        """
+        Run the forward pass and compute the loss of a single dataset batch.
+
+        If compilation is enabled, the time dimension is padded up to its 
+        bucket length so compiled graphs are reused across batches and datasets.
+
+        Parameters:
+        batch (tuple): A batch as returned by `mask_keypoint_dataset_collate_fn`.
+
+        Returns:
+        tuple: The loss and, for each hand, a tuple with the predicted and 
+        ground truth keypoints and the (N, T) boolean mask of the masked frames.
+        Time dimensions might be padded.
+        """
         # Unpack the batch data
         (seq_idx, 
         arms,
@@ -325,86 +487,106 @@ class SignBertModel(pl.LightningModule):
         lhand_masked,
         lhand_masked_frames_idx,
         lhand_scores) = batch
-        # Process data through the model
-        hand_data = self(arms, rhand_masked, lhand_masked)
-        # Extract relevant outputs from the model for both right and left hands
+        T = rhand_masked.shape[1]
+        if self.compile_args is not None:
+            buckets = self.compile_args.get('buckets', SignBertModel.COMPILE_BUCKETS)
+            (arms, rhand, rhand_masked, rhand_scores, lhand, lhand_masked, lhand_scores) = [
+                pad_to_bucket(t, buckets, dim=1) 
+                for t in (arms, rhand, rhand_masked, rhand_scores, lhand, lhand_masked, lhand_scores)
+            ]
+        # Dense masks of the frames the loss is applied on and of the frames 
+        # present before bucket padding. Avoids dynamic shapes in the loss
+        rhand_frame_mask = masked_frames_to_mask(rhand_masked_frames_idx, rhand_masked.shape[1])
+        lhand_frame_mask = masked_frames_to_mask(lhand_masked_frames_idx, lhand_masked.shape[1])
+        seq_mask = torch.arange(rhand_masked.shape[1], device=rhand_masked.device) < T
+        loss, rhand_logits, lhand_logits = self._get_forward_loss()(
+            arms,
+            rhand,
+            rhand_masked,
+            rhand_scores,
+            rhand_frame_mask,
+            lhand,
+            lhand_masked,
+            lhand_scores,
+            lhand_frame_mask,
+            seq_mask
+        )
+
+        return (
+            loss, 
+            (rhand_logits, rhand, rhand_frame_mask), 
+            (lhand_logits, lhand, lhand_frame_mask)
+        )
+
+    def _get_forward_loss(self):
+        """Return the forward and loss function, compiled if enabled."""
+        if self.compile_args is None:
+            return self._forward_loss
+        if self._compiled_forward_loss is None:
+            self._compiled_forward_loss = torch.compile(
+                self._forward_loss,
+                mode=self.compile_args.get('mode', 'default'),
+                dynamic=False
+            )
+        return self._compiled_forward_loss
+
+    def _forward_loss(
+            self, 
+            arms, 
+            rhand, 
+            rhand_masked, 
+            rhand_scores, 
+            rhand_frame_mask, 
+            lhand, 
+            lhand_masked, 
+            lhand_scores, 
+            lhand_frame_mask, 
+            seq_mask
+        ):
+        """
+        Forward pass followed by the loss computation, with static shapes.
+
+        Returns:
+        tuple: The loss and the predicted 2D keypoints of both hands.
+        """
+        hand_data = self.forward(arms, rhand_masked, lhand_masked)
+        # Extract logits, pose coefficients, and betas from the model's output
         (rhand_logits, rhand_theta, rhand_beta, _, _, _, _, _, _) = hand_data["rhand"]
         (lhand_logits, lhand_theta, lhand_beta, _, _, _, _, _, _) = hand_data["lhand"]
-        # Compute loss for both hands based on the masked frames
-        rhand_valid_idxs = torch.where(rhand_masked_frames_idx != -1.)
-        rhand_logits = rhand_logits[rhand_valid_idxs]
-        rhand = rhand[rhand_valid_idxs]
-        rhand_scores = rhand_scores[rhand_valid_idxs]
-        lhand_valid_idxs = torch.where(lhand_masked_frames_idx != -1.)
-        lhand_logits = lhand_logits[lhand_valid_idxs]
-        lhand = lhand[lhand_valid_idxs]
-        lhand_scores = lhand_scores[lhand_valid_idxs]
-        # Compute LRec and LReg
-        rhand_lrec = torch.norm(rhand_logits - rhand, p=1, dim=2)
-        rhand_scores = torch.where(rhand_scores >= self.eps, 1., rhand_scores)
-        rhand_lrec = (rhand_lrec * rhand_scores).sum()
-        lhand_lrec = torch.norm(lhand_logits - lhand, p=1, dim=2)
-        lhand_scores = torch.where(lhand_scores >= self.eps, 1., lhand_scores)
-        lhand_lrec = (lhand_lrec * lhand_scores).sum()
-        rhand_beta_t_minus_one = torch.roll(rhand_beta, shifts=1, dims=1)
-        rhand_beta_t_minus_one[:, 0] = 0.
-        rhand_lreg = torch.norm(rhand_theta, 2) + self.weight_beta * torch.norm(rhand_beta, 2) + \
-            self.weight_delta * torch.norm(rhand_beta - rhand_beta_t_minus_one, 2)
-        rhand_loss = rhand_lrec + (self.lmbd * rhand_lreg)
-        lhand_lrec = torch.norm(lhand_logits[lhand_scores>self.eps] - lhand[lhand_scores>self.eps], p=1, dim=1).sum()
-        lhand_beta_t_minus_one = torch.roll(lhand_beta, shifts=1, dims=1)
-        lhand_beta_t_minus_one[:, 0] = 0.
-        lhand_lreg = torch.norm(lhand_theta, 2) + self.weight_beta * torch.norm(lhand_beta, 2) + \
-            self.weight_delta * torch.norm(lhand_beta - lhand_beta_t_minus_one, 2)
-        lhand_loss = lhand_lrec + (self.lmbd * lhand_lreg)
-        # Combine both losses
-        loss = rhand_loss + lhand_loss
-        # Compute metrics
-        if self.normalize_inputs:
-            # Check that means and stds are in the same device as trainer
-            if self.device != self.trainer.datamodule.means[dataset_key].device:
-                self.trainer.datamodule.means[dataset_key] = self.trainer.datamodule.means[dataset_key].to(self.device)
-            if self.device != self.trainer.datamodule.stds[dataset_key].device:
-                self.trainer.datamodule.stds[dataset_key] = self.trainer.datamodule.stds[dataset_key].to(self.device)
-            # Reverse normalization
-            means = self.trainer.datamodule.means[dataset_key]
-            stds = self.trainer.datamodule.stds[dataset_key]
-            rhand_logits = (rhand_logits * stds) + means
-            lhand_logits = (lhand_logits * stds) + means
-            rhand = (rhand * stds) + means
-            lhand = (lhand * stds) + means
-        # Compute metrics   
-        rhand_pck_20 = self.val_pck_20.update(preds=rhand_logits, target=rhand)
-        rhand_pck_20 = self.val_pck_20.compute()
-        self.val_pck_20.reset()
-        lhand_pck_20 = self.val_pck_20(preds=lhand_logits, target=lhand)
-        lhand_pck_20 = self.val_pck_20.compute()
-        self.val_pck_20.reset()
-        rhand_pck_auc_20_40 = self.val_pck_auc_20_40(preds=rhand_logits, target=rhand)
-        rhand_pck_auc_20_40 = self.val_pck_auc_20_40.compute()
-        self.val_pck_auc_20_40.reset()
-        lhand_pck_auc_20_40 = self.val_pck_auc_20_40(preds=lhand_logits, target=lhand)
-        lhand_pck_auc_20_40 = self.val_pck_auc_20_40.compute()
-        self.val_pck_auc_20_40.reset()
-        # Log metrics
-        self.log(f"{dataset_key}_val_loss", loss, prog_bar=False)
-        self.log(f"{dataset_key}_val_rhand_pck_20", rhand_pck_20, prog_bar=False)
-        self.log(f"{dataset_key}_val_lhand_pck_20", lhand_pck_20, prog_bar=False)
-        self.log(f"{dataset_key}_val_rhand_pck_auc_20_40", rhand_pck_auc_20_40, prog_bar=False)
-        self.log(f"{dataset_key}_val_lhand_pck_auc_20_40", lhand_pck_auc_20_40, prog_bar=False)
-        # Store epoch level average results
-        self.mean_loss.append(loss.detach().cpu())
-        self.mean_pck_20.append(rhand_pck_20)
-        self.mean_pck_20.append(lhand_pck_20)
-    
-    def on_validation_epoch_end(self):
-        # Compute the mean of the metrics at the end of the epoch
-        mean_epoch_loss = torch.stack(self.mean_loss).mean()
-        mean_epoch_pck_20 = torch.stack(self.mean_pck_20).mean()
-        self.log("val_loss", mean_epoch_loss, prog_bar=False)
-        self.log("val_PCK_20", mean_epoch_pck_20, prog_bar=False)
-        self.mean_loss.clear()
-        self.mean_pck_20.clear()
+        # Compute reconstruction loss (LRec) and regularization loss (LReg) 
+        # for both hands at once, always in float32
+        with disable_autocast(self.device):
+            loss = self.criterion(
+                logits=torch.stack((rhand_logits, lhand_logits)),
+                target=torch.stack((rhand, lhand)).float(),
+                scores=torch.stack((rhand_scores, lhand_scores)).float(),
+                frame_mask=torch.stack((rhand_frame_mask, lhand_frame_mask)),
+                theta=torch.stack((rhand_theta, lhand_theta)),
+                beta=torch.stack((rhand_beta, lhand_beta)),
+                seq_mask=seq_mask
+            )
+
+        return loss, rhand_logits, lhand_logits
+
+    def _total_optimizer_steps(self):
+        """
+        Estimate the number of optimizer steps of the whole training.
+
+        Under manual optimization `estimated_stepping_batches` is the number
+        of batches. Each batch holds one step per dataset in "sequential" mode
+        and steps are made every `accumulate_grad_batches` of them, flushing 
+        the remaining accumulated gradients at the end of each epoch.
+
+        Returns:
+        int: An upper bound of the number of optimizer steps.
+        """
+        datamodule = self.trainer.datamodule
+        steps_per_batch = 1
+        if getattr(datamodule, "mode", "mixed") == "sequential":
+            steps_per_batch = len(datamodule.dataset_keys)
+        micro_steps = self.trainer.estimated_stepping_batches * steps_per_batch
+        # Plus one step per epoch for the flushed partial accumulations
+        return math.ceil(micro_steps / self.accumulate_grad_batches) + max(self.trainer.max_epochs, 1)
 
     def configure_optimizers(self):
         toret = {}
@@ -414,7 +596,7 @@ class SignBertModel(pl.LightningModule):
                 scheduler=torch.optim.lr_scheduler.OneCycleLR(
                     optimizer, 
                     max_lr=self.lr,
-                    total_steps=self.trainer.estimated_stepping_batches,
+                    total_steps=self._total_optimizer_steps(),
                     pct_start=self.pct_start,
                     anneal_strategy='linear'
                 )
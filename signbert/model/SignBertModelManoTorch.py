@@ -1,14 +1,24 @@
 import os
+from typing import TYPE_CHECKING
 
 import torch
 import numpy as np
 import lightning.pytorch as pl
+from torchmetrics import MeanMetric
 
-from signbert.utils import my_import
-from signbert.metrics.PCK import PCK, PCKAUC
+from signbert.utils import (
+    my_import, 
+    pad_to_bucket, 
+    masked_frames_to_mask, 
+    disable_autocast, 
+    maybe_checkpoint
+)
+from signbert.metrics.PCK import PCK, PCKAUC, PCKCurve
+from signbert.metrics.DeferredScalarLogger import DeferredScalarLogger
 from signbert.model.PositionalEncoding import PositionalEncoding
-from manotorch.manolayer import ManoLayer, MANOOutput
-from IPython import embed; from sys import exit
+from signbert.model.HandReconstructionLoss import HandReconstructionLoss
+if TYPE_CHECKING:
+    from manotorch.manolayer import MANOOutput
 
 
 class SignBertModel(pl.LightningModule):
@@ -30,6 +40,9 @@ class SignBertModel(pl.LightningModule):
     rhand_hd, lhand_hd (ManoLayer): MANO layers for detailed hand pose estimation.
     PCK and PCKAUC metrics for training and validation.
     """
+    # Sequence lengths the time dimension is padded to when compiling
+    COMPILE_BUCKETS = (128, 256, 512, 1024, 2048)
+
     def __init__(
             self, 
             in_channels, 
@@ -53,6 +66,9 @@ class SignBertModel(pl.LightningModule):
             weight_decay=0.01,
             use_onecycle_lr=False,
             pct_start=None,
+            compile_args=None,
+            tformer_checkpoint=False,
+            log_every_n_steps=50,
             *args,
             **kwargs,
         ):
@@ -80,6 +96,16 @@ class SignBertModel(pl.LightningModule):
         self.weight_decay = weight_decay
         self.use_onecycle_lr = use_onecycle_lr
         self.pct_start = pct_start
+        # If set, forward and loss are compiled with `torch.compile`. Accepted
+        # keys: `mode` (compilation mode) and `buckets` (sequence lengths)
+        self.compile_args = compile_args
+        self._compiled_forward_loss = None
+        # Whether to apply activation checkpointing to each transformer layer
+        self.tformer_checkpoint = tformer_checkpoint
+        # Per-step scalars are averaged on-device and written every 
+        # `log_every_n_steps` steps, see `setup`
+        self.log_every_n_steps = log_every_n_steps
+        self.scalar_logger = None
         # Variable to control the input channels dynamically based if clustering is enabled
         num_hid_mult = 1 if hand_cluster else 21
         # Initialization of various components of the model
@@ -105,6 +131,8 @@ class SignBertModel(pl.LightningModule):
         mano_assets_root = os.path.split(__file__)[0]
         mano_assets_root = os.path.join(mano_assets_root, "thirdparty", "mano_assets")
         assert os.path.isdir(mano_assets_root), "Download MANO files, check README."
+        # manotorch is slow to import, it is only needed to build the MANO layers
+        from manotorch.manolayer import ManoLayer
         self.hd = ManoLayer(
             center_idx=0,
             flat_hand_mean=flat_hand,
@@ -112,14 +140,21 @@ class SignBertModel(pl.LightningModule):
             use_pca=use_pca,
             ncomps=n_pca_components,
         )
+        # Reconstruction and regularization loss, joints with a low score are left out
+        self.criterion = HandReconstructionLoss(
+            eps=eps, 
+            lmbd=lmbd, 
+            weight_beta=weight_beta, 
+            weight_delta=weight_delta, 
+            score_weighted=False
+        )
         # PCK and PCKAUC metrics for training and validation
-        self.train_pck_20 = PCK(thr=20)
-        self.train_pck_auc_20_40 = PCKAUC(thr_min=20, thr_max=40)
+        self.train_pck = PCKCurve(thresholds=range(20, 41))
         self.val_pck_20 = PCK(thr=20)
         self.val_pck_auc_20_40 = PCKAUC(thr_min=20, thr_max=40)
-        # Placeholders
-        self.train_step_losses = []
-        self.val_step_losses = []
+        # Epoch level losses, accumulated on-device
+        self.train_mean_loss = MeanMetric()
+        self.val_mean_loss = MeanMetric()
 
     def forward(self, x):
         # Extract hand tokens using gesture extractor
@@ -131,7 +166,45 @@ class SignBertModel(pl.LightningModule):
         # Apply positional encoding
         x = self.pe(x)
         # Process data through the transformer encoder
-        x = self.te(x)
+        x = self._transformer(x)
+        # Parameters regression, MANO and the projection are numerically 
+        # fragile in reduced precision, so they always run in float32
+        with disable_autocast(self.device):
+            return self._decode(x.float())
+
+    def _transformer(self, x):
+        """
+        Apply the transformer encoder.
+
+        Layers are called one by one when activation checkpointing is 
+        enabled, so only their inputs are kept for the backward pass.
+
+        Parameters:
+        x (Tensor): (N, T, C) input tokens.
+
+        Returns:
+        Tensor: (N, T, C) encoded tokens.
+        """
+        if not self.tformer_checkpoint:
+            return self.te(x)
+        for layer in self.te.layers:
+            x = maybe_checkpoint(True, layer, x)
+        if self.te.norm is not None:
+            x = self.te.norm(x)
+
+        return x
+
+    def _decode(self, x):
+        """
+        Predict hand and camera parameters and project MANO joints to 2D.
+
+        Parameters:
+        x (Tensor): (N, T, C) transformer outputs.
+
+        Returns:
+        tuple: Outputs, see `forward`.
+        """
+        N, T = x.shape[:2]
         # Predict hand and camera parameters 
         params = self.pg(x)
         # Extract hand parameters
@@ -149,15 +222,16 @@ class SignBertModel(pl.LightningModule):
         # Reshape hand parameters for processing 
         pose_coeffs = pose_coeffs.view(N*T, -1)
         betas = betas.view(N*T, -1)
-        # Apply the MANO model to obtain 3D joints and vertices
+        # Apply the MANO model to obtain 3D joints and vertices. Vertices and
+        # center joints stay on the device, see the pre-training model
         mano_output: MANOOutput = self.hd(pose_coeffs, betas)
         # Extract and reshape the MANO output
         vertices = mano_output.verts
         joints_3d = mano_output.joints
         pose_coeffs = pose_coeffs.view(N, T, -1)
         betas = betas.view(N, T, -1)
-        vertices = vertices.view(N, T, 778, 3).detach().cpu()
-        center_joint = mano_output.center_joint.detach().cpu()
+        vertices = vertices.view(N, T, 778, 3).detach()
+        center_joint = mano_output.center_joint.detach()
         joints_3d = joints_3d.view(N, T, 21, 3)
         # Apply ortographic projection to the 3D joints to obtain 2D image coordinates
         x = torch.matmul(R, joints_3d.permute(0, 1, 3, 2)).permute(0, 1, 3, 2)
@@ -167,95 +241,163 @@ class SignBertModel(pl.LightningModule):
 
         return x, pose_coeffs, betas, vertices, R, S, O, center_joint, joints_3d
 
+    def setup(self, stage):
+        # Per-step scalars are written to TensorBoard from a background thread
+        writer = self.logger.experiment if self.logger is not None else None
+        self.scalar_logger = DeferredScalarLogger(writer, flush_every=self.log_every_n_steps)
+
+    def teardown(self, stage):
+        # Write the remaining scalars
+        if self.scalar_logger is not None:
+            self.scalar_logger.flush(self.global_step)
+            self.scalar_logger.close()
+
     def training_step(self, batch):
         # Unpack the batch data
         _, x_or, x_masked, scores, masked_frames_idxs = batch
-        # Forward pass through the model
-        (logits, theta, beta, _, _, _, _, _, _) = self(x_masked)
-        # Loss only applied on frames with masked joints
-        valid_idxs = torch.where(masked_frames_idxs != -1.)
-        logits = logits[valid_idxs]
-        x_or = x_or[valid_idxs]
-        scores = scores[valid_idxs]
-        # Compute reconstruction loss (LRec) and regularization loss (LReg)
-        lrec = torch.norm(logits[scores>self.eps] - x_or[scores>self.eps], p=1, dim=1).sum()
-        beta_t_minus_one = torch.roll(beta, shifts=1, dims=1)
-        beta_t_minus_one[:, 0] = 0.
-        lreg = torch.norm(theta, 2) + self.weight_beta * torch.norm(beta, 2) + \
-            self.weight_delta * torch.norm(beta - beta_t_minus_one, 2)
-        # Combine both losses
-        loss = lrec + (self.lmbd * lreg)
-        # Append step loss 
-        self.train_step_losses.append(loss.detach().cpu())
-        if self.normalize_inputs: # If inputs to the network are normalized
-            # Set means and stds attributes if they are not already
-            if not hasattr(self, 'means') or not hasattr(self, 'stds'):
-                self.means = torch.from_numpy(np.load(self.trainer.datamodule.MEANS_NPY_FPATH)).to(self.device)
-                self.stds = torch.from_numpy(np.load(self.trainer.datamodule.STDS_NPY_FPATH)).to(self.device)
-            # Reverse normalization
-            logits = (logits * self.stds) + self.means
-            x_or = (x_or * self.stds) + self.means
-        # Compute PCK metrics
-        self.train_pck_20(preds=logits, target=x_or)
-        self.train_pck_auc_20_40(preds=logits, target=x_or)
-        # Log metrics
-        self.log('train_loss', loss, on_step=True, prog_bar=True)
-        self.log('train_PCK_20', self.train_pck_20, on_step=True, on_epoch=False)
-        self.log('train_PCK_AUC_20-40', self.train_pck_auc_20_40, on_step=True, on_epoch=False)
+        # Forward pass through the model and loss computation
+        loss, logits, x_or, frame_mask = self._shared_step(x_or, x_masked, scores, masked_frames_idxs)
+        # Accumulate step loss 
+        self.train_mean_loss.update(loss.detach())
+        logits, x_or = self._denormalize(logits, x_or)
+        # Compute PCK metrics, only on frames with masked joints
+        self.train_pck.update(preds=logits, target=x_or, mask=frame_mask.unsqueeze(-1))
+        # Log metrics, they stay on-device until the next flush
+        self.scalar_logger.add('train_loss', loss)
+        self.scalar_logger.add('train_PCK_20', self.train_pck.pck(20))
+        self.scalar_logger.add('train_PCK_AUC_20-40', self.train_pck.auc(20, 40))
+        self.scalar_logger.step(self.global_step)
+        self.train_pck.reset()
 
         return loss
 
     def on_train_epoch_end(self):
-        # Compute mean of step losses at the end of the epoch
-        mean_epoch_loss = torch.stack(self.train_step_losses).mean()
+        # Log mean of step losses at the end of the epoch
+        mean_epoch_loss = self.train_mean_loss.compute()
         self.logger.experiment.add_scalars("losses", {"train_loss": mean_epoch_loss}, global_step=self.current_epoch)
-        # Clear step losses placeholder
-        self.train_step_losses.clear()
+        self.train_mean_loss.reset()
+        self.scalar_logger.flush(self.global_step)
 
     def validation_step(self, batch, batch_idx):
         # Unpack batch data
         _, x_or, x_masked, scores, masked_frames_idxs = batch
-        # Process data through the model
-        (logits, beta, theta, _, _, _, _, _, _) = self(x_masked)
-        # Loss is only applied on frames with masked joints
-        valid_idxs = torch.where(masked_frames_idxs != -1.)
-        logits = logits[valid_idxs]
-        x_or = x_or[valid_idxs]
-        scores = scores[valid_idxs]
-        # Compute LRec and LReg
-        lrec = torch.norm(logits[scores>self.eps] - x_or[scores>self.eps], p=1, dim=1).sum()
-        beta_t_minus_one = torch.roll(beta, shifts=1, dims=1)
-        beta_t_minus_one[:, 0] = 0.
-        lreg = torch.norm(theta, 2) + self.weight_beta * torch.norm(beta, 2) + \
-            self.weight_delta * torch.norm(beta - beta_t_minus_one, 2)
-        # Combine both losses
-        loss = lrec + (self.lmbd * lreg)
-        # Append validation step loss
-        self.val_step_losses.append(loss)
-        if self.normalize_inputs: # If inputs to the network are normalized
-            # Set means and stds attributes if they are not already
-            if not hasattr(self, 'means') or not hasattr(self, 'stds'):
-                self.means = torch.from_numpy(np.load(self.trainer.datamodule.MEANS_NPY_FPATH)).to(self.device)
-                self.stds = torch.from_numpy(np.load(self.trainer.datamodule.STDS_NPY_FPATH)).to(self.device)
-            # Reverse normalization
-            logits = (logits * self.stds) + self.means
-            x_or = (x_or * self.stds) + self.means
-        # Compute PCK metrics
-        self.val_pck_20(preds=logits, target=x_or)
-        self.val_pck_auc_20_40(preds=logits, target=x_or)
-        # Log metrics 
-        self.log('val_loss', loss, on_step=False, prog_bar=True)
+        # Process data through the model and compute the loss
+        loss, logits, x_or, frame_mask = self._shared_step(x_or, x_masked, scores, masked_frames_idxs)
+        # Accumulate validation step loss
+        self.val_mean_loss.update(loss)
+        logits, x_or = self._denormalize(logits, x_or)
+        # Compute PCK metrics, only on frames with masked joints
+        mask = frame_mask.unsqueeze(-1)
+        self.val_pck_20.update(preds=logits, target=x_or, mask=mask)
+        self.val_pck_auc_20_40.update(preds=logits, target=x_or, mask=mask)
+        # Log metrics, they are computed at the end of the epoch
+        self.log('val_loss', self.val_mean_loss, on_step=False, on_epoch=True, prog_bar=True)
         self.log('val_PCK_20', self.val_pck_20, on_step=False, on_epoch=True, prog_bar=True)
         self.log('val_PCK_AUC_20_40', self.val_pck_auc_20_40, on_step=False, on_epoch=True)
         self.log("hp_metric", self.val_pck_20, on_step=False, on_epoch=True)
 
     def on_validation_epoch_end(self):
-        # Compute mean step losses at the end of the epoch
-        mean_epoch_loss = torch.stack(self.val_step_losses).mean()
+        # Log mean step losses at the end of the epoch
+        mean_epoch_loss = self.val_mean_loss.compute()
         self.logger.experiment.add_scalars("losses", {"val_loss": mean_epoch_loss}, global_step=self.current_epoch)
-        # Clear step losses placeholder
-        self.val_step_losses.clear()
-        
+
+    def _denormalize(self, logits, x_or):
+        """
+        Reverse the inputs normalization, if enabled.
+
+        Parameters:
+        logits (Tensor): Predicted keypoints.
+        x_or (Tensor): Ground truth keypoints.
+
+        Returns:
+        tuple: Predicted and ground truth keypoints in image coordinates.
+        """
+        if not self.normalize_inputs: # If inputs to the network are not normalized
+            return logits, x_or
+        # Set means and stds attributes if they are not already
+        if not hasattr(self, 'means') or not hasattr(self, 'stds'):
+            self.means = torch.from_numpy(np.load(self.trainer.datamodule.MEANS_NPY_FPATH)).to(self.device)
+            self.stds = torch.from_numpy(np.load(self.trainer.datamodule.STDS_NPY_FPATH)).to(self.device)
+        # Reverse normalization
+        logits = (logits * self.stds) + self.means
+        x_or = (x_or * self.stds) + self.means
+
+        return logits, x_or
+
+    def _shared_step(self, x_or, x_masked, scores, masked_frames_idxs):
+        """
+        Run the forward pass and compute the loss of a batch.
+
+        If compilation is enabled, the time dimension is padded up to its 
+        bucket length so compiled graphs are reused across batches.
+
+        Parameters:
+        x_or (Tensor): (N, T, V, 2) ground truth keypoints.
+        x_masked (Tensor): (N, T, V, 2) masked keypoints fed to the model.
+        scores (Tensor): (N, T, V) keypoints confidence scores.
+        masked_frames_idxs (Tensor): (N, M) masked frames indices, padded with -1.
+
+        Returns:
+        tuple: The loss, the predicted and ground truth keypoints, and the 
+        (N, T) boolean mask of the masked frames. Time dimensions might be 
+        padded.
+        """
+        T = x_masked.shape[1]
+        if self.compile_args is not None:
+            buckets = self.compile_args.get('buckets', SignBertModel.COMPILE_BUCKETS)
+            x_or = pad_to_bucket(x_or, buckets, dim=1)
+            x_masked = pad_to_bucket(x_masked, buckets, dim=1)
+            scores = pad_to_bucket(scores, buckets, dim=1)
+        # Dense masks of the frames the loss is applied on and of the frames 
+        # present before bucket padding. Avoids dynamic shapes in the loss
+        frame_mask = masked_frames_to_mask(masked_frames_idxs, x_masked.shape[1])
+        seq_mask = torch.arange(x_masked.shape[1], device=x_masked.device) < T
+        loss, logits = self._get_forward_loss()(x_or, x_masked, scores, frame_mask, seq_mask)
+
+        return loss, logits, x_or, frame_mask
+
+    def _get_forward_loss(self):
+        """Return the forward and loss function, compiled if enabled."""
+        if self.compile_args is None:
+            return self._forward_loss
+        if self._compiled_forward_loss is None:
+            self._compiled_forward_loss = torch.compile(
+                self._forward_loss,
+                mode=self.compile_args.get('mode', 'default'),
+                dynamic=False
+            )
+        return self._compiled_forward_loss
+
+    def _forward_loss(self, x_or, x_masked, scores, frame_mask, seq_mask):
+        """
+        Forward pass followed by the loss computation, with static shapes.
+
+        Parameters:
+        x_or (Tensor): (N, T, V, 2) ground truth keypoints.
+        x_masked (Tensor): (N, T, V, 2) masked keypoints fed to the model.
+        scores (Tensor): (N, T, V) keypoints confidence scores.
+        frame_mask (Tensor): (N, T) boolean mask of the masked frames.
+        seq_mask (Tensor): (T,) boolean mask of the frames that are not bucket padding.
+
+        Returns:
+        tuple: The loss and the predicted 2D keypoints.
+        """
+        (logits, theta, beta, _, _, _, _, _, _) = self.forward(x_masked)
+        # The loss is always computed in float32
+        with disable_autocast(self.device):
+            # LRec on the masked frames joints with a high enough score and LReg
+            loss = self.criterion(
+                logits=logits.unsqueeze(0),
+                target=x_or.float().unsqueeze(0),
+                scores=scores.float().unsqueeze(0),
+                frame_mask=frame_mask.unsqueeze(0),
+                theta=theta.unsqueeze(0),
+                beta=beta.unsqueeze(0),
+                seq_mask=seq_mask
+            )
+
+        return loss, logits
+
     def configure_optimizers(self):
         toret = {}
         optimizer = torch.optim.Adam(self.parameters(), lr=self.lr, weight_decay=self.weight_decay)
@@ -1 +1,12 @@
-from signbert.model import MSG3DGestureExtractor, PositionalEncoding, ArmsExtractor
\ No newline at end of file
+import importlib
+
+
+# Modules are imported on first access, so importing a single class does not
+# pull in the dependencies of every model
+_SUBMODULES = ("MSG3DGestureExtractor", "PositionalEncoding", "ArmsExtractor")
+
+
+def __getattr__(name):
+    if name in _SUBMODULES:
+        return importlib.import_module(f"{__name__}.{name}")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
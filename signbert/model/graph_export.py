@@ -0,0 +1,249 @@
+import contextlib
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+
+# Graph inputs, the keypoints of each part with their number of joints
+INPUT_NAMES = ("arms", "rhand", "lhand")
+INPUT_JOINTS = (6, 21, 21)
+# Batch and time axes of the inputs and outputs are left dynamic
+DYNAMIC_AXES = {0: "batch", 1: "time"}
+
+
+class ISLRGraph(nn.Module):
+    """
+    Exportable ISLR path: extractors, positional encoding, transformer and head.
+
+    Attributes:
+    encoder (nn.Module): The pre-trained model, with an `encode` method.
+    head (Head): The ISLR head.
+    """
+    OUTPUT_NAMES = ("logits",)
+    # Logits have no time axis
+    OUTPUT_DYNAMIC_AXES = {"logits": {0: "batch"}}
+
+    def __init__(self, encoder, head):
+        """
+        Initialize the ISLRGraph.
+
+        Parameters:
+        encoder (nn.Module): The pre-trained model, with an `encode` method.
+        head (Head): The ISLR head.
+        """
+        super().__init__()
+        # Tracing follows a single thread
+        encoder.parallel_branches = False
+        self.encoder = encoder
+        self.head = head
+
+    def forward(self, arms, rhand, lhand):
+        rhand, lhand = self.encoder.encode(arms, rhand, lhand)
+
+        return self.head(rhand, lhand)
+
+
+class JointsGraph(nn.Module):
+    """
+    Exportable pre-training path, from keypoints to the predicted 2D joints.
+
+    Only the projected MANO joints are outputs, the other decoder outputs are
+    left out of the graph.
+
+    Attributes:
+    model (SignBertModel): The pre-training model.
+    """
+    OUTPUT_NAMES = ("rhand_joints", "lhand_joints")
+    OUTPUT_DYNAMIC_AXES = {"rhand_joints": DYNAMIC_AXES, "lhand_joints": DYNAMIC_AXES}
+
+    def __init__(self, model):
+        """
+        Initialize the JointsGraph.
+
+        Parameters:
+        model (SignBertModel): The pre-training model.
+        """
+        super().__init__()
+        model.parallel_branches = False
+        self.model = model
+
+    def forward(self, arms, rhand, lhand):
+        outputs = self.model(arms, rhand, lhand)
+
+        return outputs["rhand"][0], outputs["lhand"][0]
+
+
+@contextlib.contextmanager
+def no_transformer_fastpath():
+    """
+    Disable the fused transformer inference kernels, which are not traceable.
+
+    Does nothing on PyTorch versions without the switch.
+    """
+    mha = getattr(torch.backends, "mha", None)
+    if mha is None or not hasattr(mha, "set_fastpath_enabled"):
+        yield
+        return
+    enabled = mha.get_fastpath_enabled()
+    mha.set_fastpath_enabled(False)
+    try:
+        yield
+    finally:
+        mha.set_fastpath_enabled(enabled)
+
+def example_inputs(batch_size, num_frames, seed=0):
+    """
+    Random keypoints inputs.
+
+    Values are kept away from zero, zero frames are taken as padding.
+
+    Parameters:
+    batch_size (int): The batch size.
+    num_frames (int): The number of frames.
+    seed (int): The random seed. Default is 0.
+
+    Returns:
+    tuple: (N, T, V, 2) arms, right hand and left hand keypoints.
+    """
+    generator = torch.Generator().manual_seed(seed)
+
+    return tuple(
+        torch.rand((batch_size, num_frames, V, 2), generator=generator) + 0.5
+        for V in INPUT_JOINTS
+    )
+
+def export_torchscript(graph, inputs, fpath):
+    """
+    Trace a graph and save it as TorchScript.
+
+    The third-party extractors are not scriptable, so the graph is traced.
+    Sizes are read from the inputs at runtime, so batch and time stay
+    dynamic as long as the traced code does not branch on them, which
+    `check_parity` verifies on other shapes.
+
+    Parameters:
+    graph (nn.Module): `ISLRGraph` or `JointsGraph`, in eval mode.
+    inputs (tuple): Example arms, right hand and left hand keypoints.
+    fpath (str): Output file path.
+    """
+    with torch.no_grad(), no_transformer_fastpath():
+        traced = torch.jit.trace(graph, inputs, check_trace=False)
+    traced.save(fpath)
+
+def export_onnx(graph, inputs, fpath, opset_version=17):
+    """
+    Export a graph to ONNX, with dynamic batch and time axes.
+
+    Parameters:
+    graph (nn.Module): `ISLRGraph` or `JointsGraph`, in eval mode.
+    inputs (tuple): Example arms, right hand and left hand keypoints.
+    fpath (str): Output file path.
+    opset_version (int): The ONNX opset. Default is 17.
+    """
+    dynamic_axes = {k: DYNAMIC_AXES for k in INPUT_NAMES}
+    dynamic_axes.update(graph.OUTPUT_DYNAMIC_AXES)
+    with torch.no_grad(), no_transformer_fastpath():
+        torch.onnx.export(
+            graph,
+            inputs,
+            fpath,
+            input_names=list(INPUT_NAMES),
+            output_names=list(graph.OUTPUT_NAMES),
+            dynamic_axes=dynamic_axes,
+            opset_version=opset_version,
+            do_constant_folding=True
+        )
+
+def load_onnx_session(fpath, num_threads=None):
+    """
+    Open an ONNX Runtime CPU session, with all graph optimizations.
+
+    Parameters:
+    fpath (str): The ONNX file.
+    num_threads (int, optional): The intra-op threads, ONNX Runtime default
+    if None.
+
+    Returns:
+    onnxruntime.InferenceSession: The session.
+    """
+    # Only needed to run exported graphs, not to train
+    import onnxruntime as ort
+
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    if num_threads is not None:
+        options.intra_op_num_threads = num_threads
+
+    return ort.InferenceSession(fpath, options, providers=["CPUExecutionProvider"])
+
+def check_parity(graph, shapes, torchscript_fpath=None, onnx_fpath=None, rtol=1e-4, atol=1e-4):
+    """
+    Compare exported graphs outputs with eager mode ones.
+
+    Shapes other than the export one catch sizes baked in the graphs.
+
+    Parameters:
+    graph (nn.Module): The eager `ISLRGraph` or `JointsGraph`, in eval mode.
+    shapes (list): (batch size, number of frames) pairs to test.
+    torchscript_fpath (str, optional): The TorchScript file, skipped if None.
+    onnx_fpath (str, optional): The ONNX file, skipped if None.
+    rtol (float): Relative tolerance. Default is 1e-4.
+    atol (float): Absolute tolerance. Default is 1e-4.
+
+    Returns:
+    list: One dict per shape and format, with the max. absolute difference.
+
+    Raises:
+    AssertionError: If an output is out of tolerance.
+    """
+    runners = {}
+    if torchscript_fpath is not None:
+        traced = torch.jit.load(torchscript_fpath, map_location="cpu")
+        runners["torchscript"] = lambda inputs: traced(*inputs)
+    if onnx_fpath is not None:
+        session = load_onnx_session(onnx_fpath)
+        runners["onnx"] = lambda inputs: session.run(
+            None, {k: x.numpy() for k, x in zip(INPUT_NAMES, inputs)}
+        )
+    results = []
+    for i, (batch_size, num_frames) in enumerate(shapes):
+        inputs = example_inputs(batch_size, num_frames, seed=i + 1)
+        with torch.no_grad(), no_transformer_fastpath():
+            expected = graph(*inputs)
+            expected = expected if isinstance(expected, tuple) else (expected,)
+            for fmt, run in runners.items():
+                outputs = run(inputs)
+                outputs = outputs if isinstance(outputs, (tuple, list)) else (outputs,)
+                max_diff = 0.
+                for name, out, ref in zip(graph.OUTPUT_NAMES, outputs, expected):
+                    out = np.asarray(out.cpu() if isinstance(out, torch.Tensor) else out)
+                    ref = ref.cpu().numpy()
+                    assert out.shape == ref.shape, f"{fmt} {name}: shape {out.shape} instead of {ref.shape}"
+                    np.testing.assert_allclose(out, ref, rtol=rtol, atol=atol, err_msg=f"{fmt} {name} at {(batch_size, num_frames)}")
+                    max_diff = max(max_diff, float(np.abs(out - ref).max()))
+                results.append(dict(format=fmt, batch_size=batch_size, num_frames=num_frames, max_abs_diff=max_diff))
+
+    return results
+
+
+if __name__ == '__main__':
+    import os
+    import argparse
+    import tempfile
+
+    from finetune.ISLR.Head import Head
+    from signbert.model.Backbone import Backbone
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--export', required=True, type=str, help='Backbone export, see export.py')
+    args = parser.parse_args()
+
+    # Untrained head, only the export mechanics are checked
+    encoder = Backbone.load(args.export)
+    graph = ISLRGraph(encoder, Head(encoder.config["d_model"], 10)).eval()
+    with tempfile.TemporaryDirectory() as dpath:
+        ts_fpath = os.path.join(dpath, 'islr.ts')
+        export_torchscript(graph, example_inputs(2, 32), ts_fpath)
+        for result in check_parity(graph, [(1, 17), (3, 64)], torchscript_fpath=ts_fpath):
+            print(result)
@@ -1,8 +1,10 @@
+from typing import TYPE_CHECKING
+
 import torch
 from torch import nn
 
-from manotorch.manolayer import ManoLayer
-from IPython import embed; from sys import exit
+if TYPE_CHECKING:
+    from manotorch.manolayer import MANOOutput
 
 
 class HandAwareModelDecoder(nn.Module):
@@ -32,6 +34,8 @@ class HandAwareModelDecoder(nn.Module):
                 HandAwareModelDecoder.GLOBAL_NPOSE_ELS
             )
         )
+        # manotorch is slow to import, it is only needed to build the MANO layers
+        from manotorch.manolayer import ManoLayer
         self.mano = ManoLayer(
             center_idx=None, # TODO; wrist?
             flat_hand_mean=False,
@@ -52,16 +56,11 @@ class HandAwareModelDecoder(nn.Module):
         offset += HandAwareModelDecoder.C_O_SIZE
         c_s = params[:, :, offset:offset + HandAwareModelDecoder.C_S_SIZE]
 
-        verts = []
-        joints = []
-        for seq_idx in range(x.shape[1]):
-            v, j, _ = self.mano(th_pose_coeffs=theta[:, seq_idx], th_betas=beta[:, seq_idx])
-            verts.append(v)
-            joints.append(j)
-        verts = torch.stack(verts, dim=1)
-        joints = torch.stack(joints, dim=1)
-        # TODO; handle the sequence length dimension
-        # verts, joints, center_joint = self.mano(th_pose_coeffs=theta, th_betas=beta)
+        # Fold the sequence dimension into the batch one so MANO is called
+        # once for the whole sequence instead of once per time step
+        mano_output: MANOOutput = self.mano(theta.reshape(N*L, -1), beta.reshape(N*L, -1))
+        verts = mano_output.verts.view(N, L, *mano_output.verts.shape[1:])
+        joints = mano_output.joints.view(N, L, *mano_output.joints.shape[1:])
 
         # Orthographic projection
         # sources: https://sites.ecse.rpi.edu/~qji/CV/perspective_geometry2.pdf
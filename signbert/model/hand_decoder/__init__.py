@@ -1 +1,9 @@
-from signbert.model.hand_decoder.HandAwareModelDecoder import HandAwareModelDecoder
\ No newline at end of file
+import importlib
+
+
+def __getattr__(name):
+    # Imported on first access, manotorch is only needed once the decoder is used
+    if name == "HandAwareModelDecoder":
+        module = importlib.import_module(f"{__name__}.HandAwareModelDecoder")
+        return module.HandAwareModelDecoder
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
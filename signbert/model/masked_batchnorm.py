@@ -5,7 +5,6 @@ import torch
 import torch.nn.functional as F
 from torch import Tensor
 from torch.nn.modules.batchnorm import _BatchNorm
-from IPython import embed
 
 def lengths_to_mask(lengths, max_len=None, dtype=None):
     """
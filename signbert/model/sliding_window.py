@@ -0,0 +1,102 @@
+import torch
+
+
+def window_weights(window_size, overlap, device=None, dtype=None):
+    """
+    Compute the stitching weights of a window.
+
+    Weights ramp up linearly over the first `overlap` frames and down over
+    the last ones, so frames close to a window border, which have less 
+    temporal context, contribute less to the stitched output.
+
+    Parameters:
+    window_size (int): The number of frames of a window.
+    overlap (int): The number of frames shared by consecutive windows.
+    device (torch.device, optional): The device of the weights.
+    dtype (torch.dtype, optional): The dtype of the weights.
+
+    Returns:
+    Tensor: (window_size,) strictly positive weights.
+    """
+    idxs = torch.arange(window_size, device=device, dtype=torch.float)
+    ramp = float(overlap + 1)
+    weights = torch.minimum((idxs + 1) / ramp, (window_size - idxs) / ramp)
+    weights = weights.clamp(max=1.)
+
+    return weights.to(dtype) if dtype is not None else weights
+
+def window_starts(seq_len, window_size, overlap):
+    """
+    Compute the first frame of each window covering a sequence.
+
+    Parameters:
+    seq_len (int): The number of frames of the sequence.
+    window_size (int): The number of frames of a window.
+    overlap (int): The number of frames shared by consecutive windows.
+
+    Returns:
+    list: The start frame of each window. The last window is aligned with the
+    end of the sequence.
+    """
+    assert 0 <= overlap < window_size
+    if seq_len <= window_size:
+        return [0]
+    stride = window_size - overlap
+    starts = list(range(0, seq_len - window_size + 1, stride))
+    if starts[-1] + window_size < seq_len:
+        starts.append(seq_len - window_size)
+
+    return starts
+
+def sliding_window_encode(encode, inputs, window_size=500, overlap=100, lengths=None):
+    """
+    Encode a long sequence with overlapping windows and stitch the results.
+
+    Each window is encoded independently, so memory is bounded by the window
+    size and time grows linearly with the sequence length. Per-frame outputs 
+    of overlapping windows are blended with `window_weights`.
+
+    Parameters:
+    encode (callable): Maps (N, t, ...) input tensors to one or a tuple of 
+    (N, t, ...) per-frame output tensors.
+    inputs (tuple): (N, T, ...) input tensors, sliced along the time dimension.
+    window_size (int): The number of frames of a window. Default is 500, the
+    length sequences are split into during preprocessing.
+    overlap (int): The number of frames shared by consecutive windows. Default is 100.
+    lengths (Tensor, optional): (N,) sequence lengths. If given, `encode` is
+    also passed the lengths within each window, at least 1 so windows past
+    the end of a sequence are not fully masked.
+
+    Returns:
+    Tensor or tuple: (N, T, ...) stitched outputs, same structure as `encode` outputs.
+    """
+    T = inputs[0].shape[1]
+    if T <= window_size:
+        return encode(*inputs) if lengths is None else encode(*inputs, lengths)
+    outputs = None
+    norm = None
+    for start in window_starts(T, window_size, overlap):
+        end = start + window_size
+        window_inputs = [x[:, start:end] for x in inputs]
+        if lengths is not None:
+            window_inputs.append((lengths - start).clamp(1, window_size))
+        window_outputs = encode(*window_inputs)
+        is_tensor = torch.is_tensor(window_outputs)
+        if is_tensor:
+            window_outputs = (window_outputs,)
+        # Allocate the stitched outputs once the output shapes are known
+        if outputs is None:
+            outputs = [o.new_zeros((o.shape[0], T) + o.shape[2:]) for o in window_outputs]
+            weights = window_weights(window_size, overlap, device=outputs[0].device, dtype=outputs[0].dtype)
+            norm = torch.zeros(T, device=weights.device, dtype=weights.dtype)
+        for acc, o in zip(outputs, window_outputs):
+            w = weights.view((1, -1) + (1,) * (o.dim() - 2))
+            acc[:, start:end] += o * w
+        norm[start:end] += weights
+    # Normalize by the accumulated weight of each frame
+    outputs = tuple(
+        o / norm.view((1, -1) + (1,) * (o.dim() - 2)) 
+        for o in outputs
+    )
+
+    return outputs[0] if is_tensor else outputs
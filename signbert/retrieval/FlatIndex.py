@@ -0,0 +1,136 @@
+import os
+
+import numpy as np
+
+from signbert.retrieval.utils import (
+    METRICS, normalize_rows, prepare_queries, merge_topk, write_meta, read_meta
+)
+
+
+class FlatIndex:
+    """
+    Exact nearest neighbours index: every stored vector is scored.
+
+    Vectors are stored in a `.npy` file that is memory-mapped, and scanned by
+    chunks so memory stays bounded whatever the corpus size. Each chunk is
+    scored against all the queries at once with a single matrix product.
+
+    Attributes:
+    dpath (str): The index directory.
+    metric (str): "ip" (inner product, higher is better) or "l2" (squared
+    euclidean distance, lower is better).
+    normalize (bool): Whether vectors and queries are L2-normalized, with
+    "ip" the scores are then cosine similarities.
+    vectors (numpy.ndarray): (N, D) stored vectors, memory-mapped.
+    sq_norms (numpy.ndarray): (N,) squared norms of the vectors, "l2" only.
+    """
+    VECTORS_FNAME = "vectors.npy"
+    SQ_NORMS_FNAME = "sq_norms.npy"
+
+    def __init__(self, dpath, mmap_mode="r"):
+        """
+        Load an index written by `FlatIndex.build`.
+
+        Parameters:
+        dpath (str): The index directory.
+        mmap_mode (str): How the arrays are memory-mapped, None to read them
+        in memory. Default is "r".
+        """
+        meta = read_meta(dpath)
+        assert meta["kind"] == "flat", f"{dpath} holds a {meta['kind']} index"
+        self.dpath = dpath
+        self.metric = meta["metric"]
+        self.normalize = meta["normalize"]
+        self.vectors = np.load(os.path.join(dpath, FlatIndex.VECTORS_FNAME), mmap_mode=mmap_mode)
+        self.sq_norms = None
+        if self.metric == "l2":
+            self.sq_norms = np.load(os.path.join(dpath, FlatIndex.SQ_NORMS_FNAME), mmap_mode=mmap_mode)
+
+    def __len__(self):
+        """Returns the number of stored vectors."""
+        return len(self.vectors)
+
+    @staticmethod
+    def build(vectors, dpath, metric="ip", normalize=True, dtype="float32", chunk_size=65536):
+        """
+        Write a flat index.
+
+        Parameters:
+        vectors (numpy.ndarray): (N, D) vectors, possibly memory-mapped, e.g.
+        the outputs of `extract.py --embed`. Their ids are their row indices.
+        dpath (str): The index directory.
+        metric (str): "ip" or "l2". Default is "ip".
+        normalize (bool): Whether to L2-normalize the vectors. Default is True.
+        dtype (str): The storage dtype, "float32" or "float16". Default is
+        "float32".
+        chunk_size (int): The number of rows processed at once. Default is 65536.
+
+        Returns:
+        FlatIndex: The index.
+        """
+        assert metric in METRICS, f"Unknown metric: {metric}"
+        os.makedirs(dpath, exist_ok=True)
+        out = np.lib.format.open_memmap(
+            os.path.join(dpath, FlatIndex.VECTORS_FNAME),
+            mode="w+",
+            dtype=dtype,
+            shape=vectors.shape
+        )
+        sq_norms = np.empty(len(vectors), dtype=np.float32)
+        for start in range(0, len(vectors), chunk_size):
+            chunk = np.asarray(vectors[start:start + chunk_size], dtype=np.float32)
+            if normalize:
+                chunk = normalize_rows(chunk)
+            out[start:start + len(chunk)] = chunk
+            # Norms of the stored values, after the storage dtype rounding
+            stored = np.asarray(out[start:start + len(chunk)], dtype=np.float32)
+            sq_norms[start:start + len(chunk)] = (stored ** 2).sum(1)
+        out.flush()
+        del out
+        if metric == "l2":
+            np.save(os.path.join(dpath, FlatIndex.SQ_NORMS_FNAME), sq_norms)
+        write_meta(dpath, dict(kind="flat", metric=metric, normalize=normalize, dim=int(vectors.shape[1]), size=len(vectors)))
+
+        return FlatIndex(dpath)
+
+    def search(self, queries, k=10, chunk_size=65536):
+        """
+        Find the exact k nearest neighbours of a batch of queries.
+
+        Parameters:
+        queries (numpy.ndarray): (Q, D) or (D,) queries.
+        k (int): The number of neighbours. Default is 10.
+        chunk_size (int): The number of stored vectors scored at once.
+        Default is 65536.
+
+        Returns:
+        tuple: (Q, k) scores, higher is better for "ip" and lower for "l2",
+        and (Q, k) int64 ids of the neighbours, best first.
+        """
+        queries = prepare_queries(queries, self.normalize)
+        largest = self.metric == "ip"
+        best_scores = np.empty((len(queries), 0), dtype=np.float32)
+        best_idxs = np.empty((len(queries), 0), dtype=np.int64)
+        for start in range(0, len(self), chunk_size):
+            chunk = np.asarray(self.vectors[start:start + chunk_size], dtype=np.float32)
+            scores = queries @ chunk.T
+            if self.metric == "l2":
+                # ||q||^2 - 2 q.x + ||x||^2
+                scores = (queries ** 2).sum(1, keepdims=True) - 2 * scores + self.sq_norms[start:start + len(chunk)]
+            idxs = np.broadcast_to(np.arange(start, start + len(chunk)), scores.shape)
+            best_scores, best_idxs = merge_topk(best_scores, best_idxs, scores, idxs, k, largest)
+
+        return best_scores, best_idxs
+
+
+if __name__ == '__main__':
+    import tempfile
+
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((10000, 64)).astype(np.float32)
+    with tempfile.TemporaryDirectory() as dpath:
+        index = FlatIndex.build(vectors, dpath, chunk_size=3000)
+        scores, idxs = index.search(vectors[:5], k=3, chunk_size=3000)
+        # A stored vector is its own nearest neighbour
+        assert (idxs[:, 0] == np.arange(5)).all()
+        print(scores, idxs)
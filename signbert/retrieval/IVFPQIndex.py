@@ -0,0 +1,276 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from signbert.retrieval.utils import (
+    METRICS, normalize_rows, prepare_queries, topk, squared_distances, assign,
+    kmeans, sample_rows, write_meta, read_meta
+)
+
+
+# Centroids per sub-quantizer, so codes fit in a byte
+PQ_CENTROIDS = 256
+
+
+def pq_encode(x, codebooks):
+    """
+    Encode vectors with product quantization.
+
+    Parameters:
+    x (numpy.ndarray): (N, D) vectors.
+    codebooks (numpy.ndarray): (M, 256, D / M) sub-quantizer centroids.
+
+    Returns:
+    numpy.ndarray: (N, M) uint8 codes.
+    """
+    m, _, dsub = codebooks.shape
+    codes = np.empty((len(x), m), dtype=np.uint8)
+    for i in range(m):
+        codes[:, i] = squared_distances(x[:, i * dsub:(i + 1) * dsub], codebooks[i]).argmin(1)
+
+    return codes
+
+
+class IVFPQIndex:
+    """
+    Approximate nearest neighbours index: inverted file with product
+    quantization.
+
+    Vectors are assigned to their nearest coarse centroid (inverted lists)
+    and their residual to that centroid is stored as M bytes, one
+    sub-quantizer code per D / M dimensions. Codes are sorted by list, so a
+    list is a contiguous slice of the memory-mapped codes. A query only
+    scans the `nprobe` lists whose centroids are the closest, and scores
+    codes with per-query lookup tables (asymmetric distance computation).
+
+    Attributes:
+    dpath (str): The index directory.
+    metric (str): "ip" (inner product, higher is better) or "l2" (squared
+    euclidean distance, lower is better).
+    normalize (bool): Whether vectors and queries are L2-normalized.
+    coarse (numpy.ndarray): (nlist, D) coarse centroids.
+    codebooks (numpy.ndarray): (M, 256, D / M) sub-quantizer centroids.
+    offsets (numpy.ndarray): (nlist + 1,) start of each list in `codes`.
+    codes (numpy.ndarray): (N, M) uint8 codes sorted by list, memory-mapped.
+    ids (numpy.ndarray): (N,) int64 ids of the codes, memory-mapped.
+    """
+    COARSE_FNAME = "coarse.npy"
+    CODEBOOKS_FNAME = "codebooks.npy"
+    OFFSETS_FNAME = "offsets.npy"
+    CODES_FNAME = "codes.npy"
+    IDS_FNAME = "ids.npy"
+
+    def __init__(self, dpath, mmap_mode="r"):
+        """
+        Load an index written by `IVFPQIndex.build`.
+
+        Parameters:
+        dpath (str): The index directory.
+        mmap_mode (str): How codes and ids are memory-mapped, None to read
+        them in memory. Default is "r".
+        """
+        meta = read_meta(dpath)
+        assert meta["kind"] == "ivfpq", f"{dpath} holds a {meta['kind']} index"
+        self.dpath = dpath
+        self.metric = meta["metric"]
+        self.normalize = meta["normalize"]
+        # Centroids are small and read on every query, they stay in memory
+        self.coarse = np.load(os.path.join(dpath, IVFPQIndex.COARSE_FNAME))
+        self.codebooks = np.load(os.path.join(dpath, IVFPQIndex.CODEBOOKS_FNAME))
+        self.offsets = np.load(os.path.join(dpath, IVFPQIndex.OFFSETS_FNAME))
+        self.codes = np.load(os.path.join(dpath, IVFPQIndex.CODES_FNAME), mmap_mode=mmap_mode)
+        self.ids = np.load(os.path.join(dpath, IVFPQIndex.IDS_FNAME), mmap_mode=mmap_mode)
+        self._coarse_sq_norms = (self.coarse ** 2).sum(1)
+        self._codebooks_sq_norms = (self.codebooks ** 2).sum(-1)
+
+    def __len__(self):
+        """Returns the number of stored vectors."""
+        return len(self.ids)
+
+    @staticmethod
+    def build(
+            vectors,
+            dpath,
+            nlist=1024,
+            m=32,
+            metric="ip",
+            normalize=True,
+            train_size=100000,
+            niter=20,
+            chunk_size=65536,
+            seed=0
+        ):
+        """
+        Train and write an IVF-PQ index.
+
+        Parameters:
+        vectors (numpy.ndarray): (N, D) vectors, possibly memory-mapped, e.g.
+        the outputs of `extract.py --embed`. Their ids are their row indices.
+        dpath (str): The index directory.
+        nlist (int): The number of inverted lists. Default is 1024.
+        m (int): The number of sub-quantizers, i.e. bytes per vector, it must
+        divide D. Default is 32.
+        metric (str): "ip" or "l2". Default is "ip".
+        normalize (bool): Whether to L2-normalize the vectors. Default is True.
+        train_size (int): The number of vectors centroids are trained on.
+        Default is 100000.
+        niter (int): The number of k-means iterations. Default is 20.
+        chunk_size (int): The number of rows encoded at once. Default is 65536.
+        seed (int): The random seed. Default is 0.
+
+        Returns:
+        IVFPQIndex: The index.
+        """
+        assert metric in METRICS, f"Unknown metric: {metric}"
+        num_vectors, dim = vectors.shape
+        assert dim % m == 0, f"{m} sub-quantizers do not divide {dim} dimensions"
+        dsub = dim // m
+        os.makedirs(dpath, exist_ok=True)
+        # Train the coarse quantizer, then the sub-quantizers on residuals
+        train = sample_rows(vectors, train_size, seed)
+        if normalize:
+            train = normalize_rows(train)
+        assert len(train) >= max(nlist, PQ_CENTROIDS), f"{len(train)} training vectors for {nlist} lists"
+        coarse = kmeans(train, nlist, niter, seed)
+        residuals = train - coarse[assign(train, coarse)]
+        codebooks = np.stack([
+            kmeans(residuals[:, i * dsub:(i + 1) * dsub], PQ_CENTROIDS, niter, seed + 1 + i)
+            for i in range(m)
+        ])
+        # Encode every vector, in input order
+        labels = np.empty(num_vectors, dtype=np.int64)
+        unsorted_fpath = os.path.join(dpath, "codes.unsorted.npy")
+        unsorted = np.lib.format.open_memmap(unsorted_fpath, mode="w+", dtype=np.uint8, shape=(num_vectors, m))
+        for start in range(0, num_vectors, chunk_size):
+            x = np.asarray(vectors[start:start + chunk_size], dtype=np.float32)
+            if normalize:
+                x = normalize_rows(x)
+            chunk_labels = assign(x, coarse)
+            labels[start:start + len(x)] = chunk_labels
+            unsorted[start:start + len(x)] = pq_encode(x - coarse[chunk_labels], codebooks)
+        # Sort the codes by list, so each list is contiguous
+        order = np.argsort(labels, kind="stable")
+        offsets = np.concatenate(([0], np.cumsum(np.bincount(labels, minlength=nlist)))).astype(np.int64)
+        codes = np.lib.format.open_memmap(
+            os.path.join(dpath, IVFPQIndex.CODES_FNAME),
+            mode="w+",
+            dtype=np.uint8,
+            shape=(num_vectors, m)
+        )
+        for start in range(0, num_vectors, chunk_size):
+            codes[start:start + chunk_size] = unsorted[order[start:start + chunk_size]]
+        codes.flush()
+        del codes, unsorted
+        os.remove(unsorted_fpath)
+        np.save(os.path.join(dpath, IVFPQIndex.IDS_FNAME), order)
+        np.save(os.path.join(dpath, IVFPQIndex.OFFSETS_FNAME), offsets)
+        np.save(os.path.join(dpath, IVFPQIndex.COARSE_FNAME), coarse)
+        np.save(os.path.join(dpath, IVFPQIndex.CODEBOOKS_FNAME), codebooks)
+        write_meta(dpath, dict(kind="ivfpq", metric=metric, normalize=normalize, dim=dim, size=num_vectors, nlist=nlist, m=m))
+
+        return IVFPQIndex(dpath)
+
+    def _search_one(self, query, k, nprobe):
+        """
+        Search the k nearest neighbours of a single query.
+
+        Parameters:
+        query (numpy.ndarray): (D,) prepared query.
+        k (int): The number of neighbours.
+        nprobe (int): The number of lists scanned.
+
+        Returns:
+        tuple: (k,) scores and ids, padded with -1 ids if fewer candidates.
+        """
+        m, _, dsub = self.codebooks.shape
+        largest = self.metric == "ip"
+        # Closest lists
+        if largest:
+            coarse_scores = self.coarse @ query
+        else:
+            coarse_scores = squared_distances(query[None], self.coarse, self._coarse_sq_norms)[0]
+        probe = topk(coarse_scores[None], nprobe, largest)[1][0]
+        query_subs = query.reshape(m, 1, dsub)
+        if largest:
+            # q.(c + r) = q.c + sum_m q_m.r_m, the table does not depend on the list
+            lut = (self.codebooks * query_subs).sum(-1)
+        sub_idxs = np.arange(m)
+        scores = []
+        ids = []
+        for lst in probe:
+            start, stop = self.offsets[lst], self.offsets[lst + 1]
+            if start == stop:
+                continue
+            codes = self.codes[start:stop]
+            if largest:
+                base = coarse_scores[lst]
+                list_lut = lut
+            else:
+                # ||(q - c) - r||^2, summed over sub-vectors
+                base = 0.
+                residual_subs = (query - self.coarse[lst]).reshape(m, 1, dsub)
+                list_lut = (
+                    (residual_subs ** 2).sum(-1)
+                    - 2 * (self.codebooks * residual_subs).sum(-1)
+                    + self._codebooks_sq_norms
+                )
+            scores.append(list_lut[sub_idxs, codes].sum(1) + base)
+            ids.append(self.ids[start:stop])
+        pad_score = -np.inf if largest else np.inf
+        if not scores:
+            return np.full(k, pad_score, dtype=np.float32), np.full(k, -1, dtype=np.int64)
+        scores = np.concatenate(scores)[None]
+        ids = np.concatenate(ids)
+        best_scores, cols = topk(scores, k, largest)
+        best_scores, best_ids = best_scores[0], ids[cols[0]]
+        if len(best_ids) < k:
+            best_scores = np.concatenate((best_scores, np.full(k - len(best_ids), pad_score)))
+            best_ids = np.concatenate((best_ids, np.full(k - len(best_ids), -1)))
+
+        return best_scores.astype(np.float32), best_ids.astype(np.int64)
+
+    def search(self, queries, k=10, nprobe=16, num_threads=1):
+        """
+        Find the approximate k nearest neighbours of a batch of queries.
+
+        Parameters:
+        queries (numpy.ndarray): (Q, D) or (D,) queries.
+        k (int): The number of neighbours. Default is 10.
+        nprobe (int): The number of lists scanned per query, the higher the
+        more accurate and the slower. Default is 16.
+        num_threads (int): The number of queries searched concurrently.
+        Default is 1.
+
+        Returns:
+        tuple: (Q, k) scores, higher is better for "ip" and lower for "l2",
+        and (Q, k) int64 ids of the neighbours, best first. Missing neighbours
+        have -1 ids.
+        """
+        queries = prepare_queries(queries, self.normalize)
+        nprobe = min(nprobe, len(self.coarse))
+        if num_threads > 1:
+            with ThreadPoolExecutor(max_workers=num_threads) as executor:
+                results = list(executor.map(lambda q: self._search_one(q, k, nprobe), queries))
+        else:
+            results = [self._search_one(q, k, nprobe) for q in queries]
+
+        return np.stack([r[0] for r in results]), np.stack([r[1] for r in results])
+
+
+if __name__ == '__main__':
+    import tempfile
+
+    from signbert.retrieval.FlatIndex import FlatIndex
+
+    rng = np.random.default_rng(0)
+    # Clustered vectors, like embeddings of a few classes
+    centers = rng.standard_normal((50, 64)).astype(np.float32)
+    vectors = centers[rng.integers(0, 50, 20000)] + 0.3 * rng.standard_normal((20000, 64)).astype(np.float32)
+    with tempfile.TemporaryDirectory() as dpath:
+        flat = FlatIndex.build(vectors, os.path.join(dpath, 'flat'))
+        ivfpq = IVFPQIndex.build(vectors, os.path.join(dpath, 'ivfpq'), nlist=64, m=16, train_size=10000, niter=10)
+        _, expected = flat.search(vectors[:100], k=10)
+        _, found = ivfpq.search(vectors[:100], k=10, nprobe=8)
+        recall = np.mean([len(set(e) & set(f)) / 10 for e, f in zip(expected, found)])
+        print(f'recall@10 {recall:.3f}')
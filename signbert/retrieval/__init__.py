@@ -0,0 +1,11 @@
+import importlib
+
+
+# Modules are imported on first access, like the other subpackages
+_SUBMODULES = ("FlatIndex", "IVFPQIndex", "utils")
+
+
+def __getattr__(name):
+    if name in _SUBMODULES:
+        return importlib.import_module(f"{__name__}.{name}")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,175 @@
+import os
+import json
+
+import numpy as np
+
+
+META_FNAME = "meta.json"
+METRICS = ("ip", "l2")
+
+
+def normalize_rows(x, eps=1e-12):
+    """L2-normalize the rows of a (N, D) array, as float32."""
+    x = np.asarray(x, dtype=np.float32)
+
+    return x / np.maximum(np.linalg.norm(x, axis=1, keepdims=True), eps)
+
+def prepare_queries(queries, normalize):
+    """Make queries a (Q, D) float32 array, normalized like the index vectors."""
+    queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+
+    return normalize_rows(queries) if normalize else queries
+
+def topk(scores, k, largest=True):
+    """
+    Find the k best scores of each row.
+
+    Parameters:
+    scores (numpy.ndarray): (Q, N) scores.
+    k (int): The number of results per row, at most N.
+    largest (bool): Whether higher scores are better. Default is True.
+
+    Returns:
+    tuple: (Q, k) best scores and their column indices, best first.
+    """
+    k = min(k, scores.shape[1])
+    keys = -scores if largest else scores
+    # Partial selection, only the k selected are sorted
+    idxs = np.argpartition(keys, k - 1, axis=1)[:, :k]
+    order = np.argsort(np.take_along_axis(keys, idxs, axis=1), axis=1, kind="stable")
+    idxs = np.take_along_axis(idxs, order, axis=1)
+
+    return np.take_along_axis(scores, idxs, axis=1), idxs
+
+def merge_topk(best_scores, best_idxs, scores, idxs, k, largest=True):
+    """
+    Merge running top-k results with new candidates.
+
+    Parameters:
+    best_scores (numpy.ndarray): (Q, k') running best scores, may be empty.
+    best_idxs (numpy.ndarray): (Q, k') their ids.
+    scores (numpy.ndarray): (Q, n) candidate scores.
+    idxs (numpy.ndarray): (Q, n) candidate ids.
+    k (int): The number of results to keep.
+    largest (bool): Whether higher scores are better. Default is True.
+
+    Returns:
+    tuple: (Q, k) best scores and ids, best first.
+    """
+    scores = np.concatenate((best_scores, scores), axis=1)
+    idxs = np.concatenate((best_idxs, idxs), axis=1)
+    scores, cols = topk(scores, k, largest)
+
+    return scores, np.take_along_axis(idxs, cols, axis=1)
+
+def squared_distances(x, centroids, centroids_sq_norms=None):
+    """
+    Squared L2 distances between rows and centroids.
+
+    Parameters:
+    x (numpy.ndarray): (N, D) rows.
+    centroids (numpy.ndarray): (K, D) centroids.
+    centroids_sq_norms (numpy.ndarray, optional): (K,) squared norms of the
+    centroids, computed if not given.
+
+    Returns:
+    numpy.ndarray: (N, K) squared distances.
+    """
+    if centroids_sq_norms is None:
+        centroids_sq_norms = (centroids ** 2).sum(1)
+    # ||x||^2 - 2 x.c + ||c||^2, a single matrix product
+    d = (x ** 2).sum(1, keepdims=True) - 2 * x @ centroids.T + centroids_sq_norms
+
+    return np.maximum(d, 0.)
+
+def assign(x, centroids, chunk_size=65536):
+    """
+    Assign rows to their nearest centroid, by chunks.
+
+    Parameters:
+    x (numpy.ndarray): (N, D) rows, possibly memory-mapped.
+    centroids (numpy.ndarray): (K, D) centroids.
+    chunk_size (int): The number of rows processed at once. Default is 65536.
+
+    Returns:
+    numpy.ndarray: (N,) int64 centroid indices.
+    """
+    sq_norms = (centroids ** 2).sum(1)
+    labels = np.empty(len(x), dtype=np.int64)
+    for start in range(0, len(x), chunk_size):
+        chunk = np.asarray(x[start:start + chunk_size], dtype=np.float32)
+        labels[start:start + len(chunk)] = squared_distances(chunk, centroids, sq_norms).argmin(1)
+
+    return labels
+
+def kmeans(x, k, niter=20, seed=0):
+    """
+    Lloyd's k-means.
+
+    Parameters:
+    x (numpy.ndarray): (N, D) training rows, N >= k.
+    k (int): The number of centroids.
+    niter (int): The number of iterations. Default is 20.
+    seed (int): The random seed. Default is 0.
+
+    Returns:
+    numpy.ndarray: (k, D) float32 centroids.
+    """
+    x = np.asarray(x, dtype=np.float32)
+    assert len(x) >= k, f"{len(x)} training rows for {k} centroids"
+    rng = np.random.default_rng(seed)
+    centroids = x[rng.choice(len(x), k, replace=False)].copy()
+    for _ in range(niter):
+        labels = assign(x, centroids)
+        counts = np.bincount(labels, minlength=k)
+        nonempty = counts > 0
+        # Rows sorted by cluster, each cluster is summed as a contiguous slice
+        order = np.argsort(labels, kind="stable")
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[nonempty]
+        sums = np.add.reduceat(x[order], starts, axis=0)
+        centroids[nonempty] = sums / counts[nonempty, None]
+        # Empty clusters are re-seeded on random rows
+        num_empty = int((~nonempty).sum())
+        if num_empty:
+            centroids[~nonempty] = x[rng.choice(len(x), num_empty, replace=False)]
+
+    return centroids
+
+def sample_rows(vectors, size, seed=0):
+    """Read a random sample of rows, sorted so memory-mapped reads are sequential."""
+    rng = np.random.default_rng(seed)
+    if size >= len(vectors):
+        return np.asarray(vectors, dtype=np.float32)
+    idxs = np.sort(rng.choice(len(vectors), size, replace=False))
+
+    return np.asarray(vectors[idxs], dtype=np.float32)
+
+def write_meta(dpath, meta):
+    """Write the index metadata, last, so it marks a complete index."""
+    with open(os.path.join(dpath, META_FNAME), "w") as fid:
+        json.dump(meta, fid)
+
+def read_meta(dpath):
+    """Read the index metadata."""
+    with open(os.path.join(dpath, META_FNAME), "r") as fid:
+        return json.load(fid)
+
+def load_index(dpath, mmap_mode="r"):
+    """
+    Load a flat or IVF-PQ index, whichever is stored in a directory.
+
+    Parameters:
+    dpath (str): The index directory.
+    mmap_mode (str): How the arrays are memory-mapped, None to read them in
+    memory. Default is "r".
+
+    Returns:
+    FlatIndex or IVFPQIndex: The index.
+    """
+    kind = read_meta(dpath)["kind"]
+    if kind == "flat":
+        from signbert.retrieval.FlatIndex import FlatIndex
+        return FlatIndex(dpath, mmap_mode)
+    from signbert.retrieval.IVFPQIndex import IVFPQIndex
+
+    return IVFPQIndex(dpath, mmap_mode)
@@ -1,6 +1,13 @@
+import os
 import json
 import gc
+import math
+from concurrent.futures import ThreadPoolExecutor
+
 import torch
+import torch.nn.functional as F
+from torch.utils.checkpoint import checkpoint
+from torch.nn.modules.batchnorm import _BatchNorm
 
 def my_import(name):
     """
@@ -40,6 +47,236 @@ def dict_to_json_file(dict, fpath):
         json.dump(dict, fid)
 
 
+def bucket_length(length, buckets):
+    """
+    Find the bucket a sequence length falls into.
+
+    Parameters:
+    length (int): The sequence length.
+    buckets (list): Allowed sequence lengths.
+
+    Returns:
+    int: The smallest bucket that fits the length. Lengths over the largest 
+    bucket are rounded up to a multiple of it.
+    """
+    for b in sorted(buckets):
+        if length <= b:
+            return b
+    largest = max(buckets)
+    return int(math.ceil(length / largest) * largest)
+
+def pad_to_bucket(x, buckets, dim=1, value=0.0):
+    """
+    Pad a tensor dimension up to its bucket length.
+
+    Keeping the number of distinct shapes small lets `torch.compile` reuse 
+    graphs instead of recompiling for every new sequence length.
+
+    Parameters:
+    x (Tensor): The tensor to be padded.
+    buckets (list): Allowed sequence lengths.
+    dim (int): The dimension to pad. Default is 1.
+    value (float): The padding value. Default is 0.0.
+
+    Returns:
+    Tensor: The padded tensor.
+    """
+    length = x.shape[dim]
+    target = bucket_length(length, buckets)
+    if target == length:
+        return x
+    # F.pad expects the padding of the last dimension first
+    pad = [0, 0] * (x.dim() - dim - 1) + [0, target - length]
+    return F.pad(x, pad, value=value)
+
+def masked_frames_to_mask(masked_frames_idx, seq_len):
+    """
+    Convert padded masked frames indices into a dense boolean mask.
+
+    Parameters:
+    masked_frames_idx (Tensor): (N, M) indices of the masked frames, padded 
+    with -1.
+    seq_len (int): The number of frames T of the sequences.
+
+    Returns:
+    Tensor: (N, T) boolean mask, True on the masked frames.
+    """
+    N = masked_frames_idx.shape[0]
+    # Route the padding to an extra column that is dropped afterwards
+    idxs = torch.where(masked_frames_idx < 0, seq_len, masked_frames_idx)
+    mask = torch.zeros(N, seq_len + 1, dtype=torch.bool, device=idxs.device)
+    mask.scatter_(1, idxs, True)
+
+    return mask[:, :seq_len]
+
+def lengths_to_padding_mask(lengths, seq_len):
+    """
+    Convert sequence lengths into a padding mask.
+
+    Parameters:
+    lengths (Tensor): (N,) number of frames of each sequence.
+    seq_len (int): The padded number of frames T.
+
+    Returns:
+    Tensor: (N, T) boolean mask, True on the padding frames, as expected by
+    the `src_key_padding_mask` of transformer encoders.
+    """
+    positions = torch.arange(seq_len, device=lengths.device)
+
+    return positions.unsqueeze(0) >= lengths.unsqueeze(1)
+
+
+def disable_autocast(device):
+    """
+    Context manager disabling autocast on the given device.
+
+    Ops inside the context run in the dtype of their inputs, so inputs coming
+    from an autocast region must be cast to float32 explicitly.
+
+    Parameters:
+    device (torch.device): The device autocast is disabled on.
+
+    Returns:
+    torch.autocast: The context manager.
+    """
+    return torch.autocast(device_type=device.type, enabled=False)
+
+
+def maybe_checkpoint(enabled, function, *args):
+    """
+    Call a function, with activation checkpointing if enabled.
+
+    Checkpointed functions do not keep their intermediate activations, they 
+    are recomputed during the backward pass. Trades compute for memory. The
+    running statistics of the batch normalization layers of a checkpointed 
+    module are restored after the recomputation, so they are only updated 
+    once per step, as without checkpointing.
+
+    Parameters:
+    enabled (bool): Whether to apply activation checkpointing.
+    function (callable): The function (or module) to call.
+    *args: Positional arguments of the function.
+
+    Returns:
+    The function output.
+    """
+    if not enabled or not torch.is_grad_enabled():
+        return function(*args)
+    batch_norms = []
+    if isinstance(function, torch.nn.Module):
+        batch_norms = [
+            m for m in function.modules()
+            if isinstance(m, _BatchNorm) and m.training and m.track_running_stats
+        ]
+    if not batch_norms:
+        return checkpoint(function, *args, use_reentrant=False)
+    n_calls = 0
+
+    def run(*args):
+        nonlocal n_calls
+        n_calls += 1
+        if n_calls == 1:
+            return function(*args)
+        # Recomputation during the backward pass, the forward pass already 
+        # updated the running statistics
+        stats = [
+            (m.running_mean.clone(), m.running_var.clone(), m.num_batches_tracked.clone())
+            for m in batch_norms
+        ]
+        try:
+            return function(*args)
+        finally:
+            with torch.no_grad():
+                for m, (mean, var, num_batches) in zip(batch_norms, stats):
+                    m.running_mean.copy_(mean)
+                    m.running_var.copy_(var)
+                    m.num_batches_tracked.copy_(num_batches)
+
+    return checkpoint(run, *args, use_reentrant=False)
+
+
+# Worker thread running forked branches, created on first use
+_fork_executor = None
+
+def fork(function, *args):
+    """
+    Run a function in a background thread.
+
+    PyTorch kernels release the GIL, so the forked function runs concurrently 
+    with the work done by the caller until the result is requested. Unlike
+    `torch.jit.fork`, which is synchronous outside TorchScript, this also 
+    overlaps work in eager mode. The grad mode of the caller is propagated, 
+    autocast is not.
+
+    Parameters:
+    function (callable): The function (or module) to call.
+    *args: Positional arguments of the function.
+
+    Returns:
+    Future: Call `.result()` to wait for and get the function output.
+    """
+    global _fork_executor
+    if _fork_executor is None:
+        _fork_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="fork")
+    grad_enabled = torch.is_grad_enabled()
+
+    def run():
+        # Grad mode is thread local
+        with torch.set_grad_enabled(grad_enabled):
+            return function(*args)
+
+    return _fork_executor.submit(run)
+
+
+def set_num_threads_per_process(num_processes):
+    """
+    Partition the host cores between the processes running on it.
+
+    Without it, each data-parallel process would use as many threads as cores
+    and they would compete for them.
+
+    Parameters:
+    num_processes (int): The number of processes running on the host.
+
+    Returns:
+    int: The number of threads of the current process.
+    """
+    num_threads = max(1, (os.cpu_count() or 1) // num_processes)
+    torch.set_num_threads(num_threads)
+
+    return num_threads
+
+
+def get_trainer_config(accelerator, devices, num_processes=1, num_nodes=1):
+    """
+    Get the Trainer hardware arguments.
+
+    On CPU, `num_processes` > 1 or `num_nodes` > 1 runs multi-process data 
+    parallel training over gloo, with the cores of each host partitioned
+    between its processes. Hosts rendezvous through the MASTER_ADDR, 
+    MASTER_PORT and NODE_RANK environment variables, set on every host.
+
+    Parameters:
+    accelerator (str): "gpu" or "cpu".
+    devices (list): GPU indices, ignored on CPU.
+    num_processes (int): The number of processes per host on CPU. Default is 1.
+    num_nodes (int): The number of hosts. Default is 1.
+
+    Returns:
+    dict: The `accelerator`, `strategy`, `devices` and `num_nodes` arguments.
+    """
+    if accelerator != "cpu":
+        return dict(accelerator=accelerator, strategy="auto", devices=devices, num_nodes=num_nodes)
+    from lightning.pytorch.strategies import DDPStrategy
+    set_num_threads_per_process(num_processes)
+    if num_processes * num_nodes > 1:
+        strategy = DDPStrategy(process_group_backend="gloo")
+    else:
+        strategy = "auto"
+
+    return dict(accelerator="cpu", strategy=strategy, devices=num_processes, num_nodes=num_nodes)
+
+
 def _num_active_cuda_tensors():
     """
     Returns all tensors initialized on cuda devices
@@ -0,0 +1,106 @@
+# python stream.py --ckpt finetune_logs/test/version_0/ckpts/last.ckpt --base-ckpt logs/pretrain/version_0/backbone.pt --config finetune/configs/ISLR_MSASL.yml --inputs path/to/skeleton.npy --window-size 64 --hop 8 --fps 30
+import time
+import argparse
+
+import yaml
+import torch
+import numpy as np
+
+from finetune.ISLR.InferenceModel import InferenceModel
+from finetune.ISLR.StreamingRecognizer import StreamingRecognizer
+
+
+def replay(recognizer, skeleton, fps=None):
+    """
+    Push the frames of a skeleton file to a recognizer, as a live stream.
+
+    Parameters:
+    recognizer (StreamingRecognizer): The recognizer, reset beforehand.
+    skeleton (numpy.ndarray): (T, 133, C) rtmpose whole-body keypoints.
+    fps (float, optional): The stream frame rate, frames are pushed as fast
+    as possible if None.
+
+    Returns:
+    tuple: (T,) per-frame latencies in milliseconds, the (T,) mask of the
+    frames a prediction was emitted on and the predicted class of each
+    prediction.
+    """
+    latencies = []
+    emitted = []
+    predictions = []
+    stream_start = time.perf_counter()
+    for i, frame in enumerate(skeleton):
+        if fps is not None:
+            # Wait for the frame to be captured
+            time.sleep(max(0., stream_start + i / fps - time.perf_counter()))
+        start = time.perf_counter()
+        logits = recognizer.push(frame)
+        if logits is not None:
+            # The prediction is only available once it is on the host
+            predictions.append(int(logits.argmax().cpu()))
+        if recognizer.device.type == "cuda":
+            torch.cuda.synchronize()
+        latencies.append((time.perf_counter() - start) * 1e3)
+        emitted.append(logits is not None)
+
+    return np.array(latencies), np.array(emitted), predictions
+
+def format_percentiles(latencies):
+    """Format the p50, p90, p99 and max of latencies in milliseconds."""
+    if len(latencies) == 0:
+        return "n/a"
+    p50, p90, p99 = np.percentile(latencies, (50, 90, 99))
+
+    return f"p50 {p50:.2f} ms, p90 {p90:.2f} ms, p99 {p99:.2f} ms, max {latencies.max():.2f} ms"
+
+def main(args):
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+    with open(args.config, "r") as fid:
+        head_args = yaml.load(fid, yaml.SafeLoader)["head_args"]
+    model = InferenceModel.load(
+        "finetuned",
+        args.ckpt,
+        base_ckpt=args.base_ckpt,
+        head_args=head_args,
+        normalize=not args.no_normalize,
+        map_location=args.device
+    )
+    recognizer = StreamingRecognizer(
+        model,
+        window_size=args.window_size,
+        hop=args.hop,
+        context=args.context if args.context is not None else "auto"
+    )
+    print(f"Extractors context: {recognizer.context} frames")
+    for fpath in args.inputs:
+        skeleton = np.load(fpath)
+        # Warm-up pass, not timed
+        recognizer.reset()
+        replay(recognizer, skeleton[:args.window_size])
+        recognizer.reset()
+        latencies, emitted, predictions = replay(recognizer, skeleton, args.fps)
+        print(f"{fpath}: {len(skeleton)} frames, {emitted.sum()} predictions, last {predictions[-1] if predictions else None}")
+        print(f"  all frames:        {format_percentiles(latencies)}")
+        print(f"  prediction frames: {format_percentiles(latencies[emitted])}")
+        print(f"  other frames:      {format_percentiles(latencies[~emitted])}")
+        if args.fps is not None:
+            late = (latencies > 1e3 / args.fps).mean()
+            print(f"  {100 * late:.1f}% of frames took longer than the frame period")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ckpt", required=True, type=str)
+    parser.add_argument("--base-ckpt", required=True, type=str, help="Pre-trained model the finetuning started from")
+    parser.add_argument("--config", required=True, type=str, help="Finetuning config, for the head arguments")
+    parser.add_argument("--inputs", required=True, nargs="+", type=str, help="Skeleton .npy files replayed as streams")
+    parser.add_argument("--window-size", default=64, type=int)
+    parser.add_argument("--hop", default=8, type=int)
+    parser.add_argument("--context", default=None, type=int, help="Extractors receptive field radius, measured if not given")
+    parser.add_argument("--fps", default=None, type=float, help="Replay frame rate, as fast as possible if not given")
+    parser.add_argument("--device", default="cpu", type=str)
+    parser.add_argument("--threads", default=None, type=int)
+    parser.add_argument("--no-normalize", action="store_true")
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,183 @@
+# python sweep.py --config configs/HANDS17.yml --sweep configs/sweep.yml --epochs 20 --num-parallel 4
+import os
+import csv
+import copy
+import time
+import argparse
+import itertools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import yaml
+
+
+MASKING_ARGS = ("R", "m", "K", "max_disturbance")
+
+
+def grid_trials(grid):
+    """
+    Expand a grid of masking hyperparameters into trials.
+
+    Parameters:
+    grid (dict): Lists of values, keyed by masking hyperparameter.
+
+    Returns:
+    list: One dict of masking hyperparameters per combination.
+    """
+    for k in grid:
+        assert k in MASKING_ARGS, f"Unknown masking hyperparameter: {k}"
+    keys = list(grid.keys())
+
+    return [dict(zip(keys, values)) for values in itertools.product(*(grid[k] for k in keys))]
+
+def apply_masking_args(cfg, masking_args):
+    """
+    Get a copy of a training config with the given masking hyperparameters.
+
+    Parameters:
+    cfg (dict): The training config.
+    masking_args (dict): The masking hyperparameters, set in the
+    `dataset_args` of every pre-training dataset, or of HANDS17.
+
+    Returns:
+    dict: The trial training config.
+    """
+    cfg = copy.deepcopy(cfg)
+    if cfg.get("pretrain", False):
+        for v in cfg["datasets"].values():
+            v.setdefault("dataset_args", {}).update(masking_args)
+    else:
+        cfg.setdefault("dataset_args", {}).update(masking_args)
+
+    return cfg
+
+def _init_worker(num_parallel):
+    """
+    Trial process initializer, it runs once per process.
+
+    The heavy imports happen here and the process lives for the whole sweep,
+    so trials run in a warm process. The host cores are split between the
+    concurrent trials.
+    """
+    from signbert.utils import set_num_threads_per_process
+    from signbert.data_modules.MaskKeypointDataset import MaskKeypointDataset
+    from signbert.data_modules.PretrainMaskKeypointDataset import PretrainMaskKeypointDataset
+    import train # noqa: F401, imports the models and data modules
+
+    set_num_threads_per_process(num_parallel)
+    # Arrays are memory-mapped once per process and reused by every trial
+    MaskKeypointDataset.MMAP_MODE = "r"
+    PretrainMaskKeypointDataset.MMAP_MODE = "r"
+
+def run_trial(trial_idx, cfg, epochs, accelerator, device, logs_dpath):
+    """
+    Train a model on a trial config and report its validation PCK@20.
+
+    Parameters:
+    trial_idx (int): The trial index, used to name its logs.
+    cfg (dict): The trial training config.
+    epochs (int): The number of training epochs.
+    accelerator (str): "cpu" or "gpu".
+    device (int): The GPU index, ignored on CPU.
+    logs_dpath (str): The sweep logs directory.
+
+    Returns:
+    dict: The val PCK@20 at the end of training and the wall time in seconds.
+    """
+    from lightning.pytorch import Trainer
+    from lightning.pytorch import loggers as pl_loggers
+
+    from train import build_datamodule, build_model
+
+    start = time.perf_counter()
+    pretrain = cfg.get("pretrain", False)
+    datamodule = build_datamodule(cfg)
+    model = build_model(cfg, cfg["lr"])
+    tb_logger = pl_loggers.TensorBoardLogger(save_dir=logs_dpath, name=f"trial_{trial_idx}")
+    trainer = Trainer(
+        accelerator=accelerator,
+        devices=[device] if accelerator == "gpu" else 1,
+        max_epochs=epochs,
+        accumulate_grad_batches=1 if pretrain else cfg.get('accumulate_grad_batches', 1),
+        gradient_clip_val=None if pretrain else cfg.get('gradient_clip_val'),
+        logger=tb_logger,
+        log_every_n_steps=cfg.get('log_every_n_steps', 50),
+        num_sanity_val_steps=0,
+        precision=cfg.get('precision', '32-true'),
+        enable_checkpointing=False,
+        enable_progress_bar=False,
+        # Pre-training data is sharded by the data module, see train.py
+        use_distributed_sampler=not pretrain
+    )
+    trainer.fit(model, datamodule)
+    pck_20 = trainer.callback_metrics.get("val_PCK_20")
+
+    return dict(
+        val_PCK_20=float(pck_20) if pck_20 is not None else float("nan"),
+        wall_time_s=time.perf_counter() - start
+    )
+
+def main(args):
+    with open(args.config, 'r') as fid:
+        cfg = yaml.load(fid, yaml.SafeLoader)
+    with open(args.sweep, 'r') as fid:
+        sweep_cfg = yaml.load(fid, yaml.SafeLoader)
+    if args.lr is not None:
+        cfg['lr'] = args.lr
+    trials = grid_trials(sweep_cfg["grid"])
+    logs_dpath = os.path.join(os.getcwd(), 'logs', args.name)
+    os.makedirs(logs_dpath, exist_ok=True)
+    print(f"{len(trials)} trials, {args.num_parallel} at a time")
+    # Preprocessing runs once, trials only find the arrays already there
+    from train import build_datamodule
+    build_datamodule(cfg).prepare_data()
+    # Trial processes stay alive for the whole sweep
+    executor = ProcessPoolExecutor(
+        max_workers=args.num_parallel,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(args.num_parallel,)
+    )
+    results = [None] * len(trials)
+    with executor:
+        futures = {
+            executor.submit(
+                run_trial,
+                i,
+                apply_masking_args(cfg, trial),
+                args.epochs,
+                args.accelerator,
+                args.devices[i % len(args.devices)],
+                logs_dpath
+            ): i
+            for i, trial in enumerate(trials)
+        }
+        for future in as_completed(futures):
+            i = futures[future]
+            results[i] = dict(trial=i, **trials[i], **future.result())
+            print(results[i])
+    # Summary table, sorted by PCK@20
+    results = sorted(results, key=lambda r: r["val_PCK_20"], reverse=True)
+    summary_fpath = os.path.join(logs_dpath, 'summary.csv')
+    with open(summary_fpath, 'w', newline='') as fid:
+        fieldnames = ["trial", *sweep_cfg["grid"].keys(), "val_PCK_20", "wall_time_s"]
+        writer = csv.DictWriter(fid, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(results)
+    print(f"Summary written to {summary_fpath}")
+    for r in results:
+        print(" | ".join(f"{k}={v:.4f}" if isinstance(v, float) else f"{k}={v}" for k, v in r.items()))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--config', required=True, type=str)
+    parser.add_argument('--sweep', required=True, type=str)
+    parser.add_argument('--epochs', default=20, type=int)
+    parser.add_argument('--lr', default=None, type=float)
+    parser.add_argument('--name', default='sweep', type=str)
+    parser.add_argument('--num-parallel', default=1, type=int, help='Concurrent trials, host cores are split between them')
+    parser.add_argument('--accelerator', default='cpu', type=str, choices=['gpu', 'cpu'])
+    parser.add_argument('--devices', default=[0], nargs='+', type=int, help='GPUs trials are spread over')
+    args = parser.parse_args()
+
+    main(args)
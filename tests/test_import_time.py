@@ -0,0 +1,44 @@
+import os
+import sys
+import subprocess
+from importlib.util import find_spec
+
+import pytest
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from check_import_time import ENTRY_POINTS, HEAVY_MODULES, import_profile
+
+
+# Import time of an entry point, torch and lightning included
+BUDGET_MS = 4000.
+
+
+requires_deps = pytest.mark.skipif(
+    find_spec("torch") is None or find_spec("lightning") is None,
+    reason="torch and lightning are needed to import the entry points"
+)
+
+
+@requires_deps
+@pytest.mark.parametrize("statement", ENTRY_POINTS)
+def test_entry_point_import_time(statement):
+    # Best of a few runs, to filter out disk cache effects
+    elapsed_ms = min(import_profile(statement)[0] for _ in range(3)) / 1000
+    assert elapsed_ms <= BUDGET_MS, f"{statement} took {elapsed_ms:.1f} ms"
+
+
+@requires_deps
+@pytest.mark.parametrize("statement", ENTRY_POINTS)
+def test_entry_point_skips_heavy_modules(statement):
+    _, modules = import_profile(statement)
+    heavy = sorted(m for m in modules if m.split(".")[0] in HEAVY_MODULES)
+    assert not heavy, f"{statement} imports {heavy}"
+
+
+def test_import_profile_measures_statement():
+    total_us, modules = import_profile("from json import dumps")
+    assert total_us > 0
+    assert "json" in modules and "json.decoder" in modules
@@ -0,0 +1,51 @@
+import os
+import sys
+
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("lightning")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np
+
+from tiny_extractors import tiny_backbone
+from finetune.ISLR.Head import Head
+from finetune.ISLR.InferenceModel import InferenceModel
+
+
+BUCKETS = [32, 64]
+
+
+def run(model, skeletons, buckets=BUCKETS):
+    batch = model.collate([model.preprocess(s) for s in skeletons], buckets)
+    with torch.inference_mode():
+        return model(batch["arms"], batch["rhand"], batch["lhand"], batch["lengths"])
+
+
+@pytest.mark.parametrize("pe_batch_first", [True, False])
+@pytest.mark.parametrize("embed", [False, True])
+def test_file_output_does_not_depend_on_batch(pe_batch_first, embed):
+    backbone = tiny_backbone(pe_batch_first=pe_batch_first)
+    head = Head(backbone.config["d_model"], 5).eval()
+    model = InferenceModel("finetuned", backbone, head, embed=embed).eval()
+    rng = np.random.default_rng(0)
+    # Lengths of the same bucket
+    skeletons = [rng.random((t, 133, 2), dtype=np.float32) for t in (20, 27, 31, 18)]
+    alone = run(model, skeletons[:1])[0]
+    # Batch sizes 2 and 4, the file in another slot each time
+    pair = run(model, [skeletons[1], skeletons[0]])[1]
+    full = run(model, skeletons[::-1])[3]
+    torch.testing.assert_close(pair, alone, rtol=1e-5, atol=1e-5)
+    torch.testing.assert_close(full, alone, rtol=1e-5, atol=1e-5)
+
+
+def test_backbone_embedding_does_not_depend_on_batch():
+    model = InferenceModel("backbone", tiny_backbone()).eval()
+    rng = np.random.default_rng(1)
+    skeletons = [rng.random((t, 133, 2), dtype=np.float32) for t in (10, 30)]
+    alone = run(model, skeletons[:1])[0]
+    batched = run(model, skeletons)[0]
+    torch.testing.assert_close(batched, alone, rtol=1e-5, atol=1e-5)
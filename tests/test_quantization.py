@@ -0,0 +1,45 @@
+import os
+import sys
+
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("lightning")
+pytest.importorskip("torchmetrics")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import torch.nn as nn
+
+from tiny_extractors import tiny_backbone
+from finetune.ISLR.Head import Head
+from finetune.ISLR.quantization import quantize_model
+from signbert.model.graph_export import no_transformer_fastpath, example_inputs
+
+
+class TinyISLRModel(nn.Module):
+    """Stand-in of the finetuning `SignBertModel`, with its `model` and `head`."""
+    def __init__(self):
+        super().__init__()
+        self.model = tiny_backbone()
+        self.head = Head(self.model.config["d_model"], 5)
+
+    def forward(self, arms, rhand, lhand):
+        return self.head(*self.model.encode(arms, rhand, lhand))
+
+
+def test_quantized_model_runs_without_fastpath():
+    if not torch.backends.quantized.supported_engines:
+        pytest.skip("No quantized engine")
+    model = TinyISLRModel().eval()
+    arms, rhand, lhand = example_inputs(2, 12)
+    batches = [dict(arms=arms, rhand=rhand, lhand=lhand)]
+    quantized = quantize_model(model, batches)
+    # The transformer linear layers are replaced by dynamically quantized ones
+    assert not isinstance(quantized.model.te.layers[0].linear1, nn.Linear)
+    with torch.inference_mode(), no_transformer_fastpath():
+        expected = model(arms, rhand, lhand)
+        logits = quantized(arms, rhand, lhand)
+    assert logits.shape == expected.shape
+    assert torch.isfinite(logits).all()
@@ -0,0 +1,58 @@
+import os
+import sys
+
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("lightning")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np
+
+from tiny_extractors import tiny_backbone
+from finetune.ISLR.Head import Head
+from finetune.ISLR.InferenceModel import InferenceModel
+
+
+def inputs(N, T, seed=0):
+    generator = torch.Generator().manual_seed(seed)
+    return tuple(torch.rand((N, T, V, 2), generator=generator) for V in (6, 21, 21))
+
+
+def test_windowed_matches_full_below_one_window():
+    backbone = tiny_backbone()
+    arms, rhand, lhand = inputs(2, 40)
+    lengths = torch.tensor([40, 25])
+    with torch.inference_mode():
+        full = backbone.encode(arms, rhand, lhand, lengths)
+        windowed = backbone.encode_windowed(arms, rhand, lhand, window_size=64, overlap=16, lengths=lengths)
+    for f, w in zip(full, windowed):
+        torch.testing.assert_close(w, f)
+
+
+def test_windowed_long_sequence():
+    backbone = tiny_backbone()
+    arms, rhand, lhand = inputs(2, 150)
+    # The second sequence ends before the last window starts
+    lengths = torch.tensor([150, 60])
+    with torch.inference_mode():
+        outputs = backbone.encode_windowed(arms, rhand, lhand, window_size=64, overlap=16, lengths=lengths)
+    for o in outputs:
+        assert o.shape == (2, 150, backbone.config["d_model"])
+        assert torch.isfinite(o).all()
+
+
+def test_inference_model_windowed_matches_full_below_one_window():
+    backbone = tiny_backbone()
+    head = Head(backbone.config["d_model"], 5).eval()
+    full_model = InferenceModel("finetuned", backbone, head).eval()
+    windowed_model = InferenceModel("finetuned", backbone, head, window_size=64, overlap=16).eval()
+    rng = np.random.default_rng(0)
+    samples = [full_model.preprocess(rng.random((t, 133, 2), dtype=np.float32)) for t in (30, 50)]
+    batch = full_model.collate(samples, [64])
+    with torch.inference_mode():
+        full = full_model(batch["arms"], batch["rhand"], batch["lhand"], batch["lengths"])
+        windowed = windowed_model(batch["arms"], batch["rhand"], batch["lhand"], batch["lengths"])
+    torch.testing.assert_close(windowed, full)
@@ -0,0 +1,61 @@
+import torch
+import torch.nn as nn
+
+
+# Small stand-ins of the MSG3D and ST-GCN extractors, with the same output
+# layout and a finite temporal receptive field, so the backbone can be built
+# without the third-party submodules
+
+
+class TinyGestureExtractor(nn.Module):
+    """(N, T, 42, 2) hands keypoints to (N, C, T, 1, 1) per-hand features."""
+    def __init__(self, hid_dim, in_channels=2):
+        super().__init__()
+        self.proj = nn.Linear(21 * in_channels, hid_dim)
+        self.conv = nn.Conv1d(hid_dim, hid_dim, kernel_size=3, padding=1)
+
+    def _hand(self, x):
+        N, T = x.shape[:2]
+        x = self.proj(x.reshape(N, T, -1)).transpose(1, 2)
+
+        return torch.relu(self.conv(x)).unsqueeze(-1).unsqueeze(-1)
+
+    def forward(self, x):
+        return self._hand(x[:, :, :21]), self._hand(x[:, :, 21:])
+
+
+class TinyArmsExtractor(nn.Module):
+    """(N, T, 6, 2) arms keypoints to (N, C, T, 1, 1) per-arm features."""
+    def __init__(self, hid_dim, in_channels=2):
+        super().__init__()
+        self.proj = nn.Linear(3 * in_channels, hid_dim)
+        self.conv = nn.Conv1d(hid_dim, hid_dim, kernel_size=3, padding=1)
+
+    def _arm(self, x):
+        N, T = x.shape[:2]
+        x = self.proj(x.reshape(N, T, -1)).transpose(1, 2)
+
+        return self.conv(x).unsqueeze(-1).unsqueeze(-1)
+
+    def forward(self, x):
+        return self._arm(x[:, :, :3]), self._arm(x[:, :, 3:])
+
+
+def tiny_backbone(d_model=16, pe_batch_first=True, seed=0):
+    """Build a small backbone, in eval mode."""
+    from signbert.model.Backbone import Backbone
+
+    torch.manual_seed(seed)
+    backbone = Backbone(
+        gesture_extractor_cls=f"{__name__}.TinyGestureExtractor",
+        gesture_extractor_args=dict(hid_dim=d_model),
+        arms_extractor_cls=f"{__name__}.TinyArmsExtractor",
+        arms_extractor_args=dict(hid_dim=d_model),
+        d_model=d_model,
+        num_heads=2,
+        tformer_n_layers=2,
+        tformer_dropout=0.,
+        pe_batch_first=pe_batch_first,
+    )
+
+    return backbone.eval()
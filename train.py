@@ -13,12 +13,81 @@ from signbert.model.SignBertModelManoTorch import SignBertModel as SignBertModel
 from signbert.model.PretrainSignBertModelManoTorch import SignBertModel as PretrainSignBert
 from signbert.data_modules.HANDS17DataModule import HANDS17DataModule
 from signbert.data_modules.PretrainDataModule import PretrainDataModule
+from signbert.utils import get_trainer_config
 
-from IPython import embed; from sys import exit
 
 _DEBUG = False
 
 
+def build_datamodule(cfg):
+    """
+    Build the datamodule described by a training config.
+
+    Parameters:
+    cfg (dict): The training config.
+
+    Returns:
+    LightningDataModule: The datamodule.
+    """
+    batch_size = cfg['batch_size']
+    normalize = cfg['normalize']
+    if cfg.get("pretrain", False): # If pretraining is to be executed
+        datasets = cfg.get("datasets", None)
+        assert datasets is not None
+        return PretrainDataModule(
+            datasets,
+            batch_size=batch_size,
+            normalize=normalize,
+            mode=cfg.get("datamodule_mode", "sequential"),
+            num_workers=cfg.get("num_workers", 0),
+            seed=cfg.get("seed", 0),
+            val_subset_size=cfg.get("val_subset_size"),
+            full_val_every_n_epochs=cfg.get("full_val_every_n_epochs", 1)
+        )
+
+    return HANDS17DataModule(
+        batch_size=batch_size, 
+        normalize=normalize, 
+        **cfg.get('dataset_args', dict())
+    )
+
+def build_model(cfg, lr):
+    """
+    Build the model described by a training config.
+
+    Parameters:
+    cfg (dict): The training config.
+    lr (float): The learning rate.
+
+    Returns:
+    LightningModule: The model.
+    """
+    normalize = cfg['normalize']
+    log_every_n_steps = cfg.get('log_every_n_steps', 50)
+    if cfg.get("pretrain", False): # If pretraining is to be executed
+        return PretrainSignBert(
+            **cfg["model_args"],
+            lr=lr, 
+            normalize_inputs=normalize, 
+            compile_args=cfg.get('compile'),
+            log_every_n_steps=log_every_n_steps,
+            # Manual optimization, the model accumulates and clips gradients
+            accumulate_grad_batches=cfg.get('accumulate_grad_batches', 1),
+            gradient_clip_val=cfg.get('gradient_clip_val'),
+        )
+    mano_model_cls = SignBertModelManoTorch
+
+    return mano_model_cls(
+        **cfg['model_args'], 
+        lr=lr, 
+        normalize_inputs=normalize, 
+        means_fpath=HANDS17DataModule.MEANS_NPY_FPATH, 
+        stds_fpath=HANDS17DataModule.STDS_NPY_FPATH,
+        compile_args=cfg.get('compile'),
+        log_every_n_steps=log_every_n_steps,
+    )
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('--config', default=None, type=str)
@@ -28,6 +97,9 @@ if __name__ == '__main__':
     parser.add_argument('--lr', default=None, type=float)
     parser.add_argument('--name', default='test', type=str)
     parser.add_argument('--val-interval', default=None, type=int)
+    parser.add_argument('--accelerator', default=None, type=str, choices=['gpu', 'cpu'])
+    parser.add_argument('--num-processes', default=None, type=int, help='Processes per host, CPU only')
+    parser.add_argument('--num-nodes', default=None, type=int)
     args = parser.parse_args()
     # Load config 
     with open(args.config, 'r') as fid:
@@ -35,40 +107,11 @@ if __name__ == '__main__':
     pprint(cfg)
     epochs = args.epochs if args.epochs is not None else 600 
     lr = args.lr if args.lr is not None else cfg['lr'] # Preference over arguments
-    batch_size = cfg['batch_size']
-    normalize = cfg['normalize']
     pretrain = cfg.get("pretrain", False)
-    datasets = cfg.get("datasets", None)
-    if pretrain: # If pretraining is to be executed
-        assert datasets is not None
-        # Initialize datamodule
-        datamodule = PretrainDataModule(
-            datasets,
-            batch_size=batch_size,
-            normalize=normalize
-        )
-        # Initialize model
-        model = PretrainSignBert(
-            **cfg["model_args"],
-            lr=lr, 
-            normalize_inputs=normalize, 
-        )
-    else:
-        # Initialize datamodule
-        datamodule = HANDS17DataModule(
-            batch_size=batch_size, 
-            normalize=normalize, 
-            **cfg.get('dataset_args', dict())
-        )
-        # Initialize model
-        mano_model_cls = SignBertModelManoTorch
-        model = mano_model_cls(
-            **cfg['model_args'], 
-            lr=lr, 
-            normalize_inputs=normalize, 
-            means_fpath=HANDS17DataModule.MEANS_NPY_FPATH, 
-            stds_fpath=HANDS17DataModule.STDS_NPY_FPATH,
-        )
+    log_every_n_steps = cfg.get('log_every_n_steps', 50)
+    # Initialize datamodule and model
+    datamodule = build_datamodule(cfg)
+    model = build_model(cfg, lr)
     
     if _DEBUG: # Switch between trainer configs wheter debug is enabled
         trainer_config = dict(
@@ -82,12 +125,14 @@ if __name__ == '__main__':
                 n_parameters += p.numel()
         print('# params:', n_parameters)
     else:
-        trainer_config = dict(
-            accelerator='gpu',
-            strategy='auto',
+        # On CPU, several processes (per host) run data parallel over gloo
+        trainer_config = get_trainer_config(
+            accelerator=args.accelerator or cfg.get('accelerator', 'gpu'),
             devices=[args.device],
-            max_epochs=epochs
+            num_processes=args.num_processes or cfg.get('num_processes', 1),
+            num_nodes=args.num_nodes or cfg.get('num_nodes', 1),
         )
+        trainer_config['max_epochs'] = epochs
 
     if args.ckpt: # Check if training shall be resumed from checkpoint
         print('Resuming training from ckpt:', args.ckpt)
@@ -99,17 +144,28 @@ if __name__ == '__main__':
     # Initialize model checkpointing callback
     ckpt_dirpath = os.path.join(tb_logger.log_dir, 'ckpts')
     checkpoint_callback = ModelCheckpoint(dirpath=ckpt_dirpath, save_top_k=10, monitor="val_PCK_20", mode='max', filename="epoch={epoch:02d}-step={step}-{val_PCK_20:.4f}", save_last=True)
+    callbacks = [lr_logger, checkpoint_callback]
+    ckpt_every_n_train_steps = cfg.get('ckpt_every_n_train_steps')
+    if ckpt_every_n_train_steps: # Periodic checkpoint to resume from mid-epoch
+        callbacks.append(ModelCheckpoint(dirpath=ckpt_dirpath, filename="resume", every_n_train_steps=ckpt_every_n_train_steps, save_top_k=1))
     # Initialize early stopping callback
     early_stopping_callback = EarlyStopping(monitor="val_PCK_20", mode="max", patience=30, min_delta=1e-4)
     # Setup and configure the Trainer 
     trainer = Trainer(
         **trainer_config,
-        accumulate_grad_batches=cfg.get('accumulate_grad_batches', 1), 
+        accumulate_grad_batches=1 if pretrain else cfg.get('accumulate_grad_batches', 1), 
+        gradient_clip_val=None if pretrain else cfg.get('gradient_clip_val'),
         logger=tb_logger, 
-        callbacks=[lr_logger, checkpoint_callback],#, early_stopping_callback],
-        log_every_n_steps=1,
+        callbacks=callbacks,#, early_stopping_callback],
+        log_every_n_steps=log_every_n_steps,
         num_sanity_val_steps=0,
         precision=cfg.get('precision', '32-true'),
-        check_val_every_n_epoch=args.val_interval
+        # Validation every `val_check_interval` training batches if set,
+        # otherwise every `--val-interval` epochs
+        val_check_interval=cfg.get('val_check_interval'),
+        check_val_every_n_epoch=None if cfg.get('val_check_interval') else args.val_interval,
+        # Pre-training samplers shard the data themselves, so they can resume
+        # mid-epoch, and the data module shards the validation loaders
+        use_distributed_sampler=not pretrain
     )
     trainer.fit(model, datamodule, ckpt_path=args.ckpt) # Start trainig
\ No newline at end of file
@@ -4,20 +4,7 @@ import subprocess
 import cv2
 import torch
 import numpy as np
-import pandas as pd
-from pytorch3d.structures import Meshes
-from pytorch3d.renderer import (
-    PerspectiveCameras,
-    RasterizationSettings,
-    MeshRasterizer,
-    SoftPhongShader,
-    TexturesVertex,
-    MeshRendererWithFragments,
-    PointLights,
-)
-from pytorch3d.transforms import RotateAxisAngle
-
-from IPython import embed; from sys import exit
+
 
 def create_viz(out_fpath, verts, Rs, Ss, Ts, means, stds, faces, bg, device='cuda:0', comment={}):
 
@@ -39,6 +26,18 @@ def create_viz(out_fpath, verts, Rs, Ss, Ts, means, stds, faces, bg, device='cud
             fx = 475.065948;
             fy = 475.065857;
     """
+    # pytorch3d is slow to import, it is only needed for rendering
+    from pytorch3d.structures import Meshes
+    from pytorch3d.renderer import (
+        PerspectiveCameras,
+        RasterizationSettings,
+        MeshRasterizer,
+        SoftPhongShader,
+        TexturesVertex,
+        MeshRendererWithFragments,
+        PointLights,
+    )
+    from pytorch3d.transforms import RotateAxisAngle
 
     device = torch.device(device)
     N = verts.shape[0]
@@ -135,6 +134,9 @@ def create_viz(out_fpath, verts, Rs, Ss, Ts, means, stds, faces, bg, device='cud
         os.rename(tmp_fpath, out_fpath)
 
 if __name__ == "__main__":
+
+    import pandas as pd
+
     MAX_FRAMES = 250
     out_fpath = "./video_id_1.mp4" 
     c_r =  torch.from_numpy(np.load("./R_video_id_1.npy"))